@@ -4,15 +4,35 @@ import json
 from datetime import datetime
 
 
-from components.node_manager import add_root_node, delete_node, add_child, add_sibling, add_spouse, edit_node, add_same_level
+from components.node_manager import add_root_node, delete_node, add_child, add_sibling, add_spouse, edit_node, add_same_level, toggle_collapsed
 from utils.data_handler import initialize_tree, format_date_range
-from utils.export_handler import export_to_json, export_to_pdf
-from utils.storage_handler import save_to_browser, load_from_browser, clear_browser_storage
+from utils.export_handler import EXPORT_FORMATS, tree_fingerprint, start_export
+from utils.gedcom_handler import read_gedcom
+from utils.storage_handler import save_to_browser, load_from_browser, clear_browser_storage, has_newer_save, is_workspace_id, new_workspace_id, expire_workspaces
+from utils.tree_model import FamilyTree, mark_changed
+from components.layout_manager import settle_layout, position_changed
+from utils.photo_store import migrate_photos
+from utils.tree_file import load_tree
 
 
 st.set_page_config(page_title="Family Tree Maker", layout="wide")
 
 
+# Each session saves to its own workspace, named in the URL so a reload
+# (or a shared link) opens the same tree. An empty id (?workspace=) opens
+# the default workspace, which holds the tree saved before workspaces
+# (its old cache is converted on load).
+if 'workspace' not in st.session_state:
+    workspace = st.query_params.get('workspace')
+    if workspace == '':
+        workspace = None
+    elif not is_workspace_id(workspace):
+        workspace = new_workspace_id()
+        st.query_params['workspace'] = workspace
+    st.session_state.workspace = workspace
+    expire_workspaces()
+
+
 # Initialize
 if 'tree_data' not in st.session_state:
     st.session_state.tree_data = initialize_tree()
@@ -22,14 +42,42 @@ if 'tree_data' not in st.session_state:
 # Load from browser storage ONCE on first run
 if not st.session_state.loaded_from_storage:
     try:
-        loaded_data = load_from_browser()
+        loaded_data = load_from_browser(st.session_state.workspace)
         if loaded_data and 'nodes' in loaded_data and 'edges' in loaded_data:
             st.session_state.tree_data = loaded_data
+            # Trees saved before the photo store embed photos as base64
+            if migrate_photos(st.session_state.tree_data):
+                mark_changed(st.session_state.tree_data, reason='import')
+                save_to_browser(st.session_state.tree_data, st.session_state.workspace)
     except:
         pass
     st.session_state.loaded_from_storage = True
 
 
+# Edits that moved too much of the tree to re-layout locally leave one
+# full layout for the next run
+if settle_layout(st.session_state.tree_data):
+    save_to_browser(st.session_state.tree_data, st.session_state.workspace)
+
+
+# Someone else saved the workspace since this session loaded it: saves from
+# here are refused until the session takes their tree or keeps its own
+if has_newer_save(st.session_state.tree_data, st.session_state.workspace):
+    st.warning("⚠ This workspace was saved from another session since you opened it, "
+               "so your changes are not being saved.")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Load their tree", help="Drop your unsaved changes", use_container_width=True):
+            st.session_state.tree_data = initialize_tree()
+            st.session_state.loaded_from_storage = False
+            st.session_state.selected_node = None
+            st.rerun()
+    with col2:
+        if st.button("Keep mine", help="Save your tree over theirs", use_container_width=True):
+            save_to_browser(st.session_state.tree_data, st.session_state.workspace, force=True)
+            st.rerun()
+
+
 if 'selected_node' not in st.session_state:
     st.session_state.selected_node = None
 if 'mode' not in st.session_state:
@@ -45,6 +93,10 @@ if 'highlighted_edges' not in st.session_state:
 if 'highlighted_node' not in st.session_state:
     st.session_state.highlighted_node = None
 
+# Exports built on request: format -> {'version': tree fingerprint, 'future': ...}
+if 'exports' not in st.session_state:
+    st.session_state.exports = {}
+
 
 # Custom CSS - iOS Dark Mode (Refined + Fixed)
 st.markdown("""
@@ -460,13 +512,43 @@ def reset_form():
     st.session_state.form_counter += 1
 
 
+# Export button: builds the export in the background when clicked, then
+# offers the download for as long as the tree stays unchanged
+def export_button(export_format, tree_version):
+    _, extension, mime = EXPORT_FORMATS[export_format]
+    job = st.session_state.exports.get(export_format)
+    
+    if job and job['version'] == tree_version and job['future'].done():
+        if job['future'].exception():
+            st.error(f"{export_format} export failed: {job['future'].exception()}")
+            del st.session_state.exports[export_format]
+            return
+        st.download_button(
+            f"⬇ {export_format}",
+            data=job['future'].result(),
+            file_name=f"tree_{datetime.now().strftime('%Y%m%d')}.{extension}",
+            mime=mime,
+            use_container_width=True,
+            key=f"download_{export_format}"
+        )
+    elif job and job['version'] == tree_version:
+        st.button("…", disabled=True, use_container_width=True, key=f"building_{export_format}")
+    elif st.button(export_format, help=f"Build the {export_format} export", use_container_width=True,
+                   key=f"prepare_{export_format}"):
+        st.session_state.exports[export_format] = {
+            'version': tree_version,
+            'future': start_export(export_format, st.session_state.tree_data)
+        }
+        st.rerun()
+
+
 # ==================== SEARCH DIALOG (REMOVABLE BLOCK START) ====================
 # DELETE THIS ENTIRE BLOCK TO REMOVE SEARCH FEATURE
 
 # Search Dialog
 @st.dialog("Search Family Tree", width="large")
 def search_dialog():
-    from utils.search_handler import search_nodes, find_path_to_node
+    from utils.storage_handler import search_workspace, find_path_in_workspace
     
     query = st.text_input(
         "Search for family member...", 
@@ -477,7 +559,7 @@ def search_dialog():
     
     # Real-time filtering - starts from 1 character
     if query:
-        results = search_nodes(st.session_state.tree_data, query)
+        results = search_workspace(st.session_state.tree_data, query, st.session_state.workspace)
         
         if results:
             st.write(f"**Found {len(results)} result(s):**")
@@ -492,7 +574,8 @@ def search_dialog():
                     with col2:
                         if st.button("View", key=f"view_{result['id']}", use_container_width=True):
                             # Find path and highlight
-                            path_edges = find_path_to_node(st.session_state.tree_data, result['id'])
+                            path_edges = find_path_in_workspace(st.session_state.tree_data, result['id'],
+                                                                st.session_state.workspace)
                             st.session_state.highlighted_edges = path_edges
                             st.session_state.selected_node = result['id']
                             st.session_state.highlighted_node = result['id']
@@ -512,9 +595,32 @@ with st.sidebar:
     st.header("Controls")
     
     # Import JSON
-    uploaded_file = st.file_uploader("Import Tree (JSON)", type=['json'], key=f"upload_{st.session_state.form_counter}")
-    if uploaded_file:
+    uploaded_file = st.file_uploader("Import Tree (JSON, GEDCOM or FTREE)", type=['json', 'ged', 'ftree'], key=f"upload_{st.session_state.form_counter}")
+    if uploaded_file and uploaded_file.name.lower().endswith('.ftree'):
+        try:
+            st.session_state.tree_data = load_tree(uploaded_file.getvalue())
+        except ValueError as e:
+            st.error(f"Could not import: {e}")
+        else:
+            save_to_browser(st.session_state.tree_data, st.session_state.workspace)
+            st.success("Tree imported!")
+            reset_form()
+            st.rerun()
+    elif uploaded_file and uploaded_file.name.lower().endswith('.ged'):
+        try:
+            imported_tree, stats = read_gedcom(uploaded_file)
+        except ValueError as e:
+            st.error(f"Could not import: {e}")
+        else:
+            st.session_state.tree_data = imported_tree
+            save_to_browser(st.session_state.tree_data, st.session_state.workspace)
+            st.success(f"GEDCOM imported: {stats['people']} people, {stats['families']} families "
+                       f"({stats['records_per_second']:,.0f} records/s)")
+            reset_form()
+            st.rerun()
+    elif uploaded_file:
         imported_data = json.load(uploaded_file)
+        migrate_photos(imported_data)
         
         # Preserve positions and fixed flags if they exist
         for node in imported_data.get('nodes', []):
@@ -527,8 +633,8 @@ with st.sidebar:
             if 'fixed' not in node:
                 node['fixed'] = False
         
-        st.session_state.tree_data = imported_data
-        save_to_browser(st.session_state.tree_data)
+        st.session_state.tree_data = FamilyTree(imported_data)
+        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
         st.success("Tree imported!")
         reset_form()
         st.rerun()
@@ -537,50 +643,73 @@ with st.sidebar:
     
     # Export options
     st.subheader("Export Options")
-    col1, col2 = st.columns(2)
+    tree_versions = {export_format: tree_fingerprint(st.session_state.tree_data, export_format)
+                     for export_format in EXPORT_FORMATS}
+    for column, export_format in zip(st.columns(4), ['JSON', 'PDF', 'GEDCOM', 'FTREE']):
+        with column:
+            export_button(export_format, tree_versions[export_format])
     
-    with col1:
-        json_data = export_to_json(st.session_state.tree_data)
-        st.download_button(
-            "JSON",
-            data=json_data,
-            file_name=f"tree_{datetime.now().strftime('%Y%m%d')}.json",
-            mime="application/json",
-            use_container_width=True
-        )
-    
-    with col2:
-        pdf_bytes = export_to_pdf(st.session_state.tree_data)
-        st.download_button(
-            "PDF",
-            data=pdf_bytes,
-            file_name=f"tree_{datetime.now().strftime('%Y%m%d')}.pdf",
-            mime="application/pdf",
-            use_container_width=True,
-        )
+    if any(job['version'] == tree_versions[export_format] and not job['future'].done()
+           for export_format, job in st.session_state.exports.items()):
+        st.caption("Building export…")
+        if st.button("Refresh", use_container_width=True):
+            st.rerun()
     
     st.divider()
     
     # Layout control
-    if st.button("Reset Layout", help="Reset to automatic hierarchical layout", use_container_width=True):
-        from components.layout_manager import apply_hierarchical_layout
-        
+    from components.layout_manager import LAYOUT_ENGINES
+    
+    layout_style = st.selectbox(
+        "Layout Style",
+        options=list(LAYOUT_ENGINES.keys()),
+        key="layout_style",
+        help="Hierarchical packs each generation left to right; Tidy tree centers every family under its parents"
+    )
+    
+    if st.button("Reset Layout", help="Reset to automatic layout using the selected style", use_container_width=True):
         # Unfix all nodes before layout
+        unfixed = []
         for node in st.session_state.tree_data['nodes']:
+            if node.get('fixed'):
+                unfixed.append(node['id'])
             if 'fixed' in node:
                 node['fixed'] = False
+        if unfixed:
+            mark_changed(st.session_state.tree_data, unfixed, reason='layout')
         
-        apply_hierarchical_layout(st.session_state.tree_data)
-        save_to_browser(st.session_state.tree_data)
-        st.success("✓ Layout reset!")
-        st.rerun()
+        cycle_ids = LAYOUT_ENGINES[layout_style](st.session_state.tree_data)
+        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
+        if cycle_ids:
+            # Stay on this run so the warning is visible
+            st.warning(f"⚠ Layout reset, but {len(cycle_ids)} node(s) are part of a parent/child loop")
+        else:
+            st.success("✓ Layout reset!")
+            st.rerun()
     
     if st.button("Clear Browser Cache", help="Clear saved tree from browser", use_container_width=True):
-        clear_browser_storage()
+        clear_browser_storage(st.session_state.workspace)
         st.session_state.tree_data = initialize_tree()
         st.success("✓ Cache cleared!")
         st.rerun()
     
+    # Another workspace id opens (or starts) another tree; none is the default one
+    workspace = st.text_input("Workspace", value=st.session_state.workspace or '',
+                              help="Trees are saved per workspace: enter another id to open or start another tree, "
+                                   "or leave it empty for the default one (trees saved before workspaces)")
+    workspace = workspace.strip() or None
+    if workspace != st.session_state.workspace:
+        if workspace is None or is_workspace_id(workspace):
+            st.query_params['workspace'] = workspace or ''
+            st.session_state.workspace = workspace
+            st.session_state.tree_data = initialize_tree()
+            st.session_state.loaded_from_storage = False
+            st.session_state.selected_node = None
+            st.session_state.highlight_path = False
+            st.rerun()
+        else:
+            st.error("A workspace id is up to 64 letters, digits, '-' or '_'")
+    
     # st.info("💡 **Tip:** Enter year (e.g., 1960) or full date (1960-05-15)")
     
     st.divider()
@@ -633,8 +762,7 @@ with st.sidebar:
         st.session_state.selected_node = selected_id
         
         # Get selected node data
-        selected_node_data = next((n for n in st.session_state.tree_data['nodes'] 
-                                  if n['id'] == st.session_state.selected_node), None)
+        selected_node_data = st.session_state.tree_data.node(st.session_state.selected_node)
         
         st.divider()
         
@@ -711,7 +839,9 @@ with st.sidebar:
                     selected_node_data['x'] = fine_x
                     selected_node_data['y'] = fine_y
                     selected_node_data['fixed'] = True
-                    save_to_browser(st.session_state.tree_data)
+                    position_changed(st.session_state.tree_data, selected_node_data['id'])
+                    mark_changed(st.session_state.tree_data, [selected_node_data['id']], reason='layout')
+                    save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                     st.success("✓ Position updated!")
                     st.rerun()
             
@@ -727,16 +857,25 @@ with st.sidebar:
                     if new_x != current_x:
                         selected_node_data['x'] = new_x
                         selected_node_data['fixed'] = True
+                        position_changed(st.session_state.tree_data, selected_node_data['id'])
+                        mark_changed(st.session_state.tree_data, [selected_node_data['id']], reason='layout')
                     
-                    save_to_browser(st.session_state.tree_data)
+                    save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                     st.success(f"✓ Updated {edit_name}!")
                     st.rerun()
             
+            is_collapsed = st.session_state.selected_node in st.session_state.tree_data.get('collapsed', [])
+            if st.button("Expand Branch" if is_collapsed else "Collapse Branch", use_container_width=True,
+                        help="Hide or show everyone descended from this person in the graph"):
+                toggle_collapsed(st.session_state.tree_data, st.session_state.selected_node)
+                save_to_browser(st.session_state.tree_data, st.session_state.workspace)
+                st.rerun()
+            
             if st.button("Delete This Node", use_container_width=True):
                 node_name = selected_node_data['name']
                 delete_node(st.session_state.tree_data, st.session_state.selected_node)
                 st.session_state.selected_node = None
-                save_to_browser(st.session_state.tree_data)
+                save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                 st.success(f"✓ Deleted {node_name}!")
                 st.rerun()
         
@@ -770,7 +909,7 @@ with st.sidebar:
                     if add_name and st.session_state.selected_node:
                         add_child(st.session_state.tree_data, st.session_state.selected_node, 
                                 add_name, add_birth, add_death, add_photo)
-                        save_to_browser(st.session_state.tree_data)
+                        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                         st.success(f"✓ Added child {add_name}!")
                         reset_form()
                         st.rerun()
@@ -782,7 +921,7 @@ with st.sidebar:
                     if add_name and st.session_state.selected_node:
                         add_sibling(st.session_state.tree_data, st.session_state.selected_node, 
                                 add_name, add_birth, add_death, add_photo)
-                        save_to_browser(st.session_state.tree_data)
+                        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                         st.success(f"✓ Added sibling {add_name}!")
                         reset_form()
                         st.rerun()
@@ -797,7 +936,7 @@ with st.sidebar:
                     if add_name and st.session_state.selected_node:
                         add_spouse(st.session_state.tree_data, st.session_state.selected_node, 
                                 add_name, add_birth, add_death, add_photo)
-                        save_to_browser(st.session_state.tree_data)
+                        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                         st.success(f"✓ Added spouse {add_name}!")
                         reset_form()
                         st.rerun()
@@ -809,7 +948,7 @@ with st.sidebar:
                     if add_name and st.session_state.selected_node:
                         add_same_level(st.session_state.tree_data, st.session_state.selected_node, 
                                     add_name, add_birth, add_death, add_photo)
-                        save_to_browser(st.session_state.tree_data)
+                        save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                         st.success(f"✓ Added {add_name} at same level!")
                         reset_form()
                         st.rerun()
@@ -840,7 +979,7 @@ with st.sidebar:
         if st.button("Add Root Node", use_container_width=True):
             if root_name:
                 add_root_node(st.session_state.tree_data, root_name, root_birth, root_death, root_photo)
-                save_to_browser(st.session_state.tree_data)
+                save_to_browser(st.session_state.tree_data, st.session_state.workspace)
                 st.success(f"✓ Added {root_name}!")
                 reset_form()
                 st.rerun()
@@ -869,17 +1008,34 @@ with col_clear:
 
     
 if st.session_state.tree_data['nodes']:
-    from components.graph_renderer import render_tree_graph
+    from components.graph_renderer import render_tree_graph, VIEWPORT_MIN_NODES
     
     # Pass highlighted edges and node if search is active
     highlighted_edges = st.session_state.highlighted_edges if st.session_state.get('highlight_path') else []
     highlighted_node = st.session_state.highlighted_node if st.session_state.get('highlight_path') else None
     
+    # Large trees only draw the part around the selected person (or the
+    # first person); selecting someone else moves the view there
+    viewport = None
+    if len(st.session_state.tree_data['nodes']) > VIEWPORT_MIN_NODES:
+        tree = st.session_state.tree_data
+        focus = tree.node(st.session_state.selected_node) if st.session_state.selected_node else None
+        focus = focus or tree['nodes'][0]
+        view_width = st.select_slider(
+            "View width",
+            options=[1500, 3000, 6000, 12000, 24000, 48000],
+            value=3000,
+            key="view_width",
+            help="How much of the tree to draw around the selected person; wide views draw people as dots"
+        )
+        viewport = (focus.get('x', 0), focus.get('y', 0), view_width, view_width / 2)
+    
     return_value = render_tree_graph(
         st.session_state.tree_data,
         selected_id=st.session_state.selected_node,
         highlighted_edges=highlighted_edges,
-        highlighted_node=highlighted_node
+        highlighted_node=highlighted_node,
+        viewport=viewport
     )
 
 else:
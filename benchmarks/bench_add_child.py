@@ -0,0 +1,134 @@
+"""
+Regression benchmark for add_child.
+
+Grows a tree one add_child call at a time (each child under a random
+person, as when entering a family by hand) and times every block of
+calls. Every edit is followed by settle_layout(), as the app does before
+showing the tree, so any full layout an edit asks for, and moving the
+families it pushed aside, is paid for there. Each call re-lays out the
+new child's family and reads the families beside it through their kept
+rows, so once the tree has filled out a little a block of children costs
+about the same however big the tree already is: with 10000 children,
+blocks of 1000 take 0.5-0.6 s at first and level off at 0.8-1.1 s (under
+1 ms per child overall), with no full layouts. The second half's blocks
+must average at most LATE_MAX_RATIO times the first half's. The old
+rebalancing pass (which scanned every node and edge for each child
+added) keeps climbing with the tree: 35 ms per child by 2000 children.
+
+    python -m benchmarks.bench_add_child [--children N] [--block N] [--legacy-limit N]
+"""
+import argparse
+import random
+import time
+
+from components.layout_manager import settle_layout
+from components.node_manager import add_root_node, add_child, add_spouse
+from utils.data_handler import initialize_tree
+
+# The second half's blocks may take at most this many times as long, on
+# average, as the first half's (bar the first block, grown from one person)
+LATE_MAX_RATIO = 1.5
+
+
+def legacy_rebalance(tree_data, parent_id):
+    """Previous add_child rebalancing: every node x every edge x every edge"""
+    parent = next((n for n in tree_data['nodes'] if n['id'] == parent_id), None)
+    all_children = []
+    for node in tree_data['nodes']:
+        if node.get('type') == 'person' and node.get('level') == parent['level'] + 1:
+            for edge in tree_data['edges']:
+                if edge.get('type') == 'child_to_parent' and edge['source'] == node['id']:
+                    target = edge['target']
+                    if target == parent_id:
+                        all_children.append(node)
+                        break
+                    else:
+                        for p_edge in tree_data['edges']:
+                            if (p_edge.get('type') == 'parent_to_junction' and
+                                p_edge['source'] == parent_id and
+                                p_edge['target'] == target):
+                                all_children.append(node)
+                                break
+                        break
+
+    num_children = len(all_children)
+    for i, child in enumerate(all_children):
+        offset = (i - num_children / 2 + 0.5) * 200
+        child['x'] = parent.get('x', 0) + offset
+        child['y'] = parent.get('y', 0) + 150
+
+
+def grow_tree(num_children, block, seed=0, marry_rate=0.3, rebalance=None):
+    """
+    Add num_children children one by one, settling the layout after every
+    edit; returns (seconds, full layouts) per block.
+    rebalance(tree_data, parent_id) runs after every add_child if given.
+    """
+    rng = random.Random(seed)
+    tree_data = initialize_tree()
+    add_root_node(tree_data, 'Root', '', '', None)
+    people = [tree_data['nodes'][0]['id']]
+
+    timings = []
+    full_layouts = 0
+    start = time.perf_counter()
+    for i in range(1, num_children + 1):
+        parent_id = rng.choice(people)
+        child_id = tree_data.next_id('person')
+        add_child(tree_data, parent_id, f"Child {i}", '', '', None)
+        if rebalance:
+            rebalance(tree_data, parent_id)
+        full_layouts += tree_data.layout_pending
+        settle_layout(tree_data)
+        people.append(child_id)
+
+        # Some children marry, so later children also go through junctions
+        if rng.random() < marry_rate:
+            add_spouse(tree_data, people[-1], f"Spouse {i}", '', '', None)
+            full_layouts += tree_data.layout_pending
+            settle_layout(tree_data)
+
+        if i % block == 0:
+            now = time.perf_counter()
+            timings.append((now - start, full_layouts))
+            start = now
+            full_layouts = 0
+    return timings
+
+
+def report(title, timings, block):
+    print(title)
+    print(f"{'children':>9} {'block (s)':>10} {'total (s)':>10} {'avg per child (ms)':>19} {'full layouts':>13}")
+    total = 0.0
+    for i, (elapsed, full_layouts) in enumerate(timings, 1):
+        total += elapsed
+        print(f"{i * block:>9} {elapsed:10.3f} {total:10.3f} {total / (i * block) * 1000:19.3f} {full_layouts:13}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--children', type=int, default=10000)
+    parser.add_argument('--block', type=int, default=1000)
+    parser.add_argument('--legacy-limit', type=int, default=2000,
+                        help="children to grow with the old rebalancing pass (it is cubic); 0 to skip")
+    args = parser.parse_args()
+
+    timings = grow_tree(args.children, args.block)
+    report("add_child", timings, args.block)
+    half = len(timings) // 2
+    if half > 1:
+        early = sum(elapsed for elapsed, _ in timings[1:half]) / (half - 1)
+        late = sum(elapsed for elapsed, _ in timings[half:]) / (len(timings) - half)
+        print(f"late blocks / early blocks: {late / early:.2f}x\n")
+        assert late <= LATE_MAX_RATIO * early, \
+            f"per-child cost grows with the tree: late blocks take {late / early:.1f}x the early ones"
+
+    if args.legacy_limit:
+        legacy_block = min(args.block, args.legacy_limit)
+        report("add_child + old rebalancing pass",
+               grow_tree(args.legacy_limit, legacy_block, rebalance=legacy_rebalance), legacy_block)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Bulk load benchmark.
+
+Streams the people and parent / spouse relations of a synthetic lineage
+into bulk_load and times building the tree plus its one layout.
+
+    python -m benchmarks.bench_bulk_load [--sizes N ...]
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import make_synthetic_tree, count_people
+from utils.bulk_loader import bulk_load
+
+
+def as_streams(tree_data):
+    """(people, relations) generators describing a tree dict, as another system would export it"""
+    nodes, edges = tree_data['nodes'], tree_data['edges']
+    junction_parents = {}
+    for edge in edges:
+        if edge['type'] == 'parent_to_junction':
+            junction_parents.setdefault(edge['target'], []).append(edge['source'])
+
+    def people():
+        for node in nodes:
+            if node['type'] == 'person':
+                yield {'id': node['id'], 'name': node['name'], 'birth_date': node['birth_date']}
+
+    def relations():
+        for parent_ids in junction_parents.values():
+            yield ('spouse', parent_ids[0], parent_ids[1])
+        for edge in edges:
+            if edge['type'] == 'child_to_parent':
+                for parent_id in junction_parents.get(edge['target'], [edge['target']]):
+                    yield ('parent', parent_id, edge['source'])
+
+    return people(), relations()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    args = parser.parse_args()
+
+    print(f"{'people':>8} {'edges':>8} {'load + layout (s)':>18} {'people/s':>10}")
+    for size in args.sizes:
+        people, relations = as_streams(make_synthetic_tree(size, seed=size))
+        start = time.perf_counter()
+        tree = bulk_load(people, relations)
+        elapsed = time.perf_counter() - start
+        print(f"{count_people(tree):>8} {len(tree['edges']):>8} {elapsed:18.3f} {size / elapsed:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark for the circular avatar mask used by the PDF export.
+
+Times apply_circle_mask (one Pillow composite against a mask cached per
+size) against the old per-pixel loop (a sqrt and a putpixel for every
+pixel), then the whole create_circular_image call per avatar.
+
+    python -m benchmarks.bench_circle_mask [--sizes 70 84 140] [--repeat N]
+"""
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from utils.pdf_renderer import apply_circle_mask, create_circular_image
+from utils.photo_store import PHOTO_VARIANTS
+
+
+def legacy_circle_mask(img, size):
+    """Previous masking: Python double loop over every pixel"""
+    output = Image.new('RGB', (size, size), (255, 255, 255))
+    output.paste(img, (0, 0))
+    for x in range(size):
+        for y in range(size):
+            dist = ((x - size/2)**2 + (y - size/2)**2)**0.5
+            if dist > size/2:
+                output.putpixel((x, y), (255, 255, 255))
+    return output
+
+
+def sample_photo(side=PHOTO_VARIANTS['print']):
+    """JPEG bytes of a gradient image the size of a print derivative"""
+    img = Image.linear_gradient('L').resize((side, side)).convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def per_call(func, repeat):
+    """Average seconds per call over repeat calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[70, 84, 140])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    photo = sample_photo()
+    print(f"{'size':>5} {'old mask (us)':>14} {'new mask (us)':>14} {'speedup':>8} {'full avatar (ms)':>17}")
+    for size in args.sizes:
+        img = Image.open(io.BytesIO(photo)).convert('RGB').resize((size, size))
+        apply_circle_mask(img, size)  # build the cached mask outside the timing
+
+        legacy = per_call(lambda: legacy_circle_mask(img, size), max(1, args.repeat // 10))
+        masked = per_call(lambda: apply_circle_mask(img, size), args.repeat)
+
+        full = per_call(lambda: create_circular_image(photo, size), max(1, args.repeat // 10))
+
+        print(f"{size:>5} {legacy * 1e6:14.1f} {masked * 1e6:14.1f} {legacy / masked:7.0f}x {full * 1000:17.2f}")
+
+
+if __name__ == '__main__':
+    main()
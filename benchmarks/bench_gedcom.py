@@ -0,0 +1,45 @@
+"""
+GEDCOM throughput benchmark.
+
+Writes a synthetic lineage to a temporary .ged file with write_gedcom,
+reads it back with read_gedcom and reports records per second both ways.
+
+    python -m benchmarks.bench_gedcom [--sizes N ...]
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.synthetic import make_synthetic_tree, count_people
+from utils.gedcom_handler import read_gedcom, write_gedcom
+
+
+def child_links(tree_data):
+    """Number of child -> parent / junction links"""
+    return sum(1 for e in tree_data['edges'] if e['type'] == 'child_to_parent')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    args = parser.parse_args()
+
+    print(f"{'people':>8} {'records':>8} {'size (MB)':>10} {'write rec/s':>12} {'read rec/s':>12}")
+    for size in args.sizes:
+        tree_data = make_synthetic_tree(size, seed=size)
+        fd, path = tempfile.mkstemp(suffix='.ged')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as out:
+                written = write_gedcom(tree_data, out)
+            tree, read = read_gedcom(path)
+            assert count_people(tree) == count_people(tree_data), "people lost in the round trip"
+            assert child_links(tree) == child_links(tree_data), "parent links lost in the round trip"
+            megabytes = os.path.getsize(path) / 1e6
+        finally:
+            os.remove(path)
+        print(f"{size:>8} {written['records']:>8} {megabytes:10.1f} "
+              f"{written['records_per_second']:12.0f} {read['records_per_second']:12.0f}")
+
+
+if __name__ == '__main__':
+    main()
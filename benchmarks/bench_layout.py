@@ -0,0 +1,171 @@
+"""
+Layout benchmarks for "Reset Layout".
+
+Times find_couples + find_junction_between over every level, using the
+precomputed spouse / couple -> junction maps, against the old per-node
+edge scans they replaced; then times each full layout engine on a
+FamilyTree, as the app holds a loaded tree.
+
+    python -m benchmarks.bench_layout [--legacy-limit N]
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import make_synthetic_tree, count_people
+from components.layout_manager import assign_levels, build_couple_maps, find_couples, find_junction_between, LAYOUT_ENGINES
+from utils.tree_model import FamilyTree
+
+
+def legacy_find_couples(level_nodes, edges):
+    """Previous find_couples: scans every edge for every node"""
+    couples = []
+    paired = set()
+
+    for node in level_nodes:
+        if node['id'] in paired:
+            continue
+
+        spouse_edge = next((e for e in edges
+                          if (e['source'] == node['id'] or e['target'] == node['id'])
+                          and e.get('type') == 'spouse'), None)
+
+        if spouse_edge:
+            spouse_id = spouse_edge['target'] if spouse_edge['source'] == node['id'] else spouse_edge['source']
+            spouse_node = next((n for n in level_nodes if n['id'] == spouse_id), None)
+            if spouse_node:
+                couples.append([node, spouse_node])
+                paired.add(node['id'])
+                paired.add(spouse_id)
+            else:
+                couples.append([node])
+                paired.add(node['id'])
+        else:
+            junction_edge = next((e for e in edges
+                                if e['source'] == node['id']
+                                and e.get('type') == 'parent_to_junction'), None)
+            if junction_edge:
+                junction_id = junction_edge['target']
+                other_parents = [e['source'] for e in edges
+                               if e['target'] == junction_id
+                               and e.get('type') == 'parent_to_junction'
+                               and e['source'] != node['id']]
+                if other_parents:
+                    spouse_node = next((n for n in level_nodes if n['id'] == other_parents[0]), None)
+                    if spouse_node:
+                        couples.append([node, spouse_node])
+                        paired.add(node['id'])
+                        paired.add(other_parents[0])
+                    else:
+                        couples.append([node])
+                        paired.add(node['id'])
+                else:
+                    couples.append([node])
+                    paired.add(node['id'])
+            else:
+                couples.append([node])
+                paired.add(node['id'])
+
+    return couples
+
+
+def legacy_find_junction_between(person1_id, person2_id, nodes, edges):
+    """Previous find_junction_between: nested scan over all edges"""
+    for edge in edges:
+        if edge.get('type') == 'parent_to_junction' and edge['source'] == person1_id:
+            junction_id = edge['target']
+            if any(e['source'] == person2_id and e['target'] == junction_id
+                   and e.get('type') == 'parent_to_junction' for e in edges):
+                return junction_id
+    return None
+
+
+def group_levels(nodes):
+    """Person nodes grouped by level"""
+    levels = {}
+    for node in nodes:
+        if node.get('type') == 'person':
+            levels.setdefault(node.get('level', 0), []).append(node)
+    return levels
+
+
+def pair_all_levels(tree_data):
+    """Couple pairing as done by apply_hierarchical_layout"""
+    nodes, edges = tree_data['nodes'], tree_data['edges']
+    spouse_of, couple_junctions = build_couple_maps(edges)
+    node_by_id = {n['id']: n for n in nodes}
+    result = []
+    for level_nodes in group_levels(nodes).values():
+        for couple in find_couples(level_nodes, edges, spouse_of):
+            if len(couple) == 2:
+                junction_id = find_junction_between(couple[0]['id'], couple[1]['id'], nodes, edges, couple_junctions)
+                node_by_id.get(junction_id)  # junction lookup, as in the layout
+                result.append((couple[0]['id'], couple[1]['id'], junction_id))
+            else:
+                result.append((couple[0]['id'],))
+    return result
+
+
+def legacy_pair_all_levels(tree_data):
+    """Couple pairing as done before the precomputed maps"""
+    nodes, edges = tree_data['nodes'], tree_data['edges']
+    result = []
+    for level_nodes in group_levels(nodes).values():
+        for couple in legacy_find_couples(level_nodes, edges):
+            if len(couple) == 2:
+                junction_id = legacy_find_junction_between(couple[0]['id'], couple[1]['id'], nodes, edges)
+                next((n for n in nodes if n['id'] == junction_id), None)  # junction lookup, as in the layout
+                result.append((couple[0]['id'], couple[1]['id'], junction_id))
+            else:
+                result.append((couple[0]['id'],))
+    return result
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-limit', type=int, default=10000,
+                        help="skip the old implementation above this many people (it is quadratic)")
+    args = parser.parse_args()
+
+    print(f"{'people':>8} {'edges':>8} {'maps (s)':>10} {'legacy (s)':>11} {'speedup':>9}")
+    for size in args.sizes:
+        tree_data = make_synthetic_tree(size, seed=size)
+        assign_levels(tree_data['nodes'], tree_data['edges'])
+
+        result, fast = timed(pair_all_levels, tree_data)
+
+        if size <= args.legacy_limit:
+            legacy_result, slow = timed(legacy_pair_all_levels, tree_data)
+            assert legacy_result == result, "pairing differs from legacy implementation"
+            legacy_col = f"{slow:11.3f}"
+            speedup_col = f"{slow / fast:8.0f}x"
+        else:
+            legacy_col = f"{'skipped':>11}"
+            speedup_col = f"{'-':>9}"
+
+        print(f"{count_people(tree_data):>8} {len(tree_data['edges']):>8} {fast:10.4f} {legacy_col} {speedup_col}")
+
+    # Engines run on a FamilyTree with its journal started, as the app
+    # holds a loaded tree, so the cost of reporting moved nodes is counted
+    print()
+    print(f"{'people':>8} " + " ".join(f"{name + ' (s)':>18}" for name in LAYOUT_ENGINES))
+    for size in args.sizes:
+        timings = []
+        for engine in LAYOUT_ENGINES.values():
+            tree = FamilyTree(make_synthetic_tree(size, seed=size))
+            tree.start_journal()
+            tree.take_journal()
+            timings.append(timed(engine, tree)[1])
+            # A full layout is one bulk change, not a journal record per node
+            assert tree.take_journal() is None, "full layout journaled node by node"
+        print(f"{count_people(tree):>8} " + " ".join(f"{t:18.3f}" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
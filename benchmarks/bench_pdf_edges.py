@@ -0,0 +1,113 @@
+"""
+Benchmark for the PDF edge pass.
+
+Times the edge drawing of export_tree_to_pdf_visual (bounds in one pass,
+one id -> page coordinate table, every edge in a single path object)
+against the old pass (four min/max passes, two next() scans over all
+nodes per edge to find its end points and one canvas call per edge).
+The old pass is quadratic, so it only runs on the first --legacy-limit
+edges and its full cost is extrapolated from that.
+
+    python -m benchmarks.bench_pdf_edges [--people N] [--legacy-limit N]
+"""
+import argparse
+import time
+from io import BytesIO
+
+from reportlab.lib.pagesizes import landscape, A4
+from reportlab.pdfgen import canvas
+
+from benchmarks.synthetic import make_synthetic_tree
+from components.layout_manager import apply_tidy_layout
+from utils.pdf_renderer import node_bounds, page_coordinates, edges_path
+
+
+def new_canvas():
+    return canvas.Canvas(BytesIO(), pagesize=landscape(A4))
+
+
+def fit_to_page(min_x, min_y, max_x, max_y, padding=100):
+    """Scale and offsets as export_tree_to_pdf_visual computes them"""
+    page_width, page_height = landscape(A4)
+    tree_width = (max_x - min_x if max_x > min_x else 100) + padding * 2
+    tree_height = (max_y - min_y if max_y > min_y else 100) + padding * 2
+    available_width = page_width - 144
+    available_height = page_height - 144
+    scale = min(available_width / tree_width, available_height / tree_height, 1.2)
+    offset_x = 72 + (available_width - tree_width * scale) / 2
+    offset_y = page_height - 72 - (available_height - tree_height * scale) / 2
+    return scale, offset_x, offset_y
+
+
+def legacy_edge_pass(c, nodes, edges, padding=100):
+    """Previous edge drawing: per-edge node scans and canvas calls"""
+    person_nodes = [n for n in nodes if n.get('type') == 'person']
+    min_x = min(n.get('x', 0) for n in person_nodes)
+    max_x = max(n.get('x', 0) for n in person_nodes)
+    min_y = min(n.get('y', 0) for n in person_nodes)
+    max_y = max(n.get('y', 0) for n in person_nodes)
+    scale, offset_x, offset_y = fit_to_page(min_x, min_y, max_x, max_y, padding)
+
+    def transform_point(x, y):
+        return offset_x + (x - min_x + padding) * scale, offset_y - (y - min_y + padding) * scale
+
+    for edge in edges:
+        edge_type = edge.get('type', 'spouse')
+        source_node = next((n for n in nodes if n['id'] == edge['source']), None)
+        target_node = next((n for n in nodes if n['id'] == edge['target']), None)
+
+        if source_node and target_node:
+            x1, y1 = transform_point(source_node.get('x', 0), source_node.get('y', 0))
+            x2, y2 = transform_point(target_node.get('x', 0), target_node.get('y', 0))
+
+            if edge_type == 'child_to_parent':
+                mid_y = (y1 + y2) / 2
+                c.bezier(x1, y1, x1, mid_y, x2, mid_y, x2, y2)
+            elif edge_type in ['spouse', 'parent_to_junction']:
+                c.line(x1, y1, x2, y2)
+
+
+def edge_pass(c, nodes, edges, padding=100):
+    """Current edge drawing, as in export_tree_to_pdf_visual"""
+    person_nodes = [n for n in nodes if n.get('type') == 'person']
+    min_x, min_y, max_x, max_y = node_bounds(person_nodes)
+    scale, offset_x, offset_y = fit_to_page(min_x, min_y, max_x, max_y, padding)
+    points = page_coordinates(nodes, min_x - padding, min_y - padding, scale, offset_x, offset_y)
+    c.drawPath(edges_path(c, edges, points), stroke=1, fill=0)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--people', type=int, default=39000,
+                        help="people in the synthetic tree (39000 gives about 50k edges)")
+    parser.add_argument('--legacy-limit', type=int, default=2000,
+                        help="edges to draw with the old pass (it scans every node per edge)")
+    args = parser.parse_args()
+
+    tree_data = make_synthetic_tree(args.people, seed=1)
+    apply_tidy_layout(tree_data)
+    nodes, edges = tree_data['nodes'], tree_data['edges']
+    print(f"{len(nodes)} nodes, {len(edges)} edges")
+
+    c = new_canvas()
+    fast = timed(edge_pass, c, nodes, edges)
+    save = timed(c.save)
+    print(f"edge pass:           {fast:8.3f} s  ({fast / len(edges) * 1e6:.1f} us per edge)")
+    print(f"canvas save:         {save:8.3f} s")
+
+    if args.legacy_limit:
+        sample = edges[:args.legacy_limit]
+        slow = timed(legacy_edge_pass, new_canvas(), nodes, sample)
+        per_edge = slow / len(sample)
+        print(f"old pass, {len(sample)} edges: {slow:8.3f} s  ({per_edge * 1e6:.1f} us per edge, "
+              f"~{per_edge * len(edges):.0f} s for all {len(edges)}, ~{per_edge * len(edges) / fast:.0f}x slower)")
+
+
+if __name__ == '__main__':
+    main()
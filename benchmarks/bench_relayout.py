@@ -0,0 +1,89 @@
+"""
+Per-edit benchmark for the incremental layout.
+
+Lays out a large FamilyTree with the tidy engine, then makes random
+add_child / add_spouse / add_sibling edits, timing each edit and the
+settle_layout() the app runs after it (which moves the families the edit
+pushed aside) separately. An edit re-lays out one family and reads the
+families beside it through their kept rows, so it should cost about the
+same on a 100k-person tree as on a 10k one, and a small fraction of a
+full layout; settling costs the people pushed. The first edit after the
+layout works out the kept rows for the tree, once, and is reported on
+its own.
+
+    python -m benchmarks.bench_relayout [--sizes N ...] [--edits N]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.synthetic import make_synthetic_tree, count_people
+from components.layout_manager import apply_tidy_layout, settle_layout
+from components.node_manager import add_child, add_spouse, add_sibling
+from utils.tree_model import FamilyTree
+
+# An edit (95th percentile) may take at most this share of a full layout
+EDIT_MAX_SHARE = 0.05
+# and its median may grow at most this much from the smallest tree to the largest
+EDIT_MAX_GROWTH = 4.0
+
+
+def time_edits(size, num_edits, seed=1):
+    """
+    (full layout seconds, first edit seconds, per-edit seconds, per-settle
+    seconds, full layouts asked for) for num_edits random edits on a tree
+    of about size people.
+    """
+    tree = FamilyTree(make_synthetic_tree(size, seed=size))
+    start = time.perf_counter()
+    apply_tidy_layout(tree)
+    full = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    people = [n['id'] for n in tree['nodes'] if n['type'] == 'person']
+    edits, settles = [], []
+    full_layouts = 0
+    for i in range(num_edits + 1):
+        person_id = rng.choice(people)
+        kind = rng.random()
+        start = time.perf_counter()
+        if kind < 0.6:
+            add_child(tree, person_id, f"Child {i}", '', '', None)
+        elif kind < 0.8:
+            add_spouse(tree, person_id, f"Spouse {i}", '', '', None)
+        else:
+            add_sibling(tree, person_id, f"Sibling {i}", '', '', None)
+        edited = time.perf_counter()
+        full_layouts += tree.layout_pending
+        settle_layout(tree)
+        edits.append(edited - start)
+        settles.append(time.perf_counter() - edited)
+    return full, edits[0], edits[1:], settles[1:], full_layouts, count_people(tree)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--edits', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'people':>8} {'full (s)':>9} {'first (ms)':>11} {'edit median (ms)':>17} {'edit p95 (ms)':>14} "
+          f"{'edit max (ms)':>14} {'settle median (ms)':>19} {'settle max (ms)':>16} {'full layouts':>13}")
+    medians = []
+    for size in args.sizes:
+        full, first, edits, settles, full_layouts, people = time_edits(size, args.edits)
+        p95 = statistics.quantiles(edits, n=20)[-1]
+        medians.append(statistics.median(edits))
+        print(f"{people:>8} {full:9.3f} {first * 1000:11.1f} {medians[-1] * 1000:17.2f} {p95 * 1000:14.2f} "
+              f"{max(edits) * 1000:14.2f} {statistics.median(settles) * 1000:19.2f} {max(settles) * 1000:16.1f} "
+              f"{full_layouts:13}")
+        assert p95 <= EDIT_MAX_SHARE * full, \
+            f"edits take {p95 / full:.1%} of a full layout at {people} people"
+    growth = medians[-1] / medians[0]
+    print(f"\nmedian edit, largest tree / smallest: {growth:.2f}x")
+    assert growth <= EDIT_MAX_GROWTH, f"per-edit cost grows {growth:.1f}x with the tree"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for saving the tree after an edit.
+
+Times save_to_browser after each of a run of renames, then of added
+children, against the old save, which rewrote the whole tree as indented
+JSON every time. The new save appends the edit to the log, so a rename
+costs the same at any tree size; an added child also logs the people the
+layout moved to make room (everyone a full layout moved, when the edit
+needs one). Snapshots are written in the background once the log
+outgrows the last one.
+
+    python -m benchmarks.bench_save [--people 1000 10000 50000] [--edits N]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_synthetic_tree
+from components.layout_manager import apply_tidy_layout, settle_layout
+from components.node_manager import add_child, edit_node
+from utils import storage_handler
+from utils.tree_model import FamilyTree
+
+
+def legacy_save(tree_data):
+    """Previous save: the whole tree, indented, on every edit"""
+    with open(storage_handler.LEGACY_CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(tree_data, f, indent=2)
+
+
+def run_edits(tree_data, edits, save, kind, seed=0):
+    """Apply edits of one kind, saving after each; returns average seconds per save"""
+    rng = random.Random(seed)
+    people = [n['id'] for n in tree_data['nodes'] if n.get('type') == 'person']
+    spent = 0.0
+    for i in range(edits):
+        person_id = rng.choice(people)
+        if kind == 'rename':
+            edit_node(tree_data, person_id, f"Renamed {i}", '', '', None)
+        else:
+            add_child(tree_data, person_id, f"Child {i}", '', '', None)
+        settle_layout(tree_data)
+        start = time.perf_counter()
+        save(tree_data)
+        spent += time.perf_counter() - start
+    return spent / edits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--people', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--edits', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'people':>7} {'edit':>7} {'old save (ms)':>14} {'new save (ms)':>14} {'speedup':>8}")
+    for num_people in args.people:
+        tree_data = make_synthetic_tree(num_people, seed=1)
+        apply_tidy_layout(tree_data)
+
+        for kind in ('rename', 'child'):
+            with tempfile.TemporaryDirectory() as workdir:
+                cwd = os.getcwd()
+                os.chdir(workdir)
+                try:
+                    legacy = run_edits(FamilyTree(json.loads(json.dumps(tree_data))), args.edits, legacy_save, kind)
+
+                    tree = FamilyTree(json.loads(json.dumps(tree_data)))
+                    storage_handler.save_to_browser(tree)  # first save is a snapshot
+                    logged = run_edits(tree, args.edits, storage_handler.save_to_browser, kind)
+                    storage_handler.clear_browser_storage()
+                    storage_handler.workspace_store().close()
+                finally:
+                    os.chdir(cwd)
+
+            print(f"{num_people:>7} {kind:>7} {legacy * 1000:14.3f} {logged * 1000:14.3f} {legacy / logged:7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
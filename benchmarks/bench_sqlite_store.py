@@ -0,0 +1,114 @@
+"""
+Benchmark for the sqlite storage backend on an archive-sized tree.
+
+Compares, for a synthetic tree of --people people:
+  - answering a name search from a cold start: loading the JSON cache and
+    searching in memory, against search_nodes in the database
+  - root-to-person paths: find_path_to_node in memory against the
+    database version (bidirectional, one indexed query per frontier)
+  - saving one rename: rewriting the tree against one row update
+Peak memory is the Python heap (tracemalloc); SQLite's own page cache is
+not counted, it is bounded by its cache_size.
+
+    python -m benchmarks.bench_sqlite_store [--people N] [--queries N]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import make_synthetic_tree
+from utils import search_handler, sqlite_store
+from utils.tree_model import FamilyTree
+
+
+def measured(func, *args):
+    """(result, seconds, peak Python heap MB); timed and traced in separate calls"""
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def search_from_json(path, query):
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = FamilyTree(json.load(f))
+    return search_handler.search_nodes(tree, query)
+
+
+def search_from_sqlite(path, query):
+    conn = sqlite_store.open_store(path)
+    try:
+        return sqlite_store.search_nodes(conn, query)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--people', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    tree = FamilyTree(make_synthetic_tree(args.people, seed=1))
+    people = [n['id'] for n in tree['nodes'] if n.get('type') == 'person']
+    print(f"{len(tree['nodes'])} nodes, {len(tree['edges'])} edges")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, 'tree.json')
+        db_path = os.path.join(workdir, 'tree.sqlite')
+
+        start = time.perf_counter()
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(tree, f)
+        json_write = time.perf_counter() - start
+        conn = sqlite_store.open_store(db_path)
+        start = time.perf_counter()
+        sqlite_store.write_tree(conn, tree)
+        db_write = time.perf_counter() - start
+        print(f"full write:   json {json_write:7.2f} s ({os.path.getsize(json_path) / 1e6:.0f} MB)   "
+              f"sqlite {db_write:7.2f} s ({os.path.getsize(db_path) / 1e6:.0f} MB)")
+
+        print(f"\n{'search':<14} {'json + memory (s)':>18} {'peak (MB)':>10} {'sqlite (s)':>11} {'peak (MB)':>10}")
+        for query in ('Person 12345', 'person 99', 'son 4'):
+            expected, json_time, json_peak = measured(search_from_json, json_path, query)
+            found, db_time, db_peak = measured(search_from_sqlite, db_path, query)
+            assert found == expected
+            print(f"{query!r:<14} {json_time:18.3f} {json_peak:10.1f} {db_time:11.4f} {db_peak:10.2f}")
+
+        rng = random.Random(0)
+        targets = rng.sample(people, min(args.queries, len(people)))
+        memory_time = db_time = 0.0
+        for target in targets:
+            start = time.perf_counter()
+            expected = search_handler.find_path_to_node(tree, target)
+            memory_time += time.perf_counter() - start
+            start = time.perf_counter()
+            found = sqlite_store.find_path_to_node(conn, target)
+            db_time += time.perf_counter() - start
+            assert len(found) == len(expected)
+        print(f"\npath to person (avg of {len(targets)}): memory {memory_time / len(targets) * 1000:8.2f} ms   "
+              f"sqlite {db_time / len(targets) * 1000:8.2f} ms")
+
+        node = tree.node(people[len(people) // 2])
+        node['name'] = 'Renamed'
+        tree.mark_changed([node['id']])
+        start = time.perf_counter()
+        sqlite_store.write_tree(conn, tree)
+        rewrite = time.perf_counter() - start
+        start = time.perf_counter()
+        sqlite_store.apply_journal(conn, [('n', node)])
+        row_update = time.perf_counter() - start
+        print(f"save a rename: rewrite {rewrite * 1000:8.1f} ms   row update {row_update * 1000:8.3f} ms")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
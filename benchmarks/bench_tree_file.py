@@ -0,0 +1,97 @@
+"""
+Benchmark for the binary tree file format (utils.tree_file) against JSON.
+
+For a synthetic tree of --people people, laid out:
+  - file size and write time: json.dump (indented, as the cache and JSON
+    export used to be) against encode_tree
+  - loading the whole tree: json.load against open_tree + to_dict, the
+    best of --repeat runs each; the tree file must load at least
+    LOAD_MIN_SPEEDUP times as fast
+  - lazy access: opening the memory-mapped file, reading single nodes by
+    position, and the first find() by id (which indexes the id column)
+
+    python -m benchmarks.bench_tree_file [--people N] [--reads N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_synthetic_tree
+from components.layout_manager import apply_tidy_layout
+from utils import tree_file
+
+LOAD_MIN_SPEEDUP = 1.5
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def write_json(path, tree_data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tree_data, f, indent=2)
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_tree_file(path):
+    with tree_file.open_tree(path) as opened:
+        return opened.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--people', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tree = make_synthetic_tree(args.people, seed=1)
+    apply_tidy_layout(tree)
+    print(f"{len(tree['nodes'])} nodes, {len(tree['edges'])} edges")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, 'tree.json')
+        binary_path = os.path.join(workdir, 'tree.ftree')
+
+        _, json_write = timed(write_json, json_path, tree)
+        _, binary_write = timed(tree_file.write_tree, binary_path, tree)
+        print(f"write:     json {json_write:7.3f} s ({os.path.getsize(json_path) / 1e6:5.1f} MB)   "
+              f"tree file {binary_write:7.3f} s ({os.path.getsize(binary_path) / 1e6:5.1f} MB)")
+
+        json_load = binary_load = float('inf')
+        for _ in range(args.repeat):
+            from_json, elapsed = timed(load_json, json_path)
+            json_load = min(json_load, elapsed)
+            from_binary, elapsed = timed(load_tree_file, binary_path)
+            binary_load = min(binary_load, elapsed)
+        assert from_binary == from_json
+        print(f"load all:  json {json_load:7.3f} s   tree file {binary_load:7.3f} s   "
+              f"({json_load / binary_load:.1f}x)")
+        assert json_load >= LOAD_MIN_SPEEDUP * binary_load, \
+            f"loading a tree file whole takes {binary_load / json_load:.0%} of json.load's time"
+
+        opened, open_time = timed(tree_file.open_tree, binary_path)
+        positions = random.Random(0).sample(range(opened.node_count), min(args.reads, opened.node_count))
+        start = time.perf_counter()
+        for position in positions:
+            opened.node(position)
+        read_time = (time.perf_counter() - start) / len(positions)
+        target = tree['nodes'][positions[0]]['id']
+        found, find_time = timed(opened.find, target)
+        assert found == tree['nodes'][positions[0]]
+        print(f"lazy:      open {open_time * 1000:7.2f} ms   node(i) {read_time * 1000:7.4f} ms   "
+              f"first find {find_time * 1000:7.1f} ms")
+        opened.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import random
+
+
+def make_synthetic_tree(num_people, seed=0, max_children=4, marry_rate=0.7):
+    """
+    Build a tree dict with num_people persons, generation by generation.
+    Each person may marry an incoming spouse (joined by a junction) and have
+    children under that junction, like trees built through the app.
+    """
+    rng = random.Random(seed)
+    nodes = []
+    edges = []
+    people = []
+    
+    def new_person(level):
+        node = {
+            'id': f"person_{len(nodes)}",
+            'name': f"Person {len(people)}",
+            'birth_date': str(1700 + level * 25),
+            'death_date': '',
+            'photo': None,
+            'type': 'person',
+            'level': level,
+            'x': 0,
+            'y': 0,
+            'fixed': False
+        }
+        nodes.append(node)
+        people.append(node)
+        return node
+    
+    generation = [new_person(0)]
+    level = 0
+    
+    while len(people) < num_people and generation:
+        next_generation = []
+        for person in generation:
+            if len(people) >= num_people:
+                break
+            if rng.random() > marry_rate:
+                continue
+            
+            spouse = new_person(level)
+            junction_id = f"junction_{len(nodes)}"
+            nodes.append({
+                'id': junction_id,
+                'type': 'junction',
+                'level': level,
+                'x': 0,
+                'y': 0,
+                'fixed': False
+            })
+            edges.append({'source': person['id'], 'target': junction_id, 'type': 'parent_to_junction'})
+            edges.append({'source': spouse['id'], 'target': junction_id, 'type': 'parent_to_junction'})
+            
+            for _ in range(rng.randint(1, max_children)):
+                if len(people) >= num_people:
+                    break
+                child = new_person(level + 1)
+                edges.append({'source': child['id'], 'target': junction_id, 'type': 'child_to_parent'})
+                next_generation.append(child)
+        
+        # Keep the tree growing even if a whole generation stayed single
+        if not next_generation and len(people) < num_people:
+            next_generation = [new_person(level + 1)]
+        
+        generation = next_generation
+        level += 1
+    
+    return {'nodes': nodes, 'edges': edges}
+
+
+def count_people(tree_data):
+    """Number of person nodes in a tree dict"""
+    return sum(1 for n in tree_data['nodes'] if n.get('type') == 'person')
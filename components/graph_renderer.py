@@ -1,6 +1,13 @@
+import streamlit as st
 from streamlit_agraph import Node, Edge, Config, agraph
 import base64
 import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from utils.photo_store import store_photo, load_photo, load_photo_base64
+from utils.spatial_index import GridIndex
+from utils.tree_model import as_tree
 
 def get_default_avatar_base64():
     """Load default avatar from assets folder and convert to base64"""
@@ -14,6 +21,63 @@ def get_default_avatar_base64():
 
 DEFAULT_AVATAR_B64 = get_default_avatar_base64()
 
+# Photos go to the browser as URLs of static files (server.enableStaticServing
+# in .streamlit/config.toml): each image is fetched and cached once, however
+# many nodes show it and however often the app reruns. Without static
+# serving they are inlined at the 70px size nodes are drawn at.
+STATIC_AVATAR_DIR = os.path.join('static', 'avatars')
+
+@lru_cache(maxsize=1)
+def _static_avatar_url():
+    """URL path STATIC_AVATAR_DIR is served at, or None if static files are not served"""
+    try:
+        if not st.get_option('server.enableStaticServing'):
+            return None
+        base = st.get_option('server.baseUrlPath').strip('/')
+    except Exception:
+        return None
+    return f"/{base}/app/static/avatars" if base else "/app/static/avatars"
+
+@lru_cache(maxsize=4096)
+def _published_avatar(photo_hash):
+    """File name of a photo's avatar in STATIC_AVATAR_DIR, written on first use"""
+    # A missing photo raises, which lru_cache does not remember
+    name = f"{photo_hash}.jpg"
+    path = os.path.join(STATIC_AVATAR_DIR, name)
+    if not os.path.exists(path):
+        data = load_photo(photo_hash, 'avatar_2x')
+        if data is None:
+            raise FileNotFoundError(photo_hash)
+        os.makedirs(STATIC_AVATAR_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return name
+
+def photo_image_url(photo_hash):
+    """Image URL for a stored photo (None if it is missing)"""
+    base_url = _static_avatar_url()
+    if base_url:
+        try:
+            return f"{base_url}/{_published_avatar(photo_hash)}"
+        except OSError:
+            pass
+    photo_b64 = load_photo_base64(photo_hash, 'avatar')
+    return f"data:image/jpeg;base64,{photo_b64}" if photo_b64 else None
+
+@lru_cache(maxsize=1)
+def default_avatar_url():
+    """Image URL shared by every person without a photo"""
+    avatar_path = os.path.join('assets', 'default_avatar.jpg')
+    if os.path.exists(avatar_path):
+        # Stored like any photo, so it gets the same thumbnails and URL
+        with open(avatar_path, 'rb') as f:
+            url = photo_image_url(store_photo(f.read()))
+        if url:
+            return url
+    return f"data:image/png;base64,{DEFAULT_AVATAR_B64}"
+
 def create_graph_config():
     """Create graph configuration"""
     return Config(
@@ -27,116 +91,417 @@ def create_graph_config():
         collapsible=False
     )
 
-def build_graph_nodes(tree_data, selected_id=None, highlighted_node=None):
-    """Build visual nodes for graph with white borders and optional highlighting"""
+# Built Node / Edge objects per tree (by FamilyTree.uid), most recent last.
+# Each element is reused while the content it was built from is unchanged,
+# and while the tree's version is unchanged only elements whose selection
+# or highlight changed are rebuilt. Shared by every session's script
+# thread, so it is only touched under _graph_cache_lock.
+GRAPH_CACHE_TREES = 8
+_graph_cache = OrderedDict()
+_graph_cache_lock = threading.Lock()
+
+def _tree_cache(tree_data):
+    """Element cache for a FamilyTree; None for plain dicts (no version to key on)"""
+    uid = getattr(tree_data, 'uid', None)
+    if uid is None:
+        return None
+    # Lists replaced behind the tree's back count as a change
+    tree_data.sync()
+    with _graph_cache_lock:
+        cache = _graph_cache.get(uid)
+        if cache is None:
+            cache = {'nodes_version': None, 'edges_version': None, 'index_version': None,
+                     'node_elements': {}, 'edge_elements': {}, 'dot_elements': {}}
+            _graph_cache[uid] = cache
+            if len(_graph_cache) > GRAPH_CACHE_TREES:
+                _graph_cache.popitem(last=False)
+        else:
+            _graph_cache.move_to_end(uid)
+    return cache
+
+def _border_color(node_id, selected_id, highlighted_node):
+    # White border by default, gold for selected, green for search result
+    if node_id == highlighted_node:
+        return "#00FF00"  # Green for search result
+    elif node_id == selected_id:
+        return "#FFD700"  # Gold for selected
+    return "#FFFFFF"  # White default
+
+def _node_key(node, border_color, hidden_count=0):
+    """Everything a node's visual depends on"""
+    return (node.get('type'), node.get('name'), node.get('birth_date', node.get('date', '')),
+            node.get('death_date', ''), node.get('photo_hash'), node.get('photo'),
+            node.get('x', 0), node.get('y', 0), border_color, hidden_count)
+
+def _build_node(node, border_color, hidden_count=0):
+    """
+    Visual Node for a person or junction; hidden_count > 0 marks a
+    collapsed branch with a badge counting the people hidden below it.
+    """
     from utils.data_handler import format_date_range
     
-    nodes = []
-    for node in tree_data['nodes']:
-        if node.get('type') == 'person':
-            node_id = node['id']
-            name = node.get('name', 'Unknown')
-            
-            # Handle both old 'date' field and new 'birth_date'/'death_date' fields
-            birth_date = node.get('birth_date', node.get('date', ''))
-            death_date = node.get('death_date', '')
-            date_display = format_date_range(birth_date, death_date)
-            
-            # Create label
-            label = f"{name}\n{date_display}" if date_display else name
-            
-            # White border by default, gold for selected, green for search result
-            if node_id == highlighted_node:
-                border_color = "#00FF00"  # Green for search result
-            elif node_id == selected_id:
-                border_color = "#FFD700"  # Gold for selected
-            else:
-                border_color = "#FFFFFF"  # White default
-            
-            photo_b64 = node.get('photo')
-            if photo_b64:
-                image_url = f"data:image/jpeg;base64,{photo_b64}"
-            else:
-                image_url = f"data:image/png;base64,{DEFAULT_AVATAR_B64}"
-            
-            # Create tooltip with name and dates
-            tooltip = f"{name}"
-            if date_display:
-                tooltip += f"\n{date_display}"
-            
-            nodes.append(Node(
-                id=node_id,
-                label=label,
-                size=35,
-                shape="circularImage",
-                image=image_url,
-                color=border_color,
-                font={'size': 10, 'color': '#FFFFFF', 'strokeWidth': 2, 'strokeColor': '#000000'},
-                title=tooltip,
-                x=node.get('x', 0),
-                y=node.get('y', 0)
-            ))
-
-        elif node.get('type') == 'junction':
-            nodes.append(Node(
+    if node.get('type') == 'person':
+        node_id = node['id']
+        name = node.get('name', 'Unknown')
+        
+        # Handle both old 'date' field and new 'birth_date'/'death_date' fields
+        birth_date = node.get('birth_date', node.get('date', ''))
+        death_date = node.get('death_date', '')
+        date_display = format_date_range(birth_date, death_date)
+        
+        # Create label
+        label = f"{name}\n{date_display}" if date_display else name
+        if hidden_count:
+            label += f"\n▸ {hidden_count} hidden"
+        
+        # Served avatars are the 2x derivative so they stay sharp on HiDPI screens
+        image_url = None
+        if node.get('photo_hash'):
+            image_url = photo_image_url(node['photo_hash'])
+        elif node.get('photo'):
+            # Not migrated to the photo store yet
+            image_url = f"data:image/jpeg;base64,{node['photo']}"
+        if not image_url:
+            image_url = default_avatar_url()
+        
+        # Create tooltip with name and dates
+        tooltip = f"{name}"
+        if date_display:
+            tooltip += f"\n{date_display}"
+        
+        return Node(
+            id=node_id,
+            label=label,
+            size=35,
+            shape="circularImage",
+            image=image_url,
+            color=border_color,
+            font={'size': 10, 'color': '#FFFFFF', 'strokeWidth': 2, 'strokeColor': '#000000'},
+            title=tooltip,
+            x=node.get('x', 0),
+            y=node.get('y', 0)
+        )
+    
+    elif node.get('type') == 'junction':
+        if hidden_count:
+            # Collapsed family: a bigger dot with the count
+            return Node(
                 id=node['id'],
-                label="",
-                size=2,  # Slightly larger for visibility
-                color="#FFFFFF",  # White junction dots
+                label=f"▸ {hidden_count}",
+                size=6,
+                color="#FFFFFF",
                 shape="dot",
+                font={'size': 10, 'color': '#FFFFFF', 'strokeWidth': 2, 'strokeColor': '#000000'},
+                title=f"{hidden_count} hidden",
                 x=node.get('x', 0),
                 y=node.get('y', 0)
-            ))
-    return nodes
+            )
+        return Node(
+            id=node['id'],
+            label="",
+            size=2,  # Slightly larger for visibility
+            color="#FFFFFF",  # White junction dots
+            shape="dot",
+            x=node.get('x', 0),
+            y=node.get('y', 0)
+        )
+    return None
+
+def _node_element(node, border_color, elements, hidden_count=0):
+    """Cached Node for node, rebuilt only if its key changed"""
+    key = _node_key(node, border_color, hidden_count)
+    cached = elements.get(node['id'])
+    if cached is None or cached[0] != key:
+        cached = (key, _build_node(node, border_color, hidden_count))
+        elements[node['id']] = cached
+    return cached[1]
+
+def _family_ids(tree, node_id):
+    """Families a node heads: a junction itself, or a person and their junctions"""
+    node = tree.node(node_id)
+    if node.get('type') == 'junction':
+        return [node_id]
+    return [node_id] + [e['target'] for e in tree.edges_from(node_id) if e.get('type') == 'parent_to_junction']
+
+def _partner_ids(tree, person_id):
+    """Spouses and co-parents of a person"""
+    partners = [e['target'] if e['source'] == person_id else e['source']
+                for e in tree.edges_of(person_id) if e.get('type') == 'spouse']
+    for family_id in _family_ids(tree, person_id)[1:]:
+        partners.extend(p for p in tree.junction_parents(family_id) if p != person_id)
+    return partners
+
+def collapsed_branches(tree_data):
+    """
+    Ids hidden by the tree's 'collapsed' list and, per collapsed node, how
+    many people that hides: everything below a collapsed person or
+    junction, i.e. the children of its families, the partners who married
+    in to them, their families, and so on down. A partner with parents of
+    their own stays in view with them.
+    Returns (hidden ids, {collapsed id: hidden people}).
+    """
+    tree = as_tree(tree_data)
+    hidden = set()
+    counts = {}
+    for root_id in tree_data.get('collapsed', []):
+        if root_id in hidden or not tree.node(root_id):
+            continue
+        people = 0
+        stack = _family_ids(tree, root_id)
+        while stack:
+            for child_id in tree.children_of(stack.pop()):
+                if child_id in hidden or child_id == root_id:
+                    continue
+                hidden.add(child_id)
+                people += 1
+                for partner_id in _partner_ids(tree, child_id):
+                    if (partner_id not in hidden and partner_id != root_id
+                            and tree.parent_link(partner_id) is None):
+                        hidden.add(partner_id)
+                        people += 1
+                        stack.extend(_family_ids(tree, partner_id))
+                families = _family_ids(tree, child_id)
+                hidden.update(families[1:])
+                stack.extend(families)
+        counts[root_id] = people
+    return hidden, counts
+
+def _collapsed(tree_data, cache):
+    """collapsed_branches, kept per tree version"""
+    if cache is None:
+        return collapsed_branches(tree_data)
+    if cache.get('collapse_version') != tree_data.version:
+        cache.update(collapse=collapsed_branches(tree_data), collapse_version=tree_data.version)
+    return cache['collapse']
+
+def build_graph_nodes(tree_data, selected_id=None, highlighted_node=None):
+    """
+    Build visual nodes for graph with white borders and optional highlighting.
+    Nodes inside collapsed branches are left out.
+    """
+    cache = _tree_cache(tree_data)
+    hidden, hidden_counts = _collapsed(tree_data, cache)
+    if cache is None:
+        nodes = (_build_node(node, _border_color(node['id'], selected_id, highlighted_node), hidden_counts.get(node['id'], 0))
+                 for node in tree_data['nodes'] if node['id'] not in hidden)
+        return [element for element in nodes if element]
+    
+    elements = cache['node_elements']
+    if cache['nodes_version'] == tree_data.version:
+        # Tree unchanged: only the old and new selection / search result differ
+        nodes = cache['nodes']
+        positions = cache['node_positions']
+        for node_id in {cache['selected_id'], cache['highlighted_node'], selected_id, highlighted_node}:
+            if node_id in positions:
+                node = tree_data.node(node_id)
+                nodes[positions[node_id]] = _node_element(
+                    node, _border_color(node_id, selected_id, highlighted_node), elements,
+                    hidden_counts.get(node_id, 0))
+    else:
+        nodes = []
+        positions = {}
+        for node in tree_data['nodes']:
+            if node['id'] in hidden:
+                continue
+            element = _node_element(node, _border_color(node['id'], selected_id, highlighted_node), elements,
+                                    hidden_counts.get(node['id'], 0))
+            if element:
+                positions[node['id']] = len(nodes)
+                nodes.append(element)
+        # Forget deleted nodes
+        if len(elements) > len(tree_data['nodes']):
+            for node_id in [i for i in elements if tree_data.node(i) is None]:
+                del elements[node_id]
+        cache.update(nodes=nodes, node_positions=positions, nodes_version=tree_data.version)
+    
+    cache.update(selected_id=selected_id, highlighted_node=highlighted_node)
+    return list(nodes)
+
+def _build_edge(source, target, edge_type, is_highlighted):
+    """Visual Edge for a tree edge"""
+    if edge_type in ('spouse', 'parent_to_junction'):
+        return Edge(
+            source=source,
+            target=target,
+            color="#00FF00" if is_highlighted else "#FFFFFF",  # Green if highlighted, white default
+            width=2.5 if is_highlighted else 1.5,
+            smooth=False,
+            arrows=""
+        )
+    elif edge_type == 'child_to_parent':
+        return Edge(
+            source=source,
+            target=target,
+            color="#00FF00" if is_highlighted else "#FFFFFF",  # Green if highlighted, white default
+            width=2.5 if is_highlighted else 1.5,
+            smooth={'enabled': True, 'type': 'cubicBezier', 'roundness': 0.5},
+            arrows=""
+        )
+    return None
+
+def _edge_element(source, target, edge_type, is_highlighted, elements):
+    """Cached Edge, shared by edges with the same ends, type and highlight"""
+    key = (source, target, edge_type, is_highlighted)
+    if key not in elements:
+        elements[key] = _build_edge(source, target, edge_type, is_highlighted)
+    return elements[key]
 
 def build_graph_edges(tree_data, highlighted_edges=None):
-    """Build edges for graph with white lines and optional path highlighting"""
-    if highlighted_edges is None:
-        highlighted_edges = []
+    """
+    Build edges for graph with white lines and optional path highlighting.
+    Edges into collapsed branches are left out.
+    """
+    highlighted = set(highlighted_edges or [])
+    
+    cache = _tree_cache(tree_data)
+    hidden, _ = _collapsed(tree_data, cache)
+    if cache is None:
+        edges = (_build_edge(e['source'], e['target'], e.get('type', 'spouse'), (e['source'], e['target']) in highlighted)
+                 for e in tree_data['edges'] if e['source'] not in hidden and e['target'] not in hidden)
+        return [edge for edge in edges if edge]
+    
+    elements = cache['edge_elements']
+    if cache['edges_version'] == tree_data.version:
+        # Tree unchanged: only edges entering or leaving the highlighted path differ
+        edges = cache['edges']
+        positions = cache['edge_positions']
+        for ends in highlighted ^ cache['highlighted_edges']:
+            for index, edge_type in positions.get(ends, ()):
+                edges[index] = _edge_element(ends[0], ends[1], edge_type, ends in highlighted, elements)
+    else:
+        edges = []
+        positions = {}
+        if len(elements) > 2 * len(tree_data['edges']):
+            elements.clear()
+        for edge in tree_data['edges']:
+            ends = (edge['source'], edge['target'])
+            if ends[0] in hidden or ends[1] in hidden:
+                continue
+            edge_type = edge.get('type', 'spouse')
+            element = _edge_element(ends[0], ends[1], edge_type, ends in highlighted, elements)
+            if element:
+                positions.setdefault(ends, []).append((len(edges), edge_type))
+                edges.append(element)
+        cache.update(edges=edges, edge_positions=positions, edges_version=tree_data.version)
+    
+    cache['highlighted_edges'] = highlighted
+    return list(edges)
+
+# ==================== VIEWPORT ====================
+# Large trees are drawn through a viewport: only nodes in or near the view
+# (found through a grid index over x / y) and the edges touching them are
+# sent to the browser. Views wider than DETAIL_MAX_WIDTH draw people as
+# plain dots, without photos or labels.
+VIEWPORT_MIN_NODES = 2000
+DETAIL_MAX_WIDTH = 6000
+# Part of the view width / height also drawn on every side, so edges
+# leaving the view still lead somewhere
+VIEW_MARGIN = 0.25
+VIEW_INDEX_CELL = 500
+
+def _view_index(tree_data, cache):
+    """Grid index over node positions, rebuilt when the tree changes"""
+    if cache is not None and cache['index_version'] == tree_data.version:
+        return cache['index']
+    index = GridIndex(VIEW_INDEX_CELL)
+    for node in tree_data['nodes']:
+        x, y = node.get('x', 0), node.get('y', 0)
+        index.insert(node, x, y, x, y)
+    if cache is not None:
+        cache.update(index=index, index_version=tree_data.version)
+    return index
+
+def _dot_key(node, border_color):
+    return (node.get('type'), node.get('name'), node.get('x', 0), node.get('y', 0), border_color)
+
+def _build_dot(node, border_color):
+    """Low-detail Node: a dot, named only in its tooltip"""
+    if node.get('type') != 'person':
+        return Node(id=node['id'], label="", size=1, color="#FFFFFF", shape="dot",
+                    x=node.get('x', 0), y=node.get('y', 0))
+    return Node(
+        id=node['id'],
+        label="",
+        size=8,
+        shape="dot",
+        color=border_color,
+        title=node.get('name', 'Unknown'),
+        x=node.get('x', 0),
+        y=node.get('y', 0)
+    )
+
+def _dot_element(node, border_color, elements):
+    """Cached low-detail Node, rebuilt only if its key changed"""
+    key = _dot_key(node, border_color)
+    cached = elements.get(node['id'])
+    if cached is None or cached[0] != key:
+        cached = (key, _build_dot(node, border_color))
+        elements[node['id']] = cached
+    return cached[1]
+
+def build_viewport_elements(tree_data, viewport, selected_id=None, highlighted_edges=None, highlighted_node=None):
+    """
+    Nodes and edges for the part of the tree in viewport, a
+    (center_x, center_y, width, height) box in tree coordinates.
+    Returns (nodes, edges, detailed).
+    """
+    tree = as_tree(tree_data)
+    cache = _tree_cache(tree)
+    highlighted = set(highlighted_edges or [])
+    center_x, center_y, width, height = viewport
+    half_width = width * (0.5 + VIEW_MARGIN)
+    half_height = height * (0.5 + VIEW_MARGIN)
+    detailed = width <= DETAIL_MAX_WIDTH
     
+    hidden, hidden_counts = _collapsed(tree, cache)
+    in_view = _view_index(tree, cache).query(center_x - half_width, center_y - half_height,
+                                             center_x + half_width, center_y + half_height)
+    
+    if detailed:
+        elements = cache['node_elements'] if cache else {}
+    else:
+        elements = cache['dot_elements'] if cache else {}
+    
+    nodes = []
+    shown = set()
+    for node in in_view:
+        if node['id'] in hidden:
+            continue
+        border_color = _border_color(node['id'], selected_id, highlighted_node)
+        if detailed:
+            element = _node_element(node, border_color, elements, hidden_counts.get(node['id'], 0))
+        else:
+            element = _dot_element(node, border_color, elements)
+        if element:
+            nodes.append(element)
+            shown.add(node['id'])
+    
+    # Edges with both ends drawn, each once
+    edge_elements = cache['edge_elements'] if cache else {}
     edges = []
-    for edge in tree_data['edges']:
-        edge_type = edge.get('type', 'spouse')
-        
-        # Check if this edge is in the highlighted path
-        is_highlighted = (edge['source'], edge['target']) in highlighted_edges
-        
-        if edge_type == 'spouse':
-            edges.append(Edge(
-                source=edge['source'],
-                target=edge['target'],
-                color="#00FF00" if is_highlighted else "#FFFFFF",  # Green if highlighted, white default
-                width=2.5 if is_highlighted else 1.5,
-                smooth=False,
-                arrows=""
-            ))
-        elif edge_type == 'parent_to_junction':
-            edges.append(Edge(
-                source=edge['source'],
-                target=edge['target'],
-                color="#00FF00" if is_highlighted else "#FFFFFF",  # Green if highlighted, white default
-                width=2.5 if is_highlighted else 1.5,
-                smooth=False,
-                arrows=""
-            ))
-        elif edge_type == 'child_to_parent':
-            edges.append(Edge(
-                source=edge['source'],
-                target=edge['target'],
-                color="#00FF00" if is_highlighted else "#FFFFFF",  # Green if highlighted, white default
-                width=2.5 if is_highlighted else 1.5,
-                smooth={'enabled': True, 'type': 'cubicBezier', 'roundness': 0.5},
-                arrows=""
-            ))
-    return edges
-
-def render_tree_graph(tree_data, selected_id=None, highlighted_edges=None, highlighted_node=None):
-    """Render tree as interactive graph with search highlighting support"""
+    for node_id in shown:
+        for edge in tree.edges_from(node_id):
+            if edge['target'] in shown:
+                ends = (edge['source'], edge['target'])
+                element = _edge_element(ends[0], ends[1], edge.get('type', 'spouse'), ends in highlighted, edge_elements)
+                if element:
+                    edges.append(element)
+    return nodes, edges, detailed
+
+def render_tree_graph(tree_data, selected_id=None, highlighted_edges=None, highlighted_node=None, viewport=None):
+    """
+    Render tree as interactive graph with search highlighting support.
+    With viewport (center_x, center_y, width, height) only that part of
+    the tree is drawn (see build_viewport_elements).
+    """
     if highlighted_edges is None:
         highlighted_edges = []
     
-    nodes = build_graph_nodes(tree_data, selected_id, highlighted_node)
-    edges = build_graph_edges(tree_data, highlighted_edges)
+    if viewport:
+        nodes, edges, _ = build_viewport_elements(tree_data, viewport, selected_id, highlighted_edges, highlighted_node)
+    else:
+        nodes = build_graph_nodes(tree_data, selected_id, highlighted_node)
+        edges = build_graph_edges(tree_data, highlighted_edges)
     config = create_graph_config()
     
     return agraph(nodes=nodes, edges=edges, config=config)
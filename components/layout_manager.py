@@ -1,13 +1,47 @@
+import gc
+from contextlib import contextmanager
+
+from utils.tree_model import as_tree, mark_changed, FamilyTree
+
+def _layout_fields(nodes):
+    """Position fields of every node, to tell after a layout which ones moved"""
+    return {n['id']: (n.get('x'), n.get('y'), n.get('level')) for n in nodes}
+
+# A layout moving more than this share of the nodes is reported as one
+# change to the whole tree (the next save writes a snapshot) rather than
+# node by node, which would journal every moved node on its own
+BULK_LAYOUT_SHARE = 0.25
+
+def _report_moved(tree_data, moved):
+    """Report the nodes a layout moved, so saving only writes those (or the whole tree)"""
+    if len(moved) > BULK_LAYOUT_SHARE * len(tree_data.get('nodes', [])):
+        mark_changed(tree_data, reason='layout')
+    elif moved:
+        mark_changed(tree_data, moved, reason='layout')
+
+def _mark_moved(tree_data, nodes, before):
+    """Report the nodes a layout actually moved, comparing with before"""
+    moved = [n['id'] for n in nodes if before.get(n['id']) != (n.get('x'), n.get('y'), n.get('level'))]
+    _report_moved(tree_data, moved)
+
 def apply_hierarchical_layout(tree_data):
     """Apply hierarchical layout to tree"""
     nodes = tree_data.get('nodes', [])
     edges = tree_data.get('edges', [])
     
     if not nodes:
-        return
+        return []
+    
+    before = _layout_fields(nodes)
+    # Every node is placed anew: pushes not settled yet no longer apply
+    _forget_positions(tree_data)
     
     # Step 1: Assign levels to all nodes
-    assign_levels(nodes, edges)
+    cycle_ids = assign_levels(nodes, edges)
+    
+    # Spouse / junction lookups shared by every level
+    spouse_of, couple_junctions = build_couple_maps(edges)
+    node_by_id = {n['id']: n for n in nodes}
     
     # Step 2: Group nodes by level
     levels = {}
@@ -27,7 +61,7 @@ def apply_hierarchical_layout(tree_data):
         y_pos = level_num * y_spacing
         
         # Find couples in this level
-        couples = find_couples(level_nodes, edges)
+        couples = find_couples(level_nodes, edges, spouse_of)
         
         # Position nodes
         x_offset = 0
@@ -46,9 +80,9 @@ def apply_hierarchical_layout(tree_data):
                 positioned.add(person2['id'])
                 
                 # Position junction if exists (FIXED: centered exactly between spouses)
-                junction_id = find_junction_between(person1['id'], person2['id'], nodes, edges)
+                junction_id = find_junction_between(person1['id'], person2['id'], nodes, edges, couple_junctions)
                 if junction_id:
-                    junction_node = next((n for n in nodes if n['id'] == junction_id), None)
+                    junction_node = node_by_id.get(junction_id)
                     if junction_node:
                         # CRITICAL FIX: Junction must be exactly at midpoint of the two people
                         junction_node['x'] = (person1['x'] + person2['x']) / 2.0
@@ -70,72 +104,132 @@ def apply_hierarchical_layout(tree_data):
                 node['y'] = y_pos
                 positioned.add(node['id'])
                 x_offset += x_spacing
-
-# ... rest of functions (assign_levels, find_couples, find_junction_between) remain the same
+    
+    _mark_moved(tree_data, nodes, before)
+    return cycle_ids
 
 
 def assign_levels(nodes, edges):
-    """Assign hierarchical levels to all nodes"""
-    # Find root nodes (people with no incoming child_to_parent edges)
-    children_ids = {e['source'] for e in edges if e.get('type') == 'child_to_parent'}
+    """
+    Assign hierarchical levels to all nodes in a single topological pass.
+    Children always sit one level below their deepest parent, at any depth.
+    Returns ids of people that could not be leveled because they sit on
+    (or below) a parent/child cycle, e.g. from a corrupted import.
+    """
+    from collections import deque
     
-    # Set root level
-    for node in nodes:
-        if node.get('type') == 'person':
-            if node['id'] not in children_ids:
-                node['level'] = 0
-    
-    # Propagate levels downward
-    max_iterations = 20
-    for _ in range(max_iterations):
-        changed = False
-        for node in nodes:
-            if node.get('type') == 'person' and 'level' in node:
-                # Find all children of this person
-                for edge in edges:
-                    if edge.get('type') == 'child_to_parent':
-                        # Check if this node is the parent
-                        if edge['target'] == node['id']:
-                            # Direct parent-child
-                            child_node = next((n for n in nodes if n['id'] == edge['source']), None)
-                            if child_node:
-                                new_level = node['level'] + 1
-                                if child_node.get('level', -1) != new_level:
-                                    child_node['level'] = new_level
-                                    changed = True
-                        else:
-                            # Check if this node connects to a junction
-                            target_node = next((n for n in nodes if n['id'] == edge['target']), None)
-                            if target_node and target_node.get('type') == 'junction':
-                                # Check if this person is connected to the junction
-                                junction_edges = [e for e in edges 
-                                                if e.get('type') == 'parent_to_junction' 
-                                                and e['source'] == node['id'] 
-                                                and e['target'] == target_node['id']]
-                                if junction_edges:
-                                    # This person is a parent through junction
-                                    child_node = next((n for n in nodes if n['id'] == edge['source']), None)
-                                    if child_node:
-                                        new_level = node['level'] + 1
-                                        if child_node.get('level', -1) != new_level:
-                                            child_node['level'] = new_level
-                                            changed = True
+    node_by_id = {n['id']: n for n in nodes}
+    
+    # Junction -> parent ids, so a child's parents resolve in O(1)
+    junction_parents = {}
+    for edge in edges:
+        if edge.get('type') == 'parent_to_junction':
+            junction_parents.setdefault(edge['target'], []).append(edge['source'])
+    
+    # Prebuilt parent -> children adjacency and per-child parent counts
+    children_of = {}
+    pending_parents = {}
+    for edge in edges:
+        if edge.get('type') != 'child_to_parent':
+            continue
+        child_id = edge['source']
+        target_node = node_by_id.get(edge['target'])
+        if child_id not in node_by_id or not target_node:
+            continue
+        
+        if target_node.get('type') == 'junction':
+            parent_ids = junction_parents.get(target_node['id'], [])
+        else:
+            parent_ids = [target_node['id']]
         
-        if not changed:
-            break
+        for parent_id in parent_ids:
+            parent_node = node_by_id.get(parent_id)
+            if parent_node and parent_node.get('type') == 'person':
+                children_of.setdefault(parent_id, []).append(child_id)
+                pending_parents[child_id] = pending_parents.get(child_id, 0) + 1
+    
+    # Root level: people with no parents
+    queue = deque()
+    for node in nodes:
+        if node.get('type') == 'person' and node['id'] not in pending_parents:
+            node['level'] = 0
+            queue.append(node['id'])
+    
+    # Propagate levels downward once every parent of a child is known
+    new_levels = {}
+    while queue:
+        parent_id = queue.popleft()
+        child_level = node_by_id[parent_id]['level'] + 1
+        for child_id in children_of.get(parent_id, []):
+            new_levels[child_id] = max(new_levels.get(child_id, 0), child_level)
+            pending_parents[child_id] -= 1
+            if pending_parents[child_id] == 0:
+                node_by_id[child_id]['level'] = new_levels[child_id]
+                queue.append(child_id)
+    
+    # Anyone still waiting on a parent is part of (or hangs off) a cycle
+    cycle_ids = [child_id for child_id, count in pending_parents.items() if count > 0]
+    if cycle_ids:
+        print(f"Warning: parent/child cycle detected, levels left unchanged for "
+              f"{len(cycle_ids)} node(s): {', '.join(cycle_ids[:10])}")
     
     # Assign level to junctions based on their parents
     for node in nodes:
         if node.get('type') == 'junction':
-            parent_edges = [e for e in edges if e.get('type') == 'parent_to_junction' and e['target'] == node['id']]
-            if parent_edges:
-                parent_id = parent_edges[0]['source']
-                parent_node = next((n for n in nodes if n['id'] == parent_id), None)
+            parent_ids = junction_parents.get(node['id'])
+            if parent_ids:
+                parent_node = node_by_id.get(parent_ids[0])
                 if parent_node:
                     node['level'] = parent_node.get('level', 0)
+    
+    return cycle_ids
 
-def find_couples(level_nodes, edges):
+def build_couple_maps(edges):
+    """
+    Build spouse and couple -> junction lookups in one pass over the edges.
+    spouse_of maps a person to the partner find_couples pairs them with (a
+    spouse edge wins, otherwise the other parent of their first junction);
+    couple_junctions maps (person1_id, person2_id) to their shared junction.
+    """
+    spouse_of = {}
+    first_junction = {}
+    junction_parents = {}
+    
+    for edge in edges:
+        edge_type = edge.get('type')
+        if edge_type == 'spouse':
+            if edge['source'] != edge['target']:
+                spouse_of.setdefault(edge['source'], edge['target'])
+                spouse_of.setdefault(edge['target'], edge['source'])
+        elif edge_type == 'parent_to_junction':
+            first_junction.setdefault(edge['source'], edge['target'])
+            junction_parents.setdefault(edge['target'], []).append(edge['source'])
+    
+    # People without a spouse edge pair up through their first junction
+    for person_id, junction_id in first_junction.items():
+        if person_id not in spouse_of:
+            other_parent = next((p for p in junction_parents[junction_id] if p != person_id), None)
+            if other_parent:
+                spouse_of[person_id] = other_parent
+    
+    # Each parent's junctions in edge order, so the first shared one wins
+    couple_junctions = {}
+    for edge in edges:
+        if edge.get('type') == 'parent_to_junction':
+            for other_parent in junction_parents[edge['target']]:
+                couple_junctions.setdefault((edge['source'], other_parent), edge['target'])
+    
+    return spouse_of, couple_junctions
+
+def find_couples(level_nodes, edges, spouse_of=None):
     """Find couples (spouse pairs) in a level"""
+    if spouse_of is None:
+        spouse_of, _ = build_couple_maps(edges)
+    
+    level_by_id = {}
+    for node in level_nodes:
+        level_by_id.setdefault(node['id'], node)
+    
     couples = []
     paired = set()
     
@@ -143,57 +237,1406 @@ def find_couples(level_nodes, edges):
         if node['id'] in paired:
             continue
         
-        # Look for spouse connection
-        spouse_edge = next((e for e in edges 
-                          if (e['source'] == node['id'] or e['target'] == node['id']) 
-                          and e.get('type') == 'spouse'), None)
-        
-        if spouse_edge:
-            spouse_id = spouse_edge['target'] if spouse_edge['source'] == node['id'] else spouse_edge['source']
-            spouse_node = next((n for n in level_nodes if n['id'] == spouse_id), None)
-            if spouse_node:
-                couples.append([node, spouse_node])
-                paired.add(node['id'])
-                paired.add(spouse_id)
-            else:
-                couples.append([node])
-                paired.add(node['id'])
+        spouse_node = level_by_id.get(spouse_of.get(node['id']))
+        if spouse_node:
+            couples.append([node, spouse_node])
+            paired.add(node['id'])
+            paired.add(spouse_node['id'])
         else:
-            # Check for junction connection
-            junction_edge = next((e for e in edges 
-                                if e['source'] == node['id'] 
-                                and e.get('type') == 'parent_to_junction'), None)
-            if junction_edge:
-                junction_id = junction_edge['target']
-                # Find other parent
-                other_parents = [e['source'] for e in edges 
-                               if e['target'] == junction_id 
-                               and e.get('type') == 'parent_to_junction' 
-                               and e['source'] != node['id']]
-                if other_parents:
-                    spouse_node = next((n for n in level_nodes if n['id'] == other_parents[0]), None)
-                    if spouse_node:
-                        couples.append([node, spouse_node])
-                        paired.add(node['id'])
-                        paired.add(other_parents[0])
-                    else:
-                        couples.append([node])
-                        paired.add(node['id'])
-                else:
-                    couples.append([node])
-                    paired.add(node['id'])
-            else:
-                couples.append([node])
-                paired.add(node['id'])
+            couples.append([node])
+            paired.add(node['id'])
     
     return couples
 
-def find_junction_between(person1_id, person2_id, nodes, edges):
+def find_junction_between(person1_id, person2_id, nodes, edges, couple_junctions=None):
     """Find junction node between two people"""
+    if couple_junctions is None:
+        _, couple_junctions = build_couple_maps(edges)
+    return couple_junctions.get((person1_id, person2_id))
+
+
+# ==================== TIDY TREE LAYOUT ====================
+# Reingold-Tilford tree drawing with Walker's n-ary extension, in the linear
+# time formulation of Buchheim, Juenger & Leipert. The tree being drawn is a
+# tree of family units: a person plus the spouses who married into their
+# line, so couples move together and each family ends up centered under the
+# junction of its parents.
+
+TIDY_Y_SPACING = 150
+TIDY_SPOUSE_SPACING = 120
+TIDY_UNIT_GAP = 144
+
+
+class FamilyUnit:
+    """A person and their married-in spouses, laid out as one tidy-tree node"""
+    
+    __slots__ = ('head', 'members', 'left_extent', 'right_extent', 'parent',
+                 'children', 'number', 'depth', 'prelim', 'mod', 'thread', 'ancestor',
+                 'change', 'shift', 'x', 'offset', 'rows', 'rows_dx', 'fixed')
+    
+    def __init__(self, head_id):
+        self.head = head_id
+        self.members = [head_id]
+        self.left_extent = 0
+        self.right_extent = 0
+        self.parent = None
+        self.children = []
+        self.number = 0
+        self.depth = 0
+        self.prelim = 0.0
+        self.mod = 0.0
+        self.thread = None
+        self.ancestor = self
+        self.change = 0.0
+        self.shift = 0.0
+        self.x = 0.0
+        # Kept layouts only: shift pending for the subtree, and (if known)
+        # the rows its people take up, moved by rows_dx since, and the ones
+        # of them that are fixed
+        self.offset = 0.0
+        self.rows = None
+        self.rows_dx = 0.0
+        self.fixed = ()
+    
+    def family_offset(self):
+        """Where this unit's children are centered, relative to its head"""
+        return (self.right_extent - self.left_extent) / 2.0
+    
+    def left_brother(self):
+        if self.parent is not None and self.number > 1:
+            return self.parent.children[self.number - 2]
+        return None
+    
+    def leftmost_sibling(self):
+        if self.parent is not None and self.number > 1:
+            return self.parent.children[0]
+        return None
+    
+    def next_left(self):
+        return self.children[0] if self.children else self.thread
+    
+    def next_right(self):
+        return self.children[-1] if self.children else self.thread
+
+
+def build_family_units(nodes, edges, node_by_id=None):
+    """
+    Group people into family units and link units parent -> children.
+    Returns (virtual root unit, person id -> unit, junction id -> parent ids,
+    ids of people whose parent link was dropped to break a cycle).
+    """
+    if node_by_id is None:
+        node_by_id = {n['id']: n for n in nodes}
+    
+    parent_link = {}
+    family_children = {}
+    junction_parents = {}
+    partners = {}
+    
     for edge in edges:
-        if edge.get('type') == 'parent_to_junction' and edge['source'] == person1_id:
-            junction_id = edge['target']
-            if any(e['source'] == person2_id and e['target'] == junction_id 
-                   and e.get('type') == 'parent_to_junction' for e in edges):
-                return junction_id
+        edge_type = edge.get('type')
+        source, target = edge['source'], edge['target']
+        if source not in node_by_id or target not in node_by_id:
+            continue
+        if edge_type == 'child_to_parent':
+            # Only a child's first parent link places it in the tree
+            if source not in parent_link and node_by_id[source].get('type') == 'person':
+                parent_link[source] = target
+                family_children.setdefault(target, []).append(source)
+        elif edge_type == 'parent_to_junction':
+            junction_parents.setdefault(target, []).append(source)
+        elif edge_type == 'spouse' and source != target:
+            partners.setdefault(source, []).append(target)
+            partners.setdefault(target, []).append(source)
+    
+    # Co-parents only matter to people without parents of their own
+    for parent_ids in junction_parents.values():
+        if len(parent_ids) < 2:
+            continue
+        for parent_id in parent_ids:
+            if parent_id in parent_link:
+                continue
+            for other_id in parent_ids:
+                if other_id != parent_id:
+                    partners.setdefault(parent_id, []).append(other_id)
+    
+    persons = [n['id'] for n in nodes if n.get('type') == 'person']
+    unit_of = {}
+    units = []
+    
+    # Everyone with parents heads their own unit
+    for person_id in persons:
+        if person_id in parent_link and person_id not in unit_of:
+            unit = FamilyUnit(person_id)
+            unit_of[person_id] = unit
+            units.append(unit)
+    
+    # Married-in spouses join the unit of their partner
+    for person_id in persons:
+        if person_id in unit_of:
+            continue
+        for partner_id in partners.get(person_id, ()):
+            if partner_id in parent_link:
+                unit_of[partner_id].members.append(person_id)
+                unit_of[person_id] = unit_of[partner_id]
+                break
+    
+    # Remaining people are roots, grouped with their root-level partners
+    for person_id in persons:
+        if person_id in unit_of:
+            continue
+        unit = FamilyUnit(person_id)
+        unit_of[person_id] = unit
+        units.append(unit)
+        for partner_id in partners.get(person_id, []):
+            if partner_id not in unit_of and node_by_id[partner_id].get('type') == 'person':
+                unit.members.append(partner_id)
+                unit_of[partner_id] = unit
+    
+    # Hang each family's children under the unit owning the family
+    for family_id, child_ids in family_children.items():
+        if family_id in unit_of:
+            owner = unit_of[family_id]
+        else:
+            parent_ids = [p for p in junction_parents.get(family_id, []) if p in unit_of]
+            if not parent_ids:
+                continue
+            owner = unit_of[parent_ids[0]]
+            if len(parent_ids) > 1 and not any(unit_of[o] is owner for o in parent_ids[1:]):
+                # Prefer the unit holding both parents
+                owner = next((unit_of[p] for p in parent_ids
+                              if any(unit_of[o] is unit_of[p] for o in parent_ids if o != p)),
+                             owner)
+        for child_id in child_ids:
+            child_unit = unit_of[child_id]
+            if child_unit is owner or child_unit.parent is not None:
+                continue
+            child_unit.parent = owner
+            owner.children.append(child_unit)
+    
+    root = FamilyUnit(None)
+    root.members = []
+    root.depth = -1
+    for unit in units:
+        if unit.parent is None:
+            unit.parent = root
+            root.children.append(unit)
+    _arrange_units(root)
+    
+    # Units the walk never reached (number still 0) hang off a parent/child
+    # cycle: cut the cycle at the first unit on it and make that unit a root
+    cycle_ids = []
+    for unit in units:
+        if unit.number:
+            continue
+        walked = set()
+        while id(unit) not in walked:
+            walked.add(id(unit))
+            unit = unit.parent
+        unit.parent.children.remove(unit)
+        unit.parent = root
+        root.children.append(unit)
+        unit.number = len(root.children)
+        unit.depth = 0
+        cycle_ids.append(unit.members[0])
+        _arrange_units(unit)
+    
+    if cycle_ids:
+        print(f"Warning: parent/child cycle detected, parent link ignored for "
+              f"{len(cycle_ids)} node(s): {', '.join(cycle_ids[:10])}")
+    
+    return root, unit_of, junction_parents, cycle_ids
+
+
+def _arrange_units(start):
+    """Order spouses around each head, number siblings and set depths below start"""
+    stack = [start]
+    while stack:
+        unit = stack.pop()
+        if len(unit.members) > 1:
+            _arrange_members(unit, unit.members)
+        depth = unit.depth + 1
+        for i, child in enumerate(unit.children):
+            child.number = i + 1
+            child.depth = depth
+            stack.append(child)
+
+
+def _arrange_members(unit, member_ids):
+    """Set a unit's members from its head and spouses: spouses alternate right / left of the head"""
+    head, spouses = member_ids[0], member_ids[1:]
+    left, right = spouses[1::2], spouses[0::2]
+    unit.members = left[::-1] + [head] + right
+    unit.left_extent = len(left) * TIDY_SPOUSE_SPACING
+    unit.right_extent = len(right) * TIDY_SPOUSE_SPACING
+
+
+def _unit_distance(left, right):
+    """Minimum head-to-head distance between two neighbouring units"""
+    return left.right_extent + right.left_extent + TIDY_UNIT_GAP
+
+
+def _move_subtree(left, right, shift):
+    subtrees = right.number - left.number
+    right.change -= shift / subtrees
+    right.shift += shift
+    left.change += shift / subtrees
+    right.prelim += shift
+    right.mod += shift
+
+
+def _execute_shifts(unit):
+    shift = change = 0.0
+    for child in reversed(unit.children):
+        child.prelim += shift
+        child.mod += shift
+        change += child.change
+        shift += child.shift + change
+
+
+def _ancestor(inner_left, unit, default_ancestor):
+    if inner_left.ancestor.parent is unit.parent:
+        return inner_left.ancestor
+    return default_ancestor
+
+
+def _apportion(unit, default_ancestor):
+    """Push unit's subtree right until it clears its left siblings' contours"""
+    left_brother = unit.left_brother()
+    if left_brother is None:
+        return default_ancestor
+    
+    inner_right = outer_right = unit
+    inner_left = left_brother
+    outer_left = unit.leftmost_sibling()
+    sum_inner_right = sum_outer_right = unit.mod
+    sum_inner_left = inner_left.mod
+    sum_outer_left = outer_left.mod
+    
+    while inner_left.next_right() and inner_right.next_left():
+        inner_left = inner_left.next_right()
+        inner_right = inner_right.next_left()
+        outer_left = outer_left.next_left()
+        outer_right = outer_right.next_right()
+        outer_right.ancestor = unit
+        shift = ((inner_left.prelim + sum_inner_left)
+                 - (inner_right.prelim + sum_inner_right)
+                 + _unit_distance(inner_left, inner_right))
+        if shift > 0:
+            _move_subtree(_ancestor(inner_left, unit, default_ancestor), unit, shift)
+            sum_inner_right += shift
+            sum_outer_right += shift
+        sum_inner_left += inner_left.mod
+        sum_inner_right += inner_right.mod
+        sum_outer_left += outer_left.mod
+        sum_outer_right += outer_right.mod
+    
+    if inner_left.next_right() and not outer_right.next_right():
+        outer_right.thread = inner_left.next_right()
+        outer_right.mod += sum_inner_left - sum_outer_right
+    if inner_right.next_left() and not outer_left.next_left():
+        outer_left.thread = inner_right.next_left()
+        outer_left.mod += sum_inner_right - sum_outer_left
+        default_ancestor = unit
+    return default_ancestor
+
+
+def tidy_first_walk(root):
+    """Bottom-up pass: preliminary x of every unit relative to its siblings"""
+    # Iterative post-order (children left to right) so deep lines don't recurse
+    order = []
+    stack = [root]
+    while stack:
+        unit = stack.pop()
+        order.append(unit)
+        stack.extend(unit.children)
+    
+    default_ancestors = {}
+    for unit in reversed(order):
+        left_brother = unit.left_brother()
+        if unit.children:
+            _execute_shifts(unit)
+            # Put the parents' junction, not the head, over the children
+            midpoint = (unit.children[0].prelim + unit.children[-1].prelim) / 2.0 - unit.family_offset()
+            if left_brother is not None:
+                unit.prelim = left_brother.prelim + _unit_distance(left_brother, unit)
+                unit.mod = unit.prelim - midpoint
+            else:
+                unit.prelim = midpoint
+        elif left_brother is not None:
+            unit.prelim = left_brother.prelim + _unit_distance(left_brother, unit)
+        else:
+            unit.prelim = 0.0
+        
+        # A first child has nothing to its left to apportion against
+        if left_brother is not None:
+            parent = unit.parent
+            default_ancestor = default_ancestors.get(id(parent), parent.children[0])
+            default_ancestors[id(parent)] = _apportion(unit, default_ancestor)
+
+
+def tidy_second_walk(root):
+    """
+    Top-down pass: final head x = preliminary x + sum of ancestor modifiers.
+    Returns the leftmost x any unit reaches.
+    """
+    min_x = 0.0
+    stack = [(child, root.mod) for child in root.children]
+    if stack:
+        min_x = float('inf')
+    while stack:
+        unit, mod_sum = stack.pop()
+        unit.x = unit.prelim + mod_sum
+        if unit.x - unit.left_extent < min_x:
+            min_x = unit.x - unit.left_extent
+        mod_sum += unit.mod
+        for child in unit.children:
+            stack.append((child, mod_sum))
+    return min_x
+
+
+def place_family_units(root, node_by_id, junction_parents, shift=0.0,
+                       y_origin=0.0, level_origin=0, respect_fixed=False):
+    """
+    Copy unit positions (moved left by shift) onto person and junction nodes.
+    Rows start at y_origin / level_origin; with respect_fixed, nodes marked
+    fixed keep their position. Returns the ids of the nodes that moved.
+    """
+    moved = []
+    stack = list(root.children)
+    while stack:
+        unit = stack.pop()
+        left_x = unit.x - unit.left_extent - shift
+        y_pos = y_origin + unit.depth * TIDY_Y_SPACING
+        level = level_origin + unit.depth
+        for person_id in unit.members:
+            person = node_by_id[person_id]
+            if not (respect_fixed and person.get('fixed', False)):
+                # Compared first: most nodes of a re-run layout stay put
+                if person.get('x') != left_x or person.get('y') != y_pos or person.get('level') != level:
+                    person['x'] = left_x
+                    person['y'] = y_pos
+                    person['level'] = level
+                    moved.append(person_id)
+            left_x += TIDY_SPOUSE_SPACING
+        stack.extend(unit.children)
+    
+    # Junctions sit at the midpoint of their parents
+    for junction_id, parent_ids in junction_parents.items():
+        junction_node = node_by_id.get(junction_id)
+        if not junction_node or junction_node.get('type') != 'junction':
+            continue
+        if respect_fixed and junction_node.get('fixed', False):
+            continue
+        parents = [node_by_id[p] for p in parent_ids if p in node_by_id]
+        if parents:
+            x = sum([p.get('x', 0) for p in parents]) / len(parents)
+            y = parents[0].get('y', 0)
+            level = parents[0].get('level', 0)
+            if junction_node.get('x') != x or junction_node.get('y') != y or junction_node.get('level') != level:
+                junction_node['x'] = x
+                junction_node['y'] = y
+                junction_node['level'] = level
+                moved.append(junction_id)
+    return moved
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Hold off the cyclic garbage collector. A full layout allocates a unit
+    per family, and on a large tree those allocations set off collections
+    that scan every node already loaded, for nothing to free.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def apply_tidy_layout(tree_data, respect_fixed=False):
+    """
+    Apply tidy tree layout: linear time, couples kept together and every
+    family centered under its parents' junction.
+    With respect_fixed, nodes marked fixed keep their position.
+    Returns ids of people whose parent link was ignored to break a cycle.
+    """
+    nodes = tree_data.get('nodes', [])
+    edges = tree_data.get('edges', [])
+    
+    if not nodes:
+        return []
+    
+    node_by_id = {n['id']: n for n in nodes}
+    with _gc_paused():
+        root, unit_of, junction_parents, cycle_ids = build_family_units(nodes, edges, node_by_id)
+        tidy_first_walk(root)
+        
+        # Start the leftmost family at x=0, like the hierarchical layout
+        shift = tidy_second_walk(root)
+        moved = place_family_units(root, node_by_id, junction_parents, shift, respect_fixed=respect_fixed)
+    if isinstance(tree_data, FamilyTree):
+        # Kept for re-laying out single families after edits
+        _keep_units(tree_data, UnitCache(root, unit_of))
+    _report_moved(tree_data, moved)
+    return cycle_ids
+
+
+# ==================== INCREMENTAL LAYOUT ====================
+# After a single edit only the edited family is re-laid out with the tidy
+# engine, anchored at its head. Because a tidy subtree's shape depends only
+# on the subtree, unchanged families come out exactly where they were.
+# Where the new shape reaches past the rows the family used before, the
+# families beside it are pushed aside, nearest first, until every such row
+# is clear. Parents of pushed families stay where they are: the result is a
+# valid but looser layout than a full one, which "Reset Layout" tidies up.
+#
+# The family units of the last layout are kept on the FamilyTree
+# (UnitCache) and patched for the nodes each edit relinked, so an edit
+# walks units instead of working each one out from the edge index. Each
+# unit also keeps the rows its subtree takes up (y -> min / max x), worked
+# out from its children's, so the edges of a family beside the edited one
+# are looked up rather than walked. A push does not move anyone: like the
+# mod / shift of Walker's algorithm it only adds to the pushed unit's
+# offset, which positions in its subtree are read through until
+# settle_layout() moves everyone pushed since in one pass, before the tree
+# is next shown. An edit then costs the family re-laid out and the units
+# on its way up to the root, never a pass over the tree; settling costs
+# the people moved. The first edits after the units are built (on loading,
+# after a full layout) also work out the rows, once.
+#
+# Edits that change the tree too much for that (relatives left as a tree of
+# their own, subtrees grown in between each other's people) mark it for a
+# full layout instead, which settle_layout() runs before the tree is next
+# shown: a burst of edits then costs one layout.
+
+# Extra room a pushed unit gets, as a fraction of its width
+PUSH_SLACK = 0.2
+
+
+def request_full_layout(tree_data):
+    """
+    Mark the tree for a full tidy layout at the next settle_layout().
+    A plain dict has nowhere to keep the mark, so it is laid out right away.
+    """
+    if isinstance(tree_data, FamilyTree):
+        tree_data.layout_pending = True
+    else:
+        apply_tidy_layout(tree_data, respect_fixed=True)
+
+
+def settle_layout(tree_data):
+    """
+    Run the full layout edits asked for, if any, or else move the families
+    edits pushed aside (see relayout_family). Returns True if either ran.
+    """
+    if getattr(tree_data, 'layout_pending', False):
+        tree_data.layout_pending = False
+        apply_tidy_layout(tree_data, respect_fixed=True)
+        return True
+    cache = getattr(tree_data, 'layout_units', None)
+    if cache is None or not cache.pending:
+        return False
+    _report_moved(tree_data, _apply_offsets(as_tree(tree_data), cache))
+    return True
+
+
+def settle_position(tree_data, node_id):
+    """
+    Move node_id to where pushes not settled yet put it (see
+    settle_layout), so its position can be read, e.g. to place someone
+    new beside it. Only the families above it are settled.
+    """
+    cache = getattr(tree_data, 'layout_units', None)
+    unit = cache.unit_of.get(node_id) if cache is not None else None
+    if unit is not None and cache.pending:
+        moved = []
+        _settle_path(as_tree(tree_data), cache, unit, moved)
+        _report_moved(tree_data, moved)
+
+
+def _parent_family(tree, person_id):
+    """Family (parent or junction id) a person hangs under, via their first parent link"""
+    for edge in tree.edges_from(person_id):
+        if edge.get('type') == 'child_to_parent' and tree.node(edge['target']):
+            return edge['target']
     return None
+
+
+def _partners(tree, person_id):
+    """Spouses of a person: spouse edges first, then co-parents of their junctions"""
+    partner_ids = [e['target'] for e in tree.edges_from(person_id) if e.get('type') == 'spouse']
+    partner_ids += [e['source'] for e in tree.edges_to(person_id) if e.get('type') == 'spouse']
+    for edge in tree.edges_from(person_id):
+        if edge.get('type') == 'parent_to_junction':
+            partner_ids.extend(tree.junction_parents(edge['target']))
+    return [p for p in partner_ids
+            if p != person_id and (tree.node(p) or {}).get('type') == 'person']
+
+
+def _unit_head(tree, person_id, memo):
+    """Head of the family unit a person belongs to (same rules as build_family_units)"""
+    if person_id in memo:
+        return memo[person_id]
+    
+    head_id = person_id
+    if not _parent_family(tree, person_id):
+        partner_ids = _partners(tree, person_id)
+        married_into = next((p for p in partner_ids if _parent_family(tree, p)), None)
+        if married_into:
+            head_id = married_into
+        else:
+            # Root couple: the earliest partner heading its own unit takes this person in
+            memo[person_id] = person_id
+            position = tree.position(person_id)
+            earlier = [p for p in partner_ids
+                       if tree.position(p) < position and _unit_head(tree, p, memo) == p]
+            if earlier:
+                head_id = min(earlier, key=tree.position)
+    
+    memo[person_id] = head_id
+    return head_id
+
+
+def _family_owner(tree, family_id, memo):
+    """Head of the unit whose children a family's children are"""
+    family_node = tree.node(family_id)
+    if not family_node:
+        return None
+    if family_node.get('type') != 'junction':
+        return _unit_head(tree, family_id, memo)
+    
+    # Parents in edges list order, as build_family_units meets them
+    parent_edges = sorted((e for e in tree.edges_to(family_id) if e.get('type') == 'parent_to_junction'),
+                          key=tree.edge_position)
+    heads = [_unit_head(tree, e['source'], memo) for e in parent_edges if tree.node(e['source'])]
+    if not heads:
+        return None
+    # Prefer the unit holding both parents
+    return next((h for h in heads if heads.count(h) > 1), heads[0])
+
+
+def family_anchor(tree_data, person_id):
+    """
+    Person whose family re-lays out when person_id is removed: the head of
+    the unit they belong to, or, if they head it, the unit above them.
+    """
+    tree = as_tree(tree_data)
+    memo = {}
+    head_id = _unit_head(tree, person_id, memo)
+    if head_id != person_id:
+        return head_id
+    parent_family = _parent_family(tree, person_id)
+    return _family_owner(tree, parent_family, memo) if parent_family else None
+
+
+def detaches_relatives(tree_data, person_id):
+    """
+    True if removing person_id leaves relatives as a separate tree: children
+    hanging directly off them or off a family they were the last parent of,
+    or partners who married into their family.
+    """
+    tree = as_tree(tree_data)
+    if any(e.get('type') == 'child_to_parent' for e in tree.edges_to(person_id)):
+        return True
+    # Children of a family they were the last parent of
+    for e in tree.edges_from(person_id):
+        if (e.get('type') == 'parent_to_junction'
+                and tree.junction_parents(e['target']) == [person_id]
+                and tree.children_of(e['target'])):
+            return True
+    memo = {}
+    return any(_unit_head(tree, p, memo) == person_id
+               for p in _partners(tree, person_id))
+
+
+def _unit_members(tree, head_id, memo):
+    """
+    The head of a family unit, then its spouses in the order build_family_units
+    adds them: married-in spouses in node order, a root's partners in edge order
+    """
+    spouse_ids = {p for p in _partners(tree, head_id)
+                  if p != head_id and _unit_head(tree, p, memo) == head_id}
+    if _parent_family(tree, head_id):
+        return [head_id] + sorted(spouse_ids, key=tree.position)
+    
+    # Spouse edges, then co-parents junction by junction, in edges list order
+    spouse_edges = [e for e in tree.edges_from(head_id) + tree.edges_to(head_id)
+                    if e.get('type') == 'spouse']
+    ordered = [e['target'] if e['source'] == head_id else e['source']
+               for e in sorted(spouse_edges, key=tree.edge_position)]
+    junction_ids = [e['target'] for e in tree.edges_from(head_id)
+                    if e.get('type') == 'parent_to_junction']
+    junction_ids.sort(key=lambda j: min(tree.edge_position(e) for e in tree.edges_to(j)
+                                        if e.get('type') == 'parent_to_junction'))
+    for junction_id in junction_ids:
+        ordered.extend(tree.junction_parents(junction_id))
+    return [head_id] + [p for p in dict.fromkeys(ordered) if p in spouse_ids]
+
+
+def _child_heads(tree, head_id, member_ids, memo):
+    """Heads of the units below a unit, left to right as a full layout places them"""
+    # Families this unit owns: its members directly, plus their junctions
+    family_ids = []
+    for member_id in member_ids:
+        family_ids.append(member_id)
+        family_ids.extend(e['target'] for e in tree.edges_from(member_id)
+                          if e.get('type') == 'parent_to_junction')
+    
+    groups = []
+    for family_id in dict.fromkeys(family_ids):
+        if _family_owner(tree, family_id, memo) != head_id:
+            continue
+        child_ids = [c for c in tree.children_of(family_id)
+                     if (tree.node(c) or {}).get('type') == 'person'
+                     and _parent_family(tree, c) == family_id]
+        if child_ids:
+            # In edges list order, as a full layout takes them
+            groups.append(sorted(child_ids, key=lambda c: tree.edge_position(tree.parent_link(c))))
+    
+    # Families in the order their first child was linked, as in a full layout
+    groups.sort(key=lambda child_ids: tree.edge_position(tree.parent_link(child_ids[0])))
+    return [child_id for child_ids in groups for child_id in child_ids]
+
+
+def build_family_subtree(tree, head_id, memo):
+    """
+    Family units for head_id's unit and everything below it, built from the
+    tree index. Returns (virtual root unit, list of units).
+    """
+    head_unit = FamilyUnit(head_id)
+    units = [head_unit]
+    claimed = {head_id}
+    
+    stack = [head_unit]
+    while stack:
+        unit = stack.pop()
+        unit.members = [m for m in _unit_members(tree, unit.members[0], memo)
+                        if m == unit.members[0] or m not in claimed]
+        claimed.update(unit.members)
+        for child_id in _child_heads(tree, unit.members[0], unit.members, memo):
+            if child_id in claimed:
+                continue
+            claimed.add(child_id)
+            child_unit = FamilyUnit(child_id)
+            child_unit.parent = unit
+            unit.children.append(child_unit)
+            units.append(child_unit)
+            stack.append(child_unit)
+    
+    root = FamilyUnit(None)
+    root.members = []
+    root.depth = -1
+    root.children = [head_unit]
+    head_unit.parent = root
+    _arrange_units(root)
+    return root, units
+
+
+def _row_extents(units, x_of):
+    """depth -> (min x, max x) over unit members, skipping members x_of returns None for"""
+    rows = {}
+    for unit in units:
+        for i, person_id in enumerate(unit.members):
+            x = x_of(unit, i, person_id)
+            if x is None:
+                continue
+            low, high = rows.get(unit.depth, (x, x))
+            rows[unit.depth] = (min(low, x), max(high, x))
+    return rows
+
+
+class UnitCache:
+    """
+    Family units of a FamilyTree as its last layout built them, kept on
+    the tree (layout_units) for re-laying out single families: root is the
+    virtual root whose children are the root families, unit_of maps each
+    person to their unit and pending holds the units with an offset their
+    subtree has not been moved by yet (see _apply_offsets).
+    """
+    
+    __slots__ = ('root', 'unit_of', 'pending')
+    
+    def __init__(self, root, unit_of):
+        self.root = root
+        self.unit_of = unit_of
+        self.pending = set()
+    
+    def head_unit(self, head_id):
+        """The unit head_id heads, or None"""
+        unit = self.unit_of.get(head_id)
+        return unit if unit is not None and unit.head == head_id else None
+
+
+# Past this share of the nodes relinked since the units were kept,
+# building them again is cheaper than patching them one by one
+PATCH_MAX_SHARE = 0.05
+
+
+def _keep_units(tree, cache):
+    """Keep units on a tree, and watch its links from now on to patch them"""
+    tree.layout_units = cache
+    tree.watch_links()
+
+
+def _family_units(tree, memo, moved):
+    """
+    Units of the whole tree as it is now: the ones kept on it, patched for
+    the nodes relinked since, or built again if there are none to patch.
+    Nodes moved by offsets settled on the way are added to moved.
+    """
+    cache = tree.layout_units
+    relinked = tree.take_relinked()
+    if (cache is None or relinked is None
+            or len(relinked) > PATCH_MAX_SHARE * len(tree['nodes'])
+            or not _patch_units(cache, tree, relinked, memo, moved)):
+        if cache is not None:
+            moved += _apply_offsets(tree, cache)
+        with _gc_paused():
+            root, unit_of, _, _ = build_family_units(tree['nodes'], tree['edges'])
+        cache = UnitCache(root, unit_of)
+        _keep_units(tree, cache)
+    return cache
+
+
+def _subtree_rows(tree, unit):
+    """
+    Rows unit's subtree takes up, y -> (min x, max x) of its people, with
+    the offsets pending below unit but not its own, and to be moved by
+    unit.rows_dx. Fixed people, who stay where they are whatever is
+    pushed, are left out and listed in unit.fixed. Kept on the units until
+    they change, and worked out from the children's, so a change costs
+    the units above it.
+    """
+    if unit.rows is None:
+        order = []
+        stack = [unit]
+        while stack:
+            below = stack.pop()
+            order.append(below)
+            stack.extend(child for child in below.children if child.rows is None)
+        # Children before their parents
+        node = tree.node
+        for below in reversed(order):
+            rows = {}
+            fixed = []
+            for member_id in below.members:
+                member = node(member_id)
+                if member is None:
+                    continue
+                if member.get('fixed', False):
+                    fixed.append(member_id)
+                    continue
+                y, x = round(member.get('y', 0), 6), member.get('x', 0)
+                span = rows.get(y)
+                rows[y] = (x, x) if span is None else (min(span[0], x), max(span[1], x))
+            for child in below.children:
+                dx = child.offset + child.rows_dx
+                for y, (low, high) in child.rows.items():
+                    low += dx
+                    high += dx
+                    span = rows.get(y)
+                    if span is None:
+                        rows[y] = (low, high)
+                    else:
+                        rows[y] = (low if low < span[0] else span[0], high if high > span[1] else span[1])
+                if child.fixed:
+                    fixed += child.fixed
+            below.rows = rows
+            below.rows_dx = 0.0
+            below.fixed = tuple(fixed) if fixed else ()
+    return unit.rows
+
+
+def _row_spans(tree, unit):
+    """
+    Rows (y -> (min x, max x)) unit's subtree takes up, through the
+    offsets pending in it; the units above it must have none pending.
+    """
+    rows = _subtree_rows(tree, unit)
+    dx = unit.offset + unit.rows_dx
+    spans = {y: (low + dx, high + dx) for y, (low, high) in rows.items()}
+    for member_id in unit.fixed:
+        member = tree.node(member_id)
+        y, x = round(member.get('y', 0), 6), member.get('x', 0)
+        span = spans.get(y)
+        spans[y] = (x, x) if span is None else (min(span[0], x), max(span[1], x))
+    return spans
+
+
+def _rows_changed(unit):
+    """Forget the rows of unit's subtree and of the ones above it"""
+    while unit is not None and unit.rows is not None:
+        unit.rows = None
+        unit = unit.parent
+
+
+def _detach_unit(unit):
+    """Take a unit out of its parent's children"""
+    parent = unit.parent
+    if parent is not None and unit in parent.children:
+        parent.children.remove(unit)
+        for number, child in enumerate(parent.children, 1):
+            child.number = number
+        _rows_changed(parent)
+    unit.parent = None
+
+
+def _offset_above(unit):
+    """Offsets pending on the units above unit, which its subtree has yet to be moved by"""
+    dx = 0.0
+    unit = unit.parent
+    while unit is not None:
+        dx += unit.offset
+        unit = unit.parent
+    return dx
+
+
+def _move_members(tree, unit, dx, moved, junction_ids):
+    """Move a unit's people by dx (except fixed ones), collecting their junctions"""
+    for person_id in unit.members:
+        person = tree.node(person_id)
+        if person is None:
+            continue
+        if not person.get('fixed', False):
+            person['x'] = person.get('x', 0) + dx
+            moved.append(person_id)
+        for edge in tree.edges_from(person_id):
+            if edge.get('type') == 'parent_to_junction':
+                junction_ids[edge['target']] = True
+
+
+def _place_junctions(tree, junction_ids, moved):
+    """Put junctions back between their parents, adding the ones that move to moved"""
+    for junction_id in junction_ids:
+        junction_node = tree.node(junction_id)
+        if not junction_node or junction_node.get('fixed', False):
+            continue
+        parents = [parent for parent in map(tree.node, tree.junction_parents(junction_id)) if parent]
+        if parents:
+            x = sum([p.get('x', 0) for p in parents]) / len(parents)
+            if junction_node.get('x') != x:
+                junction_node['x'] = x
+                moved.append(junction_id)
+
+
+def _settle_path(tree, cache, unit, moved):
+    """
+    Move the people of unit and of the units above it by the offsets
+    pending on them, handing each offset on to the children, so nothing
+    above unit's subtree is left to move.
+    """
+    path = []
+    while unit is not None:
+        path.append(unit)
+        unit = unit.parent
+    junction_ids = {}
+    for unit in reversed(path):
+        dx = unit.offset
+        if not dx:
+            continue
+        unit.offset = 0.0
+        cache.pending.discard(unit)
+        _move_members(tree, unit, dx, moved, junction_ids)
+        unit.rows_dx += dx
+        for child in unit.children:
+            child.offset += dx
+            cache.pending.add(child)
+    _place_junctions(tree, junction_ids, moved)
+
+
+def _apply_offsets(tree, cache):
+    """
+    Move the people of each pending unit's subtree by the offsets on it
+    and the pending units inside it, in one pass from the top, and their
+    junctions with them. Returns the ids of the nodes moved.
+    """
+    moved = []
+    # junction id -> (how far its parents moved, if all the same; how many did)
+    junction_dx = {}
+    unit_of = cache.unit_of
+    node = tree.node
+    edges_from = tree.edges_from
+    for unit in sorted(cache.pending, key=lambda u: u.depth):
+        if not unit.offset:
+            # Settled already, or handed on to a pending unit above it
+            continue
+        stack = [(unit, 0.0)]
+        while stack:
+            unit, dx = stack.pop()
+            dx += unit.offset
+            unit.offset = 0.0
+            if dx:
+                unit.rows_dx += dx
+                for person_id in unit.members:
+                    # Only people still in the unit: a unit patched away
+                    # keeps its offset but no longer moves anyone
+                    if unit_of.get(person_id) is not unit:
+                        continue
+                    person = node(person_id)
+                    if person is None:
+                        continue
+                    person_dx = 0.0 if person.get('fixed', False) else dx
+                    if person_dx:
+                        person['x'] = person.get('x', 0) + person_dx
+                        moved.append(person_id)
+                    for edge in edges_from(person_id):
+                        if edge.get('type') == 'parent_to_junction':
+                            seen = junction_dx.get(edge['target'])
+                            if seen is None:
+                                junction_dx[edge['target']] = (person_dx, 1)
+                            else:
+                                junction_dx[edge['target']] = (person_dx if seen[0] == person_dx else None, seen[1] + 1)
+            stack.extend((child, dx) for child in unit.children)
+    cache.pending.clear()
+    
+    # A junction whose parents all moved by the same amount moves with them
+    placed = []
+    for junction_id, (dx, count) in junction_dx.items():
+        if dx is None or count != len(tree.junction_parents(junction_id)):
+            placed.append(junction_id)
+            continue
+        junction_node = node(junction_id)
+        if dx and junction_node and not junction_node.get('fixed', False):
+            junction_node['x'] = junction_node.get('x', 0) + dx
+            moved.append(junction_id)
+    _place_junctions(tree, placed, moved)
+    return moved
+
+
+def _forget_positions(tree_data):
+    """Forget pending offsets and rows of the kept units, for a layout that places every node anew"""
+    cache = getattr(tree_data, 'layout_units', None)
+    if cache is not None:
+        for unit in cache.pending:
+            unit.offset = 0.0
+        cache.pending.clear()
+        for unit in cache.unit_of.values():
+            unit.rows = None
+            unit.fixed = ()
+        cache.root.rows = None
+
+
+def position_changed(tree_data, node_id):
+    """Tell the kept family units a node was placed by hand, which may have taken it to another row"""
+    cache = getattr(tree_data, 'layout_units', None)
+    unit = cache.unit_of.get(node_id) if cache is not None else None
+    if unit is not None:
+        _rows_changed(unit)
+
+
+def _take_members(tree, cache, unit, moved):
+    """
+    Make unit the unit of its members. Someone coming from a unit with
+    offsets still pending over it is moved by them first, as that unit's
+    offsets will no longer reach them.
+    """
+    unit_of = cache.unit_of
+    junction_ids = {}
+    for member_id in unit.members:
+        old = unit_of.get(member_id)
+        if old is not None and old is not unit:
+            _rows_changed(old)
+            dx = old.offset + _offset_above(old)
+            if dx:
+                person = tree.node(member_id)
+                if person is not None and not person.get('fixed', False):
+                    person['x'] = person.get('x', 0) + dx
+                    moved.append(member_id)
+                    junction_ids.update((e['target'], True) for e in tree.edges_from(member_id)
+                                        if e.get('type') == 'parent_to_junction')
+        unit_of[member_id] = unit
+    _place_junctions(tree, junction_ids, moved)
+
+
+def _patch_units(cache, tree, relinked, memo, moved):
+    """
+    Bring kept units up to date after the relinked nodes changed. Every
+    unit an edit can have changed is worked out again from the index:
+    the units of the relinked people and of their partners, the units
+    owning the families they hang under or head, and the units their
+    children hung under before. The rest are kept as they are.
+    Offsets pending over the units worked out again are settled first
+    (adding the nodes they move to moved), and a unit handed to another
+    parent takes the offsets of its old one along.
+    Returns False if that does not add up to a tree, for a rebuild.
+    """
+    root, unit_of = cache.root, cache.unit_of
+    heads = set()
+    for node_id in relinked:
+        unit = unit_of.get(node_id)
+        if unit is not None:
+            heads.add(unit.head)
+            if unit.parent is not None and unit.parent is not root:
+                heads.add(unit.parent.head)
+        node = tree.node(node_id)
+        if node is None:
+            continue
+        if node.get('type') == 'person':
+            people = [node_id] + _partners(tree, node_id)
+            family_ids = [node_id] + [e['target'] for e in tree.edges_from(node_id)
+                                      if e.get('type') == 'parent_to_junction']
+            parent_family = _parent_family(tree, node_id)
+            if parent_family:
+                family_ids.append(parent_family)
+        else:
+            people = list(tree.junction_parents(node_id))
+            family_ids = [node_id]
+        heads.update(_unit_head(tree, p, memo) for p in people)
+        for family_id in family_ids:
+            owner_id = _family_owner(tree, family_id, memo)
+            if owner_id:
+                heads.add(owner_id)
+            for child_id in tree.children_of(family_id):
+                child_unit = unit_of.get(child_id)
+                if child_unit is not None and child_unit.parent is not None and child_unit.parent is not root:
+                    heads.add(child_unit.parent.head)
+    
+    for head_id in heads:
+        unit = cache.head_unit(head_id)
+        if unit is not None:
+            _settle_path(tree, cache, unit, moved)
+    
+    # Units whose head is gone or now belongs to someone else's unit
+    dropped = []
+    for head_id in heads:
+        unit = cache.head_unit(head_id)
+        if unit is not None and (not tree.node(head_id) or _unit_head(tree, head_id, memo) != head_id):
+            _detach_unit(unit)
+            dropped.append(unit)
+    for node_id in relinked:
+        if not tree.node(node_id):
+            unit_of.pop(node_id, None)
+    
+    # Members first, so children below can tell which units they belong to
+    patched = []
+    for head_id in heads:
+        node = tree.node(head_id)
+        if not node or node.get('type') != 'person' or _unit_head(tree, head_id, memo) != head_id:
+            continue
+        unit = cache.head_unit(head_id) or FamilyUnit(head_id)
+        _arrange_members(unit, _unit_members(tree, head_id, memo))
+        _take_members(tree, cache, unit, moved)
+        patched.append(unit)
+    
+    for unit in patched:
+        children = []
+        for child_id in _child_heads(tree, unit.head, unit.members, memo):
+            child = cache.head_unit(child_id)
+            if child is None:
+                # A family not kept yet: built from the index
+                _, built = build_family_subtree(tree, child_id, memo)
+                for built_unit in built:
+                    _take_members(tree, cache, built_unit, moved)
+                child = built[0]
+            children.append(child)
+        for old_child in unit.children:
+            if old_child.parent is unit:
+                old_child.parent = None
+        unit.children = children
+        for number, child in enumerate(children, 1):
+            if child.parent is not None and child.parent is not unit:
+                _carry_offsets(cache, child)
+                _detach_unit(child)
+            child.parent = unit
+            child.number = number
+        _rows_changed(unit)
+    
+    # Patched units without a family above them are root families
+    for unit in patched:
+        parent_family = _parent_family(tree, unit.head)
+        owner_id = _family_owner(tree, parent_family, memo) if parent_family else None
+        if owner_id is None or owner_id == unit.head:
+            if unit.parent is not root:
+                if unit.parent is not None:
+                    _carry_offsets(cache, unit)
+                    _detach_unit(unit)
+                unit.parent = root
+                root.children.append(unit)
+                unit.number = len(root.children)
+        elif unit.parent is None or unit.parent.head != owner_id:
+            return False
+    
+    # Everything patched, dropped or orphaned has to hang off the root again
+    for unit in patched + [child for unit in dropped for child in unit.children]:
+        depth = 0
+        above = unit.parent
+        while above is not root:
+            if above is None or depth > len(unit_of):
+                return False
+            depth += 1
+            above = above.parent
+        if unit.depth != depth:
+            _set_depths(unit, depth)
+        for child in unit.children:
+            # Children taken over from a unit on another row
+            if child.depth != depth + 1:
+                _set_depths(child, depth + 1)
+    return True
+
+
+def _carry_offsets(cache, unit):
+    """Fold the offsets pending above unit into its own, before it changes parent"""
+    dx = _offset_above(unit)
+    if dx:
+        unit.offset += dx
+        cache.pending.add(unit)
+
+
+def _set_depths(unit, depth):
+    """Give unit the depth, and the units below it theirs"""
+    unit.depth = depth
+    stack = [unit]
+    while stack:
+        parent = stack.pop()
+        for child in parent.children:
+            child.depth = parent.depth + 1
+            stack.append(child)
+
+
+def _subtree_units(unit):
+    """unit and every unit below it, each before its children"""
+    units = []
+    stack = [unit]
+    while stack:
+        unit = stack.pop()
+        units.append(unit)
+        stack.extend(unit.children)
+    return units
+
+
+def _head_x(tree, unit):
+    """Where unit's head is, through the unit's pending offset (fixed heads stay put)"""
+    head = tree.node(unit.head)
+    return head.get('x', 0) + (0.0 if head.get('fixed', False) else unit.offset)
+
+
+def _units_beside(tree, cache, unit, side):
+    """
+    Units beside unit's subtree, nearest first, on the right (side 1) or
+    left (side -1): its siblings, then its parent's, and so on up to the
+    other root families. Sides go by where the units are now, which edits
+    and dragging may have taken out of sibling order. unit and the units
+    above it must have no offsets pending (see _settle_path).
+    """
+    child = unit
+    while child.parent is not None:
+        parent = child.parent
+        child_x = tree.node(child.head).get('x', 0)
+        beside = [(side * (_head_x(tree, s) - child_x), s) for s in parent.children if s is not child]
+        yield from (s for distance, s in sorted(beside, key=lambda item: item[0]) if distance >= 0)
+        if parent is cache.root:
+            return
+        child = parent
+
+
+def _make_room(tree, cache, head_unit, new_rows, old_rows, tolerance=1e-6):
+    """
+    Push the units beside head_unit's subtree aside where its new rows
+    (y -> (min x, max x)) reach past old_rows, the rows it used before.
+    A push only adds to the pushed unit's offset and marks it pending:
+    its people are moved later, all at once (see _apply_offsets), and
+    positions in its subtree are read through the offset until then.
+    Units are taken nearest first; one that is not in the way settles the
+    rows it has someone on, since everyone further out on those rows is
+    further out still. A unit that is pushed brings its own rows into play
+    for the units beyond it, and for the ones passed over before it, which
+    need not nest with it when their heads sit on different rows.
+    head_unit and the units above it must have no offsets pending.
+    Returns how many units were pushed, or None if a unit passed over sits
+    in between the people of a pushed one, which no push can untangle.
+    """
+    pushed = 0
+    for side in (1, -1):
+        near, far = (0, 1) if side > 0 else (1, 0)
+        # Outer edge of everything moved so far, on the rows it may run into others
+        front = {}
+        for y, span in new_rows.items():
+            if y not in old_rows or side * (span[far] - old_rows[y][far]) > tolerance:
+                front[y] = span[far]
+        
+        def near_edges(unit, wanted):
+            """Nearest x unit's subtree reaches on each of the wanted rows, from head_unit's side"""
+            return {y: span[near] for y, span in _row_spans(tree, unit).items() if y in wanted}
+        
+        def push(unit, overlap):
+            """Shift a unit's subtree out; returns y -> (near, far) edges it had before"""
+            rows = _row_spans(tree, unit)
+            # Room to spare for the next edits around here, in proportion
+            # to the unit's width, so pushes do not keep rippling out
+            overlap += PUSH_SLACK * max(high - low for low, high in rows.values())
+            unit.offset += side * overlap
+            cache.pending.add(unit)
+            _rows_changed(unit.parent)
+            for y, span in rows.items():
+                front[y] = span[far] + side * overlap
+            return {y: (span[near], span[far]) for y, span in rows.items()}
+        
+        passed = []
+        for other in _units_beside(tree, cache, head_unit, side):
+            if not front:
+                break
+            edges = near_edges(other, front)
+            overlap = max((side * (front[y] - x) + TIDY_UNIT_GAP for y, x in edges.items()), default=0)
+            if overlap <= tolerance:
+                passed.append(other)
+                for y in edges:
+                    del front[y]
+                continue
+            
+            moved = push(other, overlap)
+            pushed += 1
+            # Units passed over may still be beyond the pushed one on its rows
+            while moved and passed:
+                wanted = {y: front[y] for y in moved}
+                before, moved = moved, {}
+                for passed_unit in list(passed):
+                    edges = near_edges(passed_unit, wanted)
+                    if any(side * (x - before[y][0]) > tolerance and side * (before[y][1] - x) > tolerance
+                           for y, x in edges.items()):
+                        return None
+                    overlap = max((side * (wanted[y] - x) + TIDY_UNIT_GAP for y, x in edges.items()
+                                   if side * (x - before[y][1]) >= 0), default=0)
+                    if overlap > tolerance:
+                        passed.remove(passed_unit)
+                        moved.update(push(passed_unit, overlap))
+                        pushed += 1
+    return pushed
+
+
+def relayout_family(tree_data, person_id, new_ids=()):
+    """
+    Incrementally re-layout the family of person_id after an edit.
+    The family's subtree is laid out with the tidy engine around its head's
+    current position; where it outgrows the rows its old layout used, the
+    families beside it are pushed aside (see _make_room), or a full layout
+    is requested if they cannot be. On a FamilyTree the pushed families
+    are only moved at the next settle_layout(), all pushes since in one
+    pass. Nodes marked fixed keep their position. new_ids are nodes
+    created by the edit, which have no meaningful old position.
+    Returns the head of the family that was re-laid out (None if none was).
+    """
+    tree = as_tree(tree_data)
+    if getattr(tree_data, 'layout_pending', False) or not tree.node(person_id):
+        # Already waiting for a full layout, which will cover this edit too
+        return None
+    
+    memo = {}
+    moved = []
+    new_ids = set(new_ids)
+    head_id = _unit_head(tree, person_id, memo)
+    if head_id in new_ids:
+        # A new person has no real position yet: start from the family they joined
+        parent_family = _parent_family(tree, head_id)
+        head_id = (_family_owner(tree, parent_family, memo) if parent_family else None) or head_id
+    head_node = tree.node(head_id)
+    cache = _family_units(tree, memo, moved)
+    head_unit = cache.head_unit(head_id)
+    if head_unit is None:
+        _report_moved(tree_data, moved)
+        request_full_layout(tree_data)
+        return head_id
+    _settle_path(tree, cache, head_unit, moved)
+    units = _subtree_units(head_unit)
+    
+    # Where the subtree's people are now, through the offsets pending in
+    # it; it is placed anew below, which takes the place of those offsets
+    old_dx = {head_unit: 0.0}
+    for unit in units:
+        for child in unit.children:
+            old_dx[child] = old_dx[unit] + child.offset
+    for unit in units:
+        if unit.offset:
+            unit.offset = 0.0
+            cache.pending.discard(unit)
+    
+    # Lay the subtree out on its own, under a root of its own for the walk
+    for unit in units:
+        unit.mod = unit.change = unit.shift = 0.0
+        unit.thread = None
+        unit.ancestor = unit
+    root = FamilyUnit(None)
+    root.members = []
+    root.children = [head_unit]
+    parent, number = head_unit.parent, head_unit.number
+    head_unit.parent, head_unit.number = root, 1
+    try:
+        tidy_first_walk(root)
+        tidy_second_walk(root)
+    finally:
+        head_unit.parent, head_unit.number = parent, number
+    
+    # Keep the head where it is
+    shift = head_unit.x - head_node.get('x', 0)
+    
+    def old_x(unit, index, member_id):
+        if member_id in new_ids:
+            return None
+        member = tree.node(member_id)
+        if member.get('fixed', False):
+            return member.get('x', 0)
+        return member.get('x', 0) + old_dx[unit]
+    
+    def new_x(unit, index, member_id):
+        member = tree.node(member_id)
+        if member.get('fixed', False):
+            return old_x(unit, index, member_id)
+        return unit.x - unit.left_extent - shift + index * TIDY_SPOUSE_SPACING
+    
+    def by_y(rows):
+        return {round(head_node.get('y', 0) + (depth - head_unit.depth) * TIDY_Y_SPACING, 6): span
+                for depth, span in rows.items()}
+    
+    new_rows = by_y(_row_extents(units, new_x))
+    old_rows = by_y(_row_extents(units, old_x))
+    
+    # Nodes touched by the placement: members, their junctions and co-parents
+    node_by_id = {}
+    junction_parents = {}
+    for unit in units:
+        for member_id in unit.members:
+            node_by_id[member_id] = tree.node(member_id)
+            for edge in tree.edges_from(member_id):
+                if edge.get('type') == 'parent_to_junction':
+                    junction_id = edge['target']
+                    junction_parents[junction_id] = tree.junction_parents(junction_id)
+                    node_by_id[junction_id] = tree.node(junction_id)
+    for parent_ids in junction_parents.values():
+        for parent_id in parent_ids:
+            if parent_id not in node_by_id and tree.node(parent_id):
+                node_by_id[parent_id] = tree.node(parent_id)
+    
+    # Units keep their depth in the whole tree, so rows start above the head
+    placed = place_family_units(root, node_by_id, junction_parents, shift,
+                                y_origin=head_node.get('y', 0) - head_unit.depth * TIDY_Y_SPACING,
+                                level_origin=head_node.get('level', 0) - head_unit.depth,
+                                respect_fixed=True)
+    moved += placed
+    # Kept rows of the units whose people are somewhere else now
+    for unit in units:
+        if old_dx[unit]:
+            _rows_changed(unit)
+    for node_id in placed:
+        unit = cache.unit_of.get(node_id)
+        if unit is not None:
+            _rows_changed(unit)
+    if _make_room(tree, cache, head_unit, new_rows, old_rows) is None:
+        # Subtrees grown into each other: only a full layout sorts them out
+        _report_moved(tree_data, moved)
+        request_full_layout(tree_data)
+        return head_id
+    if not isinstance(tree_data, FamilyTree):
+        # A plain dict does not keep its units to settle later
+        moved += _apply_offsets(tree, cache)
+    _report_moved(tree_data, list(dict.fromkeys(moved)))
+    return head_id
+
+
+# Engines offered by the "Reset Layout" control
+LAYOUT_ENGINES = {
+    'Hierarchical': apply_hierarchical_layout,
+    'Tidy tree': apply_tidy_layout,
+}
@@ -1,8 +1,11 @@
-import base64
+from utils.tree_model import as_tree
+from utils.photo_store import store_upload
+from components.layout_manager import relayout_family, family_anchor, detaches_relatives, request_full_layout, settle_position
 
 def position_new_node(tree_data, new_node_id, parent_id=None, sibling_id=None, spouse_id=None):
     """Smart positioning for new node only - doesn't touch existing or fixed nodes"""
-    new_node = next((n for n in tree_data['nodes'] if n['id'] == new_node_id), None)
+    tree = as_tree(tree_data)
+    new_node = tree.node(new_node_id)
     if not new_node:
         return
     
@@ -10,14 +13,17 @@ def position_new_node(tree_data, new_node_id, parent_id=None, sibling_id=None, s
     if new_node.get('fixed', False):
         return
     
+    # Placed from where the person it goes with really is now
+    for reference_id in (parent_id, sibling_id, spouse_id):
+        if reference_id:
+            settle_position(tree, reference_id)
+    
     if parent_id:
         # Child node - position below parent
-        parent = next((n for n in tree_data['nodes'] if n['id'] == parent_id), None)
+        parent = tree.node(parent_id)
         if parent:
             # Count siblings to space horizontally
-            siblings = [n for n in tree_data['nodes'] 
-                       if n.get('level') == parent.get('level', 0) + 1 
-                       and n.get('type') == 'person']
+            siblings = get_children(tree, parent_id)
             offset = len(siblings) * 150
             new_node['x'] = parent.get('x', 400) + offset - 150
             new_node['y'] = parent.get('y', 50) + 200
@@ -25,7 +31,7 @@ def position_new_node(tree_data, new_node_id, parent_id=None, sibling_id=None, s
     
     elif sibling_id:
         # Sibling node - position next to sibling
-        sibling = next((n for n in tree_data['nodes'] if n['id'] == sibling_id), None)
+        sibling = tree.node(sibling_id)
         if sibling:
             new_node['x'] = sibling.get('x', 400) + 200
             new_node['y'] = sibling.get('y', 50)
@@ -33,7 +39,7 @@ def position_new_node(tree_data, new_node_id, parent_id=None, sibling_id=None, s
     
     elif spouse_id:
         # Spouse node - position next to spouse
-        spouse = next((n for n in tree_data['nodes'] if n['id'] == spouse_id), None)
+        spouse = tree.node(spouse_id)
         if spouse:
             new_node['x'] = spouse.get('x', 400) + 200
             new_node['y'] = spouse.get('y', 50)
@@ -45,19 +51,35 @@ def position_new_node(tree_data, new_node_id, parent_id=None, sibling_id=None, s
         new_node['y'] = 50
         new_node['level'] = 0
 
+def get_children(tree_data, parent_id):
+    """Children of a person, directly or through any junction they belong to"""
+    tree = as_tree(tree_data)
+    
+    families = [parent_id] + [e['target'] for e in tree.edges_from(parent_id)
+                              if e.get('type') == 'parent_to_junction']
+    
+    # Each family keeps its children in the order they were added
+    children = []
+    for family_id in families:
+        for child_id in tree.children_of(family_id):
+            child = tree.node(child_id)
+            if child and child.get('type') == 'person':
+                children.append(child)
+    return children
+
 def add_root_node(tree_data, name, birth_date, death_date, photo_file):
     """Add root node to tree"""
-    photo_b64 = None
-    if photo_file:
-        photo_b64 = base64.b64encode(photo_file.read()).decode()
+    tree = as_tree(tree_data)
     
-    node_id = f"person_{len(tree_data['nodes'])}"
+    photo_hash = store_upload(photo_file)
+    
+    node_id = tree.next_id('person')
     node = {
         'id': node_id,
         'name': name,
         'birth_date': birth_date,
         'death_date': death_date,
-        'photo': photo_b64,
+        'photo_hash': photo_hash,
         'type': 'person',
         'level': 0,
         'x': 0,
@@ -65,26 +87,27 @@ def add_root_node(tree_data, name, birth_date, death_date, photo_file):
         'fixed': False
     }
     
-    tree_data['nodes'].append(node)
-    position_new_node(tree_data, node_id)
+    tree.add_node(node)
+    position_new_node(tree, node_id)
+    tree.mark_changed([node_id])
 
 def add_child(tree_data, parent_id, name, birth_date, death_date, photo_file):
     """Add child to selected parent"""
-    photo_b64 = None
-    if photo_file:
-        photo_b64 = base64.b64encode(photo_file.read()).decode()
+    tree = as_tree(tree_data)
     
-    parent = next((n for n in tree_data['nodes'] if n['id'] == parent_id), None)
+    parent = tree.node(parent_id)
     if not parent:
         return
     
-    child_id = f"person_{len(tree_data['nodes'])}"
+    photo_hash = store_upload(photo_file)
+    
+    child_id = tree.next_id('person')
     child_node = {
         'id': child_id,
         'name': name,
         'birth_date': birth_date,
         'death_date': death_date,
-        'photo': photo_b64,
+        'photo_hash': photo_hash,
         'type': 'person',
         'level': parent['level'] + 1,
         'x': 0,
@@ -92,20 +115,15 @@ def add_child(tree_data, parent_id, name, birth_date, death_date, photo_file):
         'fixed': False
     }
     
-    tree_data['nodes'].append(child_node)
+    tree.add_node(child_node)
     
     # Find if parent has spouse with junction
-    parent_edges = [e for e in tree_data['edges'] if e['source'] == parent_id or e['target'] == parent_id]
+    parent_edges = tree.edges_of(parent_id)
     junction_edge = next((e for e in parent_edges if e.get('type') == 'parent_to_junction'), None)
     
     if junction_edge:
         # Junction already exists - connect to it
-        junction_id = junction_edge['target']
-        tree_data['edges'].append({
-            'source': child_id,
-            'target': junction_id,
-            'type': 'child_to_parent'
-        })
+        tree.add_edge(child_id, junction_edge['target'], 'child_to_parent')
     else:
         # Check if parent has a spouse (via 'spouse' edge)
         spouse_edge = next((e for e in parent_edges if e.get('type') == 'spouse'), None)
@@ -115,10 +133,10 @@ def add_child(tree_data, parent_id, name, birth_date, death_date, photo_file):
             spouse_id = spouse_edge['target'] if spouse_edge['source'] == parent_id else spouse_edge['source']
             
             # Remove the old spouse edge
-            tree_data['edges'].remove(spouse_edge)
+            tree.remove_edge(spouse_edge)
             
             # Create junction node
-            junction_id = f"junction_{len(tree_data['nodes'])}"
+            junction_id = tree.next_id('junction')
             junction_node = {
                 'id': junction_id,
                 'type': 'junction',
@@ -127,97 +145,41 @@ def add_child(tree_data, parent_id, name, birth_date, death_date, photo_file):
                 'y': parent.get('y', 0) + 50,
                 'fixed': False
             }
-            tree_data['nodes'].append(junction_node)
+            tree.add_node(junction_node)
             
             # Connect both parents to junction
-            tree_data['edges'].append({
-                'source': parent_id,
-                'target': junction_id,
-                'type': 'parent_to_junction'
-            })
-            tree_data['edges'].append({
-                'source': spouse_id,
-                'target': junction_id,
-                'type': 'parent_to_junction'
-            })
+            tree.add_edge(parent_id, junction_id, 'parent_to_junction')
+            tree.add_edge(spouse_id, junction_id, 'parent_to_junction')
             
             # Connect child to junction
-            tree_data['edges'].append({
-                'source': child_id,
-                'target': junction_id,
-                'type': 'child_to_parent'
-            })
+            tree.add_edge(child_id, junction_id, 'child_to_parent')
         else:
             # No spouse - direct connection to parent
-            tree_data['edges'].append({
-                'source': child_id,
-                'target': parent_id,
-                'type': 'child_to_parent'
-            })
-    
-    position_new_node(tree_data, child_id, parent_id=parent_id)
-    # === ADD THIS REBALANCING CODE HERE ===
-    
-    # Find ALL children of this parent
-    all_children = []
-    for node in tree_data['nodes']:
-        if node.get('type') == 'person' and node.get('level') == parent['level'] + 1:
-            # Check if this node is connected to parent
-            for edge in tree_data['edges']:
-                if edge.get('type') == 'child_to_parent' and edge['source'] == node['id']:
-                    target = edge['target']
-                    # Check if target is parent OR junction connected to parent
-                    if target == parent_id:
-                        all_children.append(node)
-                        break
-                    else:
-                        # Check if junction connects to parent
-                        for p_edge in tree_data['edges']:
-                            if (p_edge.get('type') == 'parent_to_junction' and 
-                                p_edge['source'] == parent_id and 
-                                p_edge['target'] == target):
-                                all_children.append(node)
-                                break
-                        break
-    
-    # Rebalance children around parent center
-    if all_children:
-        num_children = len(all_children)
-        spacing = 200
-        parent_x = parent.get('x', 0)
-        parent_y = parent.get('y', 0)
-        
-        # Calculate spread positions
-        if num_children % 2 == 1:  # Odd: -200, 0, 200
-            for i, child in enumerate(all_children):
-                offset = (i - num_children // 2) * spacing
-                child['x'] = parent_x + offset
-                child['y'] = parent_y + 150
-        else:  # Even: -300, -100, 100, 300
-            for i, child in enumerate(all_children):
-                offset = (i - num_children / 2 + 0.5) * spacing
-                child['x'] = parent_x + offset
-                child['y'] = parent_y + 150
+            tree.add_edge(child_id, parent_id, 'child_to_parent')
     
+    position_new_node(tree, child_id, parent_id=parent_id)
     
+    # Re-layout just this sibling set, pushing the families around it aside if it no longer fits
+    relayout_family(tree_data, child_id, new_ids=[child_id])
+    tree.mark_changed([child_id])
 
 def add_spouse(tree_data, person_id, name, birth_date, death_date, photo_file):
     """Add spouse to selected person"""
-    photo_b64 = None
-    if photo_file:
-        photo_b64 = base64.b64encode(photo_file.read()).decode()
+    tree = as_tree(tree_data)
     
-    person = next((n for n in tree_data['nodes'] if n['id'] == person_id), None)
+    person = tree.node(person_id)
     if not person:
         return
     
-    spouse_id = f"person_{len(tree_data['nodes'])}"
+    photo_hash = store_upload(photo_file)
+    
+    spouse_id = tree.next_id('person')
     spouse_node = {
         'id': spouse_id,
         'name': name,
         'birth_date': birth_date,
         'death_date': death_date,
-        'photo': photo_b64,
+        'photo_hash': photo_hash,
         'type': 'person',
         'level': person['level'],
         'x': 0,
@@ -225,15 +187,14 @@ def add_spouse(tree_data, person_id, name, birth_date, death_date, photo_file):
         'fixed': False
     }
     
-    tree_data['nodes'].append(spouse_node)
+    tree.add_node(spouse_node)
     
     # Check if person already has children
-    children = [e for e in tree_data['edges'] 
-                if e.get('target') == person_id and e.get('type') == 'child_to_parent']
+    children = [e for e in tree.edges_to(person_id) if e.get('type') == 'child_to_parent']
     
     if children:
         # Create junction node
-        junction_id = f"junction_{len(tree_data['nodes'])}"
+        junction_id = tree.next_id('junction')
         junction_node = {
             'id': junction_id,
             'type': 'junction',
@@ -243,50 +204,40 @@ def add_spouse(tree_data, person_id, name, birth_date, death_date, photo_file):
             'fixed': False
         }
         
-        tree_data['nodes'].append(junction_node)
+        tree.add_node(junction_node)
         
         # Connect both spouses to junction
-        tree_data['edges'].append({
-            'source': person_id,
-            'target': junction_id,
-            'type': 'parent_to_junction'
-        })
-        tree_data['edges'].append({
-            'source': spouse_id,
-            'target': junction_id,
-            'type': 'parent_to_junction'
-        })
+        tree.add_edge(person_id, junction_id, 'parent_to_junction')
+        tree.add_edge(spouse_id, junction_id, 'parent_to_junction')
         
         # Update children to point to junction
         for edge in children:
-            edge['target'] = junction_id
+            tree.set_edge_target(edge, junction_id)
     else:
         # Simple spouse connection
-        tree_data['edges'].append({
-            'source': person_id,
-            'target': spouse_id,
-            'type': 'spouse'
-        })
+        tree.add_edge(person_id, spouse_id, 'spouse')
     
-    position_new_node(tree_data, spouse_id, spouse_id=person_id)
+    position_new_node(tree, spouse_id, spouse_id=person_id)
+    relayout_family(tree_data, spouse_id, new_ids=[spouse_id])
+    tree.mark_changed([spouse_id])
 
 def add_sibling(tree_data, person_id, name, birth_date, death_date, photo_file):
     """Add sibling to selected person"""
-    photo_b64 = None
-    if photo_file:
-        photo_b64 = base64.b64encode(photo_file.read()).decode()
+    tree = as_tree(tree_data)
     
-    person = next((n for n in tree_data['nodes'] if n['id'] == person_id), None)
+    person = tree.node(person_id)
     if not person:
         return
     
-    sibling_id = f"person_{len(tree_data['nodes'])}"
+    photo_hash = store_upload(photo_file)
+    
+    sibling_id = tree.next_id('person')
     sibling_node = {
         'id': sibling_id,
         'name': name,
         'birth_date': birth_date,
         'death_date': death_date,
-        'photo': photo_b64,
+        'photo_hash': photo_hash,
         'type': 'person',
         'level': person['level'],
         'x': 0,
@@ -294,20 +245,17 @@ def add_sibling(tree_data, person_id, name, birth_date, death_date, photo_file):
         'fixed': False
     }
     
-    tree_data['nodes'].append(sibling_node)
+    tree.add_node(sibling_node)
     
     # Find parent connection
-    parent_edge = next((e for e in tree_data['edges'] 
-                       if e['source'] == person_id and e['type'] == 'child_to_parent'), None)
+    parent_edge = tree.parent_link(person_id)
     
     if parent_edge:
-        tree_data['edges'].append({
-            'source': sibling_id,
-            'target': parent_edge['target'],
-            'type': 'child_to_parent'
-        })
+        tree.add_edge(sibling_id, parent_edge['target'], 'child_to_parent')
     
-    position_new_node(tree_data, sibling_id, sibling_id=person_id)
+    position_new_node(tree, sibling_id, sibling_id=person_id)
+    relayout_family(tree_data, sibling_id, new_ids=[sibling_id])
+    tree.mark_changed([sibling_id])
 
 def add_same_level(tree_data, reference_node_id, name, birth_date, death_date, photo_file):
     """
@@ -316,10 +264,13 @@ def add_same_level(tree_data, reference_node_id, name, birth_date, death_date, p
     """
     import uuid
     
+    tree = as_tree(tree_data)
+    
     # Find reference node
-    ref_node = next((n for n in tree_data['nodes'] if n['id'] == reference_node_id), None)
+    ref_node = tree.node(reference_node_id)
     if not ref_node:
         return
+    settle_position(tree, reference_node_id)
     
     # Get reference node's level and position
     ref_level = ref_node.get('level', 0)
@@ -330,11 +281,7 @@ def add_same_level(tree_data, reference_node_id, name, birth_date, death_date, p
     new_id = f"person_{uuid.uuid4().hex[:8]}"
     
     # Process photo if provided
-    photo_b64 = None
-    if photo_file:
-        import base64
-        photo_bytes = photo_file.read()
-        photo_b64 = base64.b64encode(photo_bytes).decode('utf-8')
+    photo_hash = store_upload(photo_file)
     
     # Create new node at same level, offset horizontally
     new_node = {
@@ -343,7 +290,7 @@ def add_same_level(tree_data, reference_node_id, name, birth_date, death_date, p
         'birth_date': birth_date,
         'death_date': death_date,
         'date': birth_date,  # Keep for backward compatibility
-        'photo': photo_b64,
+        'photo_hash': photo_hash,
         'type': 'person',
         'level': ref_level,  # Same level as reference
         'x': ref_x + 250,  # Offset 250 pixels to the right
@@ -351,14 +298,16 @@ def add_same_level(tree_data, reference_node_id, name, birth_date, death_date, p
         'fixed': True  # Keep position fixed
     }
     
-    tree_data['nodes'].append(new_node)
+    tree.add_node(new_node)
+    tree.mark_changed([new_id])
     
     # No edges added - this is an independent node at same generation
 
 
 def edit_node(tree_data, node_id, name, birth_date, death_date, photo_file):
     """Edit existing node"""
-    node = next((n for n in tree_data['nodes'] if n['id'] == node_id), None)
+    tree = as_tree(tree_data)
+    node = tree.node(node_id)
     if not node:
         return
     
@@ -367,14 +316,49 @@ def edit_node(tree_data, node_id, name, birth_date, death_date, photo_file):
     node['death_date'] = death_date
     
     if photo_file:
-        photo_b64 = base64.b64encode(photo_file.read()).decode()
-        node['photo'] = photo_b64
+        node['photo_hash'] = store_upload(photo_file)
+        node.pop('photo', None)
+    
+    tree.mark_changed([node_id])
     
     # Don't reposition when editing
 
 def delete_node(tree_data, node_id):
     """Delete node and its edges"""
-    tree_data['nodes'] = [n for n in tree_data['nodes'] if n['id'] != node_id]
-    tree_data['edges'] = [e for e in tree_data['edges'] 
-                         if e['source'] != node_id and e['target'] != node_id]
-    # Don't reposition remaining nodes
+    tree = as_tree(tree_data)
+    
+    # Family that closes the gap: the parents' family for a child, the
+    # partner's family for someone who married in
+    anchor_id = None
+    detached = False
+    node = tree.node(node_id)
+    if node and node.get('type') == 'person':
+        anchor_id = family_anchor(tree, node_id)
+        detached = detaches_relatives(tree, node_id)
+    
+    tree.remove_node(node_id)
+    if node_id in tree_data.get('collapsed', []):
+        tree_data['collapsed'].remove(node_id)
+    
+    if detached:
+        # Relatives left behind become a tree of their own, which can land anywhere
+        request_full_layout(tree_data)
+    elif anchor_id and tree.node(anchor_id):
+        # Only re-layout that family; everything else stays put
+        relayout_family(tree_data, anchor_id)
+    
+    tree.mark_changed([node_id])
+
+def toggle_collapsed(tree_data, node_id):
+    """
+    Collapse or expand the branch below a person or junction; the state is
+    kept in the tree's 'collapsed' list. Returns True if now collapsed.
+    """
+    tree = as_tree(tree_data)
+    collapsed = tree_data.setdefault('collapsed', [])
+    if node_id in collapsed:
+        collapsed.remove(node_id)
+    else:
+        collapsed.append(node_id)
+    tree.mark_changed([node_id], reason='collapse')
+    return node_id in collapsed
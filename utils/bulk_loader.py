@@ -0,0 +1,104 @@
+from utils.tree_model import FamilyTree
+from components.layout_manager import LAYOUT_ENGINES
+
+
+def bulk_load(people_iter, relations_iter, layout='Tidy tree'):
+    """
+    Build a tree from streams of people and relations in one pass each.
+
+    people_iter yields dicts with an 'id' (any hashable, e.g. the id in
+    the source system) and optional 'name', 'birth_date', 'death_date'
+    and 'photo_hash' (see utils.photo_store). relations_iter yields
+    ('parent', parent_id, child_id) or ('spouse', id1, id2) tuples using
+    those ids.
+
+    Nodes and edges come out the way the node_manager functions make them:
+    a couple with children shares a junction, a childless couple gets a
+    spouse edge, a child with one known parent links to that parent. No
+    per-node positioning is done; one layout from LAYOUT_ENGINES runs at
+    the end (layout=None skips it). Returns a FamilyTree.
+    """
+    nodes = []
+    edges = []
+    node_id_of = {}
+
+    for person in people_iter:
+        if person['id'] in node_id_of:
+            continue
+        node_id = f"person_{len(nodes)}"
+        node_id_of[person['id']] = node_id
+        nodes.append({
+            'id': node_id,
+            'name': person.get('name', ''),
+            'birth_date': person.get('birth_date', ''),
+            'death_date': person.get('death_date', ''),
+            'photo_hash': person.get('photo_hash'),
+            'type': 'person',
+            'level': 0,
+            'x': 0,
+            'y': 0,
+            'fixed': False
+        })
+
+    parents_of = {}
+    couples = {}
+    skipped = 0
+
+    for kind, first, second in relations_iter:
+        first, second = node_id_of.get(first), node_id_of.get(second)
+        if first is None or second is None or first == second:
+            skipped += 1
+        elif kind == 'parent':
+            parents = parents_of.setdefault(second, [])
+            if first not in parents:
+                parents.append(first)
+        elif kind == 'spouse':
+            couples.setdefault(frozenset((first, second)), (first, second))
+        else:
+            skipped += 1
+
+    # Junction per couple with children, created the first time it is needed
+    junction_of = {}
+    extra_parents = 0
+
+    for child_id, parent_ids in parents_of.items():
+        if len(parent_ids) > 2:
+            extra_parents += 1
+        if len(parent_ids) == 1:
+            edges.append({'source': child_id, 'target': parent_ids[0], 'type': 'child_to_parent'})
+            continue
+
+        couple = frozenset(parent_ids[:2])
+        junction_id = junction_of.get(couple)
+        if junction_id is None:
+            junction_id = f"junction_{len(nodes)}"
+            junction_of[couple] = junction_id
+            couples.setdefault(couple, tuple(parent_ids[:2]))
+            nodes.append({
+                'id': junction_id,
+                'type': 'junction',
+                'level': 0,
+                'x': 0,
+                'y': 0,
+                'fixed': False
+            })
+            for parent_id in couples[couple]:
+                edges.append({'source': parent_id, 'target': junction_id, 'type': 'parent_to_junction'})
+        edges.append({'source': child_id, 'target': junction_id, 'type': 'child_to_parent'})
+
+    # Couples without children together keep a plain spouse edge
+    for couple, (first, second) in couples.items():
+        if couple not in junction_of:
+            edges.append({'source': first, 'target': second, 'type': 'spouse'})
+
+    if skipped:
+        print(f"Warning: skipped {skipped} relation(s) with unknown people or type")
+    if extra_parents:
+        print(f"Warning: {extra_parents} child(ren) had more than two parents, only the first two were kept")
+
+    tree = FamilyTree({'nodes': nodes, 'edges': edges})
+
+    if layout:
+        LAYOUT_ENGINES[layout](tree)
+
+    return tree
@@ -1,9 +1,11 @@
+from utils.tree_model import FamilyTree
+
 def initialize_tree():
     """Initialize empty tree structure"""
-    return {
+    return FamilyTree({
         'nodes': [],
         'edges': []
-    }
+    })
 
 def format_date_range(birth_date, death_date=''):
     """Format date range for display (birth-death)"""
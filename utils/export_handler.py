@@ -1,11 +1,23 @@
+import hashlib
+import io
 import json
-from utils.pdf_renderer import export_tree_to_pdf_visual, export_tree_to_pdf_list
+from concurrent.futures import ThreadPoolExecutor
+from utils.gedcom_handler import write_gedcom
+from utils.tree_file import encode_tree
+from utils.photo_store import node_photo_base64
+from utils.pdf_renderer import export_tree_to_pdf_visual, export_tree_to_pdf_tiled, export_tree_to_pdf_list, TILED_MIN_PEOPLE
 
 def export_to_json(tree_data):
-    """Export tree as JSON string with positions"""
+    """
+    Export tree as JSON string with positions. Photos go along as base64
+    'photo' fields (the original upload), which importing moves back into
+    the photo store (see migrate_photos).
+    """
     clean_data = {
         'nodes': [],
-        'edges': tree_data.get('edges', [])
+        'edges': tree_data.get('edges', []),
+        # Collapsed branches of the graph view
+        'collapsed': tree_data.get('collapsed', [])
     }
     
     # Export all nodes (person and junction) WITH positions and fixed flag
@@ -16,13 +28,16 @@ def export_to_json(tree_data):
                 'name': n['name'],
                 'birth_date': n.get('birth_date', ''),
                 'death_date': n.get('death_date', ''),
-                'photo': n.get('photo'),
+                'photo_hash': n.get('photo_hash'),
                 'type': 'person',
                 'x': n.get('x', 0),
                 'y': n.get('y', 0),
                 'level': n.get('level', 0),
                 'fixed': n.get('fixed', False)
             })
+            photo = node_photo_base64(n, None)
+            if photo:
+                clean_data['nodes'][-1]['photo'] = photo
         elif n.get('type') == 'junction':
             clean_data['nodes'].append({
                 'id': n['id'],
@@ -35,9 +50,24 @@ def export_to_json(tree_data):
     
     return json.dumps(clean_data, indent=2)
 
-def export_to_pdf(tree_data):
-    """Export tree as visual PDF"""
+def export_to_gedcom(tree_data):
+    """Export tree as GEDCOM 5.5.1 string"""
+    out = io.StringIO()
+    write_gedcom(tree_data, out)
+    return out.getvalue()
+
+def export_to_tree_file(tree_data):
+    """Export tree as a binary tree file (utils.tree_file) with its photos"""
+    return encode_tree(tree_data, photos=True)
+
+def export_to_pdf(tree_data, tiled=None):
+    """Export tree as visual PDF; large trees (or tiled=True) are tiled over several pages"""
     try:
+        if tiled is None:
+            people = sum(1 for n in tree_data.get('nodes', []) if n.get('type') == 'person')
+            tiled = people > TILED_MIN_PEOPLE
+        if tiled:
+            return export_tree_to_pdf_tiled(tree_data)
         return export_tree_to_pdf_visual(tree_data)
     except Exception as e:
         print(f"Visual export failed: {e}")
@@ -47,3 +77,43 @@ def export_to_pdf(tree_data):
             return export_tree_to_pdf_list(tree_data)
         except:
             return b""
+
+# Exports asked for from the UI are built off the script thread, so reruns
+# stay responsive while a large PDF renders
+_export_pool = ThreadPoolExecutor(max_workers=2)
+
+# Format -> (exporter, file extension, mime type)
+EXPORT_FORMATS = {
+    'JSON': (export_to_json, 'json', 'application/json'),
+    'PDF': (export_to_pdf, 'pdf', 'application/pdf'),
+    'GEDCOM': (export_to_gedcom, 'ged', 'text/plain'),
+    'FTREE': (export_to_tree_file, 'ftree', 'application/octet-stream'),
+}
+
+# Formats that hold no positions, collapsed state or photos: their export
+# only changes with the tree's structure_hash
+STRUCTURE_ONLY_FORMATS = {'GEDCOM'}
+
+def tree_fingerprint(tree_data, export_format=None):
+    """Key of the tree's content for an export; a cached export is reused while it matches"""
+    if export_format in STRUCTURE_ONLY_FORMATS and hasattr(tree_data, 'structure_hash'):
+        # Stable across sessions and moves, so re-laying out or reloading
+        # the tree keeps the export
+        return ('structure', tree_data.structure_hash)
+    if hasattr(tree_data, 'version'):
+        return tree_data.version
+    # Plain dicts keep no revision: hash the content
+    content = json.dumps({'nodes': tree_data.get('nodes', []), 'edges': tree_data.get('edges', [])},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def start_export(export_format, tree_data):
+    """Build an export in the background from a snapshot of the tree; returns a Future"""
+    # Later edits must not reach a half-built export
+    snapshot = {
+        'nodes': [dict(n) for n in tree_data.get('nodes', [])],
+        'edges': [dict(e) for e in tree_data.get('edges', [])],
+        'collapsed': list(tree_data.get('collapsed', []))
+    }
+    exporter = EXPORT_FORMATS[export_format][0]
+    return _export_pool.submit(exporter, snapshot)
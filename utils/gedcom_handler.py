@@ -0,0 +1,197 @@
+import io
+import time
+
+from utils.bulk_loader import bulk_load
+from utils.tree_model import as_tree
+
+
+def _open_text(source):
+    """Text line iterator for a path, a binary file (e.g. an upload) or a text file"""
+    if isinstance(source, str):
+        return open(source, encoding='utf-8-sig', errors='replace')
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding='utf-8-sig', errors='replace')
+
+
+def _parse_line(line):
+    """Split a GEDCOM line into (level, xref, tag, value); None if malformed"""
+    parts = line.strip().split(' ', 2)
+    if len(parts) < 2 or not (parts[0].isascii() and parts[0].isdigit()):
+        return None
+    level = int(parts[0])
+    if parts[1].startswith('@'):
+        xref = parts[1]
+        rest = parts[2].split(' ', 1) if len(parts) > 2 else ['']
+        tag, value = rest[0], rest[1] if len(rest) > 1 else ''
+    else:
+        xref = None
+        tag, value = parts[1], parts[2] if len(parts) > 2 else ''
+    return level, xref, tag.upper(), value
+
+
+def _records(lines):
+    """Yield (xref, tag, [(level, tag, value), ...]) per level-0 record"""
+    record = None
+    for line in lines:
+        parsed = _parse_line(line)
+        if parsed is None:
+            continue
+        level, xref, tag, value = parsed
+        if level == 0:
+            if record:
+                yield record
+            record = (xref, tag, [])
+        elif record:
+            record[2].append((level, tag, value))
+    if record:
+        yield record
+
+
+def _person_from(xref, lines):
+    """Person dict for bulk_load from an INDI record"""
+    person = {'id': xref, 'name': '', 'birth_date': '', 'death_date': ''}
+    event = None
+    for level, tag, value in lines:
+        if level == 1:
+            event = tag
+            if tag == 'NAME' and not person['name']:
+                # Surname is written between slashes: "John /Smith/"
+                person['name'] = ' '.join(value.replace('/', ' ').split())
+        elif level == 2 and tag == 'DATE':
+            if event == 'BIRT' and not person['birth_date']:
+                person['birth_date'] = value.strip()
+            elif event == 'DEAT' and not person['death_date']:
+                person['death_date'] = value.strip()
+    return person
+
+
+def _relations_from(lines):
+    """('spouse' / 'parent', ...) relations from a FAM record"""
+    parent_ids = [value.strip() for level, tag, value in lines
+                  if level == 1 and tag in ('HUSB', 'WIFE')]
+    child_ids = [value.strip() for level, tag, value in lines
+                 if level == 1 and tag == 'CHIL']
+    relations = []
+    if len(parent_ids) >= 2:
+        relations.append(('spouse', parent_ids[0], parent_ids[1]))
+    for child_id in child_ids:
+        for parent_id in parent_ids:
+            relations.append(('parent', parent_id, child_id))
+    return relations
+
+
+def read_gedcom(source, layout='Tidy tree'):
+    """
+    Read a GEDCOM file (path or file object) into a FamilyTree.
+    INDI records become people; a FAM record becomes a junction (couple
+    with children), a spouse edge (childless couple) or direct child links
+    (single parent). Records are parsed as they stream past and handed to
+    bulk_load, so only the relations, not the file, are held in memory.
+    Returns (tree, stats) where stats has 'records', 'people', 'families',
+    'seconds' and 'records_per_second'. Raises ValueError if the file holds
+    no GEDCOM records at all.
+    """
+    start = time.perf_counter()
+    stats = {'records': 0, 'people': 0, 'families': 0}
+    relations = []
+    lines = _open_text(source)
+
+    def people():
+        # bulk_load reads every person before any relation, so FAM records
+        # met along the way only leave their relations behind
+        for xref, tag, record_lines in _records(lines):
+            stats['records'] += 1
+            if tag == 'INDI' and xref:
+                stats['people'] += 1
+                yield _person_from(xref, record_lines)
+            elif tag == 'FAM':
+                stats['families'] += 1
+                relations.extend(_relations_from(record_lines))
+
+    try:
+        tree = bulk_load(people(), iter(relations), layout=layout)
+    finally:
+        if isinstance(source, str):
+            lines.close()
+
+    if not stats['records']:
+        raise ValueError("not a GEDCOM file: no records found")
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['records_per_second'] = stats['records'] / stats['seconds'] if stats['seconds'] else 0.0
+    return tree, stats
+
+
+def write_gedcom(tree_data, out):
+    """
+    Write the tree as GEDCOM 5.5.1 to a text file object, one record at a
+    time. Couples have no recorded sex, so the first parent of a family is
+    written as HUSB and the second as WIFE.
+    Returns stats with 'records', 'seconds' and 'records_per_second'.
+    """
+    start = time.perf_counter()
+    tree = as_tree(tree_data)
+    persons = [n for n in tree['nodes'] if n.get('type') == 'person']
+    person_xref = {n['id']: f"@I{i}@" for i, n in enumerate(persons, 1)}
+
+    # Families first, so individuals can point at them:
+    # (xref, parent ids, child ids) for junctions, single parents and childless couples
+    families = []
+    fams = {}
+    famc = {}
+
+    def add_family(parent_ids, child_ids):
+        xref = f"@F{len(families) + 1}@"
+        families.append((xref, parent_ids, child_ids))
+        for parent_id in parent_ids:
+            fams.setdefault(parent_id, []).append(xref)
+        for child_id in child_ids:
+            famc.setdefault(child_id, xref)
+
+    for node in tree['nodes']:
+        if node.get('type') == 'junction':
+            parent_ids = [p for p in tree.junction_parents(node['id']) if p in person_xref]
+            child_ids = [c for c in tree.children_of(node['id']) if c in person_xref]
+            if parent_ids or child_ids:
+                add_family(parent_ids, child_ids)
+    for person in persons:
+        child_ids = [c for c in tree.children_of(person['id']) if c in person_xref]
+        if child_ids:
+            add_family([person['id']], child_ids)
+    for edge in tree['edges']:
+        if (edge.get('type') == 'spouse' and edge['source'] in person_xref
+                and edge['target'] in person_xref and edge['source'] != edge['target']):
+            add_family([edge['source'], edge['target']], [])
+
+    out.write("0 HEAD\n1 SOUR FAMILY_TREE_MAKER\n1 GEDC\n2 VERS 5.5.1\n"
+              "2 FORM LINEAGE-LINKED\n1 CHAR UTF-8\n")
+
+    for person in persons:
+        lines = [f"0 {person_xref[person['id']]} INDI"]
+        if person.get('name'):
+            lines.append(f"1 NAME {person['name']}")
+        if person.get('birth_date'):
+            lines.append(f"1 BIRT\n2 DATE {person['birth_date']}")
+        if person.get('death_date'):
+            lines.append(f"1 DEAT\n2 DATE {person['death_date']}")
+        if person['id'] in famc:
+            lines.append(f"1 FAMC {famc[person['id']]}")
+        for xref in fams.get(person['id'], []):
+            lines.append(f"1 FAMS {xref}")
+        out.write('\n'.join(lines) + '\n')
+
+    for xref, parent_ids, child_ids in families:
+        lines = [f"0 {xref} FAM"]
+        for role, parent_id in zip(('HUSB', 'WIFE'), parent_ids):
+            lines.append(f"1 {role} {person_xref[parent_id]}")
+        for child_id in child_ids:
+            lines.append(f"1 CHIL {person_xref[child_id]}")
+        out.write('\n'.join(lines) + '\n')
+
+    out.write("0 TRLR\n")
+
+    records = len(persons) + len(families) + 2
+    seconds = time.perf_counter() - start
+    return {'records': records, 'seconds': seconds,
+            'records_per_second': records / seconds if seconds else 0.0}
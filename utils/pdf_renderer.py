@@ -5,13 +5,45 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.utils import ImageReader
 from io import BytesIO
-import base64
 from PIL import Image, ImageDraw
 import io
+import math
 import os
-import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from utils.tree_model import as_tree
+from utils.photo_store import node_photo_bytes
+from utils.spatial_index import GridIndex
 
+def _usable_cpus():
+    """CPUs this process may run on (its affinity mask, where the OS has one)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Avatar preprocessing (decode, resize, mask, encode) runs on a pool before
+# the canvas is drawn. 'thread' needs no worker start-up and no copying of
+# image bytes, and still overlaps the parts where Pillow releases the GIL.
+# 'process' scales further with cores, but starts interpreters from inside
+# the running app, so it is opt-in.
+AVATAR_POOL = 'thread'
+AVATAR_WORKERS = min(16, _usable_cpus())
+# Fewer distinct avatars than this are not worth starting a pool for
+AVATAR_POOL_MIN_JOBS = 32
+
+# Tiled export: past TILED_MIN_PEOPLE people one page makes nodes unreadable,
+# so the tree is drawn at TILE_SCALE over as many pages as it needs
+TILED_MIN_PEOPLE = 200
+TILE_SCALE = 0.8
+# How far a drawn person reaches around its (x, y), in tree units:
+# avatar above, name box below (see draw_person)
+PERSON_HALF_WIDTH = 80
+PERSON_TOP = 40
+PERSON_BOTTOM = 120
 
 
 def get_default_avatar_for_pdf():
@@ -38,44 +70,89 @@ def get_default_avatar_for_pdf():
 
 
 
-def create_circular_image_simple(image_bytes, size=70):
-    """Create circular image - save as temp file for reportlab"""
+@lru_cache(maxsize=16)
+def circle_mask(size):
+    """Circular 'L' mask for a size x size avatar, built once per size"""
+    mask = Image.new('L', (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, size - 1, size - 1), fill=255)
+    return mask
+
+
+
+def apply_circle_mask(img, size):
+    """Paint the corners outside the avatar circle white in one composite"""
+    background = Image.new('RGB', (size, size), (255, 255, 255))
+    return Image.composite(img, background, circle_mask(size))
+
+
+
+def create_circular_jpeg(image_bytes, size=70):
+    """Create circular image as JPEG bytes (None if the image cannot be read)"""
     try:
         # Open and resize
         img = Image.open(io.BytesIO(image_bytes))
         img = img.convert('RGB')
         img = img.resize((size, size), Image.Resampling.LANCZOS)
         
-        # Create circular mask
-        mask = Image.new('L', (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size, size), fill=255)
-        
-        # Apply mask
-        output = Image.new('RGB', (size, size), (255, 255, 255))
-        output.paste(img, (0, 0))
-        
         # Make corners white (circular mask)
-        for x in range(size):
-            for y in range(size):
-                dist = ((x - size/2)**2 + (y - size/2)**2)**0.5
-                if dist > size/2:
-                    output.putpixel((x, y), (255, 255, 255))
-        
-        # Save to temp file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        output.save(temp_file.name, 'JPEG', quality=95)
-        temp_file.close()
+        output = apply_circle_mask(img, size)
         
-        return temp_file.name
+        buffer = BytesIO()
+        output.save(buffer, 'JPEG', quality=95)
+        return buffer.getvalue()
     except Exception as e:
         print(f"Error creating circular image: {e}")
         return None
 
 
 
-def export_tree_to_pdf_visual(tree_data):
-    """Export family tree as visual PDF with images"""
+def create_circular_image(image_bytes, size=70):
+    """Create circular image as an in-memory JPEG ImageReader for reportlab"""
+    jpeg = create_circular_jpeg(image_bytes, size)
+    # reportlab embeds the JPEG as-is
+    return ImageReader(BytesIO(jpeg)) if jpeg else None
+
+
+
+def _circular_jpeg_job(job):
+    image_bytes, size = job
+    return create_circular_jpeg(image_bytes, size)
+
+
+
+def prepare_avatars(sources, size, workers=None, pool=None):
+    """
+    Make the circular avatar of every image in sources ({key: image bytes})
+    up front, fanned out over a pool of at most workers (AVATAR_WORKERS)
+    processes or threads (pool, AVATAR_POOL). Returns {key: ImageReader or
+    None}; results are matched to keys in order, so the output does not
+    depend on which worker finished first.
+    """
+    workers = max(1, workers or AVATAR_WORKERS)
+    pool = pool or AVATAR_POOL
+    keys = list(sources)
+    jobs = [(sources[key], size) for key in keys]
+    
+    if workers == 1 or len(jobs) < AVATAR_POOL_MIN_JOBS:
+        jpegs = [_circular_jpeg_job(job) for job in jobs]
+    else:
+        executor_class = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        workers = min(workers, len(jobs))
+        # A few chunks per worker keeps them busy without a round trip per avatar
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with executor_class(max_workers=workers) as executor:
+            jpegs = list(executor.map(_circular_jpeg_job, jobs, chunksize=chunksize))
+    
+    return {key: ImageReader(BytesIO(jpeg)) if jpeg else None for key, jpeg in zip(keys, jpegs)}
+
+
+
+def export_tree_to_pdf_visual(tree_data, workers=None, pool=None):
+    """
+    Export family tree as visual PDF with images.
+    workers / pool configure avatar preprocessing (see prepare_avatars).
+    """
     
     pdf_buffer = BytesIO()
     page_width, page_height = landscape(A4)
@@ -92,8 +169,9 @@ def export_tree_to_pdf_visual(tree_data):
     c.setFillColor(black)
     c.drawString(inch, page_height - 0.5*inch, "Family Tree")
     
-    nodes = tree_data.get('nodes', [])
-    edges = tree_data.get('edges', [])
+    tree = as_tree(tree_data)
+    nodes = tree['nodes']
+    edges = tree['edges']
     
     if not nodes:
         c.save()
@@ -108,10 +186,7 @@ def export_tree_to_pdf_visual(tree_data):
         return pdf_buffer.getvalue()
     
     # Calculate bounds
-    min_x = min(n.get('x', 0) for n in person_nodes)
-    max_x = max(n.get('x', 0) for n in person_nodes)
-    min_y = min(n.get('y', 0) for n in person_nodes)
-    max_y = max(n.get('y', 0) for n in person_nodes)
+    min_x, min_y, max_x, max_y = node_bounds(person_nodes)
     
     tree_width = max_x - min_x if max_x > min_x else 100
     tree_height = max_y - min_y if max_y > min_y else 100
@@ -130,153 +205,302 @@ def export_tree_to_pdf_visual(tree_data):
     offset_x = inch + (available_width - tree_width*scale) / 2
     offset_y = page_height - inch - (available_height - tree_height*scale) / 2
     
-    def transform_point(x, y):
-        scaled_x = (x - min_x + padding) * scale
-        scaled_y = (y - min_y + padding) * scale
-        return offset_x + scaled_x, offset_y - scaled_y
+    # Page position of every node, computed once
+    points = page_coordinates(nodes, min_x - padding, min_y - padding, scale, offset_x, offset_y)
     
     # Draw edges
     c.setStrokeColor(black)
     c.setLineWidth(2)
+    c.drawPath(edges_path(c, edges, points), stroke=1, fill=0)
     
-    for edge in edges:
-        edge_type = edge.get('type', 'spouse')
-        source_node = next((n for n in nodes if n['id'] == edge['source']), None)
-        target_node = next((n for n in nodes if n['id'] == edge['target']), None)
-        
+    # Draw nodes
+    node_radius = 35 * scale
+    avatar_sources, avatar_key_of = collect_avatar_sources(person_nodes)
+    avatar_readers = prepare_avatars(avatar_sources, int(node_radius * 2), workers, pool)
+    
+    for node in person_nodes:
+        x, y = points[node['id']]
+        avatar_reader = avatar_readers[avatar_key_of[node['id']]] if node['id'] in avatar_key_of else None
+        draw_person(c, node, x, y, node_radius, scale, avatar_reader)
+    
+    # Footer
+    c.setFont("Helvetica", 10)
+    c.setFillColor(HexColor("#666666"))
+    c.drawString(0.5*inch, 0.3*inch, "Generated by Family Tree Maker")
+    
+    c.save()
+    
+    pdf_buffer.seek(0)
+    return pdf_buffer.getvalue()
+
+
+
+def export_tree_to_pdf_tiled(tree_data, out=None, scale=TILE_SCALE, pagesize=landscape(A4),
+                             workers=None, pool=None):
+    """
+    Export a large tree as poster tiles: the bounding box is cut into rows
+    and columns of pages at a fixed node scale. Each page draws only the
+    people and edges a spatial index finds for it, clipped at the tile
+    edge, and tiles with nothing on them are left out. Every distinct
+    avatar is prepared once, in one pool run before the first page.
+    Writes to out (a binary file object) if given, else returns the bytes.
+    """
+    pdf_buffer = out if out is not None else BytesIO()
+    page_width, page_height = pagesize
+    margin = 0.5*inch
+    header = 0.3*inch
+    content_width = page_width - 2*margin
+    content_height = page_height - 2*margin - header
+    content_top = margin + content_height
+    
+    c = canvas.Canvas(pdf_buffer, pagesize=pagesize)
+    c.setTitle("Family Tree")
+    
+    tree = as_tree(tree_data)
+    person_nodes = [n for n in tree['nodes'] if n.get('type') == 'person']
+    
+    if not person_nodes:
+        c.showPage()
+        c.save()
+        return None if out is not None else pdf_buffer.getvalue()
+    
+    # Tile size in tree units
+    tile_width = content_width / scale
+    tile_height = content_height / scale
+    
+    people = GridIndex(min(tile_width, tile_height) / 2)
+    for node in person_nodes:
+        x, y = node.get('x', 0), node.get('y', 0)
+        people.insert(node, x - PERSON_HALF_WIDTH, y - PERSON_TOP, x + PERSON_HALF_WIDTH, y + PERSON_BOTTOM)
+    
+    origin_x, origin_y, max_x, max_y = node_bounds(person_nodes)
+    origin_x -= PERSON_HALF_WIDTH
+    origin_y -= PERSON_TOP
+    cols = max(1, math.ceil((max_x + PERSON_HALF_WIDTH - origin_x) / tile_width))
+    rows = max(1, math.ceil((max_y + PERSON_BOTTOM - origin_y) / tile_height))
+    
+    # Poster coordinates of every node, computed once: x grows right from 0
+    # and y down from 0; each tile shifts the canvas to its part of the poster
+    points = page_coordinates(tree['nodes'], origin_x, origin_y, scale, 0, 0)
+    
+    lines = GridIndex(min(tile_width, tile_height) / 2)
+    for edge in tree['edges']:
+        source_node = tree.node(edge['source'])
+        target_node = tree.node(edge['target'])
         if source_node and target_node:
-            x1, y1 = transform_point(source_node.get('x', 0), source_node.get('y', 0))
-            x2, y2 = transform_point(target_node.get('x', 0), target_node.get('y', 0))
-            
-            if edge_type == 'child_to_parent':
-                mid_y = (y1 + y2) / 2
-                c.bezier(x1, y1, x1, mid_y, x2, mid_y, x2, y2)
-            elif edge_type in ['spouse', 'parent_to_junction']:
-                c.line(x1, y1, x2, y2)
+            # Edge curves stay inside the box of their end points
+            lines.insert(edge, source_node.get('x', 0), source_node.get('y', 0),
+                         target_node.get('x', 0), target_node.get('y', 0))
     
-    # Draw nodes
     node_radius = 35 * scale
-    default_avatar_bytes = get_default_avatar_for_pdf()
-    temp_files = []
+    # One pool run for the whole poster rather than one per tile
+    avatar_sources, avatar_key_of = collect_avatar_sources(person_nodes)
+    avatar_readers = prepare_avatars(avatar_sources, int(node_radius * 2), workers, pool)
+    
+    for row in range(rows):
+        for col in range(cols):
+            tile_x = origin_x + col * tile_width
+            tile_y = origin_y + row * tile_height
+            tile_people = people.query(tile_x, tile_y, tile_x + tile_width, tile_y + tile_height)
+            tile_lines = lines.query(tile_x, tile_y, tile_x + tile_width, tile_y + tile_height)
+            if not tile_people and not tile_lines:
+                continue
+            
+            c.saveState()
+            clip = c.beginPath()
+            clip.rect(margin, margin, content_width, content_height)
+            c.clipPath(clip, stroke=0, fill=0)
+            c.translate(margin - col * content_width, content_top + row * content_height)
+            
+            c.setStrokeColor(black)
+            c.setLineWidth(2)
+            c.drawPath(edges_path(c, tile_lines, points), stroke=1, fill=0)
+            
+            for node in tile_people:
+                x, y = points[node['id']]
+                avatar_reader = avatar_readers[avatar_key_of[node['id']]] if node['id'] in avatar_key_of else None
+                draw_person(c, node, x, y, node_radius, scale, avatar_reader)
+            c.restoreState()
+            
+            # Tile position, for assembling a poster
+            c.setFont("Helvetica-Bold", 12)
+            c.setFillColor(black)
+            c.drawString(margin, page_height - margin - 12,
+                         f"Family Tree - row {row + 1} of {rows}, column {col + 1} of {cols}")
+            c.setFont("Helvetica", 10)
+            c.setFillColor(HexColor("#666666"))
+            c.drawString(0.5*inch, 0.3*inch, "Generated by Family Tree Maker")
+            c.showPage()
     
+    c.save()
+    
+    return None if out is not None else pdf_buffer.getvalue()
+
+
+
+def collect_avatar_sources(person_nodes):
+    """
+    Distinct images to draw: ({key: image bytes}, {node id: key}), keyed by
+    photo hash, with every photo-less node sharing the default avatar.
+    reportlab names an XObject after the reader's pixel data, so drawing
+    one reader per key embeds each image once.
+    """
+    default_avatar_bytes = get_default_avatar_for_pdf()
+    avatar_sources = {}
+    avatar_key_of = {}
     for node in person_nodes:
-        x, y = transform_point(node.get('x', 0), node.get('y', 0))
-        name = node.get('name', 'Unknown')
-        
         # Get image - prioritize user photo, fallback to default avatar
-        image_bytes = None
-        photo_b64 = node.get('photo')
-        
-        if photo_b64:
-            try:
-                image_bytes = base64.b64decode(photo_b64)
-            except:
-                pass
+        image_bytes = node_photo_bytes(node, 'print')
+        image_key = node.get('photo_hash') or node.get('photo')
         
         # Use default avatar if no photo
         if not image_bytes:
             image_bytes = default_avatar_bytes
+            image_key = None
         
-        # Draw white circle background
-        c.setFillColor(white)
-        c.setStrokeColor(black)
-        c.setLineWidth(3)
-        c.circle(x, y, node_radius, fill=1, stroke=1)
-        
-        # Draw image (either user photo or default avatar)
         if image_bytes:
-            temp_image_path = create_circular_image_simple(image_bytes, int(node_radius * 2))
-            if temp_image_path:
-                temp_files.append(temp_image_path)
-                try:
-                    c.drawImage(
-                        temp_image_path,
-                        x - node_radius,
-                        y - node_radius,
-                        width=node_radius * 2,
-                        height=node_radius * 2,
-                        preserveAspectRatio=True
-                    )
-                    # Redraw circle border
-                    c.setStrokeColor(black)
-                    c.setLineWidth(3)
-                    c.circle(x, y, node_radius, fill=0, stroke=1)
-                except Exception as e:
-                    print(f"Error drawing image for {name}: {e}")
-                    draw_initial(c, x, y, node_radius, name)
-            else:
-                draw_initial(c, x, y, node_radius, name)
-        else:
-            # Only show initial if everything failed (rare)
-            draw_initial(c, x, y, node_radius, name)
-        
-        # Draw name with background box
-        font_size = max(8, int(10 * scale))
-        c.setFont("Helvetica", font_size)
-        
-        # Prepare text lines
-        text_lines = []
-        if len(name) > 15:
-            words = name.split()
-            if len(words) > 1:
-                mid = len(words) // 2
-                line1 = " ".join(words[:mid])
-                line2 = " ".join(words[mid:])
-                text_lines.append(line1)
-                text_lines.append(line2)
-            else:
-                text_lines.append(name[:15])
-        else:
-            text_lines.append(name)
-        
-        # Add date range
-        from utils.data_handler import format_date_range
-        birth = node.get('birth_date', node.get('date', ''))
-        death = node.get('death_date', '')
-        date_range = format_date_range(birth, death)
-        if date_range:
-            text_lines.append(date_range)
-        
-        # Calculate background box size - FIXED POSITIONING
-        max_text_width = max(c.stringWidth(line, "Helvetica", font_size) for line in text_lines)
-        box_width = max_text_width + 12
-        line_height = 13 * scale
-        box_height = len(text_lines) * line_height + 8
-        box_x = x - box_width / 2
-        box_y = y - node_radius - 18 * scale - box_height
-        
-        # Draw white background box with border
-        c.setFillColor(white)
-        c.setStrokeColor(black)
-        c.setLineWidth(1)
-        c.roundRect(box_x, box_y, box_width, box_height, 3, fill=1, stroke=1)
+            avatar_sources.setdefault(image_key, image_bytes)
+            avatar_key_of[node['id']] = image_key
+    return avatar_sources, avatar_key_of
+
+
+
+def node_bounds(nodes):
+    """(min_x, min_y, max_x, max_y) of the nodes' positions in one pass"""
+    min_x = min_y = float('inf')
+    max_x = max_y = float('-inf')
+    for node in nodes:
+        x, y = node.get('x', 0), node.get('y', 0)
+        if x < min_x:
+            min_x = x
+        if x > max_x:
+            max_x = x
+        if y < min_y:
+            min_y = y
+        if y > max_y:
+            max_y = y
+    return min_x, min_y, max_x, max_y
+
+
+
+def page_coordinates(nodes, origin_x, origin_y, scale, left, top):
+    """
+    id -> page (x, y) for every node: tree point (origin_x, origin_y) lands
+    on page point (left, top), and tree y, which grows down, is flipped.
+    """
+    return {n['id']: (left + (n.get('x', 0) - origin_x) * scale, top - (n.get('y', 0) - origin_y) * scale)
+            for n in nodes}
+
+
+
+def edges_path(c, edges, points):
+    """All edges as one path object, stroked with a single drawPath call"""
+    path = c.beginPath()
+    for edge in edges:
+        start = points.get(edge['source'])
+        end = points.get(edge['target'])
+        if start is None or end is None:
+            continue
         
-        # Draw text on top - FIXED Y OFFSET
-        c.setFillColor(black)
-        y_offset = y - node_radius - 18 * scale - box_height + line_height - 2
-        for i, line in enumerate(text_lines):
-            if i == len(text_lines) - 1 and date_range and line == date_range:
-                c.setFont("Helvetica", max(7, int(8 * scale)))
-            else:
-                c.setFont("Helvetica", font_size)
-            c.drawCentredString(x, y_offset - i * line_height, line)
-    
-    # Footer
-    c.setFont("Helvetica", 10)
-    c.setFillColor(HexColor("#666666"))
-    c.drawString(0.5*inch, 0.3*inch, "Generated by Family Tree Maker")
-    
-    c.save()
+        edge_type = edge.get('type', 'spouse')
+        x1, y1 = start
+        x2, y2 = end
+        if edge_type == 'child_to_parent':
+            mid_y = (y1 + y2) / 2
+            path.moveTo(x1, y1)
+            path.curveTo(x1, mid_y, x2, mid_y, x2, y2)
+        elif edge_type in ['spouse', 'parent_to_junction']:
+            path.moveTo(x1, y1)
+            path.lineTo(x2, y2)
+    return path
+
+
+
+def draw_person(c, node, x, y, node_radius, scale, avatar_reader):
+    """
+    Draw a person's avatar circle and name box centred on page point (x, y).
+    avatar_reader is the prepared ImageReader, or None to draw the initial.
+    """
+    name = node.get('name', 'Unknown')
+    
+    # Draw white circle background
+    c.setFillColor(white)
+    c.setStrokeColor(black)
+    c.setLineWidth(3)
+    c.circle(x, y, node_radius, fill=1, stroke=1)
     
-    # Cleanup temp files
-    for temp_file in temp_files:
+    # Draw image (either user photo or default avatar)
+    if avatar_reader:
         try:
-            os.unlink(temp_file)
-        except:
-            pass
+            c.drawImage(
+                avatar_reader,
+                x - node_radius,
+                y - node_radius,
+                width=node_radius * 2,
+                height=node_radius * 2,
+                preserveAspectRatio=True
+            )
+            # Redraw circle border
+            c.setStrokeColor(black)
+            c.setLineWidth(3)
+            c.circle(x, y, node_radius, fill=0, stroke=1)
+        except Exception as e:
+            print(f"Error drawing image for {name}: {e}")
+            draw_initial(c, x, y, node_radius, name)
+    else:
+        # Only show initial if everything failed (rare)
+        draw_initial(c, x, y, node_radius, name)
+    
+    # Draw name with background box
+    font_size = max(8, int(10 * scale))
+    c.setFont("Helvetica", font_size)
+    
+    # Prepare text lines
+    text_lines = []
+    if len(name) > 15:
+        words = name.split()
+        if len(words) > 1:
+            mid = len(words) // 2
+            line1 = " ".join(words[:mid])
+            line2 = " ".join(words[mid:])
+            text_lines.append(line1)
+            text_lines.append(line2)
+        else:
+            text_lines.append(name[:15])
+    else:
+        text_lines.append(name)
+    
+    # Add date range
+    from utils.data_handler import format_date_range
+    birth = node.get('birth_date', node.get('date', ''))
+    death = node.get('death_date', '')
+    date_range = format_date_range(birth, death)
+    if date_range:
+        text_lines.append(date_range)
+    
+    # Calculate background box size - FIXED POSITIONING
+    max_text_width = max(c.stringWidth(line, "Helvetica", font_size) for line in text_lines)
+    box_width = max_text_width + 12
+    line_height = 13 * scale
+    box_height = len(text_lines) * line_height + 8
+    box_x = x - box_width / 2
+    box_y = y - node_radius - 18 * scale - box_height
+    
+    # Draw white background box with border
+    c.setFillColor(white)
+    c.setStrokeColor(black)
+    c.setLineWidth(1)
+    c.roundRect(box_x, box_y, box_width, box_height, 3, fill=1, stroke=1)
     
-    pdf_buffer.seek(0)
-    return pdf_buffer.getvalue()
+    # Draw text on top - FIXED Y OFFSET
+    c.setFillColor(black)
+    y_offset = y - node_radius - 18 * scale - box_height + line_height - 2
+    for i, line in enumerate(text_lines):
+        if i == len(text_lines) - 1 and date_range and line == date_range:
+            c.setFont("Helvetica", max(7, int(8 * scale)))
+        else:
+            c.setFont("Helvetica", font_size)
+        c.drawCentredString(x, y_offset - i * line_height, line)
 
 
 
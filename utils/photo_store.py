@@ -0,0 +1,186 @@
+import base64
+import hashlib
+import io
+import os
+from functools import lru_cache
+
+PHOTO_DIR = ".photo_store"
+
+# Square derivatives made once at upload; renderers only ever read these.
+# 'avatar' / 'avatar_2x' are the graph node at 1x and retina density,
+# 'print' is for PDF export.
+PHOTO_VARIANTS = {
+    'avatar': 70,
+    'avatar_2x': 140,
+    'print': 360,
+}
+
+
+def _blob_path(photo_hash, variant=None):
+    """Blobs are sharded by the first two hex digits to keep directories small"""
+    name = f"{photo_hash}.{variant}.jpg" if variant else photo_hash
+    return os.path.join(PHOTO_DIR, photo_hash[:2], name)
+
+
+def _write_blob(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a crash never leaves a half-written blob
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def make_derivatives(photo_bytes):
+    """
+    Decode a photo once and return {variant: JPEG bytes} for PHOTO_VARIANTS,
+    center-cropped to a square and downsized with LANCZOS.
+    """
+    # Imported here so the tree code (imports, GEDCOM, benchmarks) does not need Pillow
+    from PIL import Image, ImageOps
+
+    largest = max(PHOTO_VARIANTS.values())
+    img = Image.open(io.BytesIO(photo_bytes))
+    # Let the JPEG decoder skip detail no derivative needs
+    img.draft('RGB', (largest, largest))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    side = min(img.size)
+    left = (img.width - side) // 2
+    top = (img.height - side) // 2
+    img = img.crop((left, top, left + side, top + side))
+
+    derivatives = {}
+    # Largest first, each smaller one is resized from the previous
+    for variant, size in sorted(PHOTO_VARIANTS.items(), key=lambda item: -item[1]):
+        if img.width != size:
+            img = img.resize((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=90 if variant == 'print' else 85, optimize=True)
+        derivatives[variant] = out.getvalue()
+    return derivatives
+
+
+def _store_derivatives(photo_hash, photo_bytes):
+    """Write missing derivatives of a stored photo; False if it cannot be decoded"""
+    if all(os.path.exists(_blob_path(photo_hash, v)) for v in PHOTO_VARIANTS):
+        return True
+    try:
+        derivatives = make_derivatives(photo_bytes)
+    except Exception as e:
+        print(f"Could not make derivatives of photo {photo_hash[:12]}: {e}")
+        return False
+    for variant, data in derivatives.items():
+        _write_blob(_blob_path(photo_hash, variant), data)
+    return True
+
+
+def store_photo(photo_bytes):
+    """
+    Store photo bytes once, keyed by their SHA-256, along with their
+    PHOTO_VARIANTS derivatives; returns the hash. Uploading the same photo
+    again only returns the existing hash.
+    """
+    photo_hash = hashlib.sha256(photo_bytes).hexdigest()
+    path = _blob_path(photo_hash)
+    if not os.path.exists(path):
+        _write_blob(path, photo_bytes)
+    _store_derivatives(photo_hash, photo_bytes)
+    return photo_hash
+
+
+def store_upload(photo_file):
+    """Store an uploaded file (or None); returns its hash or None"""
+    if not photo_file:
+        return None
+    return store_photo(photo_file.read())
+
+
+def has_photo(photo_hash):
+    """True if the original of a photo is in the store"""
+    return os.path.exists(_blob_path(photo_hash))
+
+
+def _read_blob(photo_hash, variant):
+    path = _blob_path(photo_hash, variant)
+    if variant and not os.path.exists(path):
+        # Stored before derivatives existed: make them from the original once
+        with open(_blob_path(photo_hash), 'rb') as f:
+            _store_derivatives(photo_hash, f.read())
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Only the small derivatives are cached; originals can be several MB each
+# and are read for exports only, so they are read from disk every time.
+# A missing blob raises, and lru_cache does not remember exceptions, so it
+# is found once it is stored.
+@lru_cache(maxsize=256)
+def _read_variant(photo_hash, variant):
+    return _read_blob(photo_hash, variant)
+
+
+@lru_cache(maxsize=256)
+def _read_variant_base64(photo_hash, variant):
+    return base64.b64encode(_read_variant(photo_hash, variant)).decode()
+
+
+def load_photo(photo_hash, variant=None):
+    """
+    Bytes of a stored photo, read on first use (None if missing).
+    variant names one of PHOTO_VARIANTS; None is the original upload.
+    """
+    try:
+        if variant:
+            return _read_variant(photo_hash, variant)
+        return _read_blob(photo_hash, None)
+    except (OSError, TypeError):
+        return None
+
+
+def load_photo_base64(photo_hash, variant=None):
+    """Base64 text of a stored photo, for data URLs (None if missing)"""
+    try:
+        if variant:
+            return _read_variant_base64(photo_hash, variant)
+        return base64.b64encode(_read_blob(photo_hash, None)).decode()
+    except (OSError, TypeError):
+        return None
+
+
+def node_photo_bytes(node, variant):
+    """Photo bytes of a person node, from the store or a not yet migrated 'photo' field"""
+    if node.get('photo_hash'):
+        return load_photo(node['photo_hash'], variant)
+    if node.get('photo'):
+        try:
+            return base64.b64decode(node['photo'])
+        except Exception:
+            return None
+    return None
+
+
+def node_photo_base64(node, variant):
+    """Base64 photo of a person node (None if it has none)"""
+    if node.get('photo_hash'):
+        return load_photo_base64(node['photo_hash'], variant)
+    return node.get('photo') or None
+
+
+def migrate_photos(tree_data):
+    """
+    Move photos embedded as base64 'photo' fields into the store, leaving
+    only 'photo_hash' on the node. Returns the number of nodes migrated.
+    """
+    migrated = 0
+    for node in tree_data.get('nodes', []):
+        if 'photo' not in node:
+            continue
+        if node['photo']:
+            try:
+                node['photo_hash'] = store_photo(base64.b64decode(node['photo']))
+            except Exception as e:
+                print(f"Could not migrate photo of {node.get('id')}: {e}")
+                continue
+            migrated += 1
+        del node['photo']
+    return migrated
@@ -1,3 +1,43 @@
+from utils.tree_model import as_tree
+
+
+def match_score(name, query):
+    """Score of a name against a lowercased, stripped query (None if no match)"""
+    name = name.lower()
+    
+    # Exact match (highest priority)
+    if query == name:
+        return 100
+    # Starts with
+    elif name.startswith(query):
+        return 90
+    # Contains
+    elif query in name:
+        return 70
+    # Word boundary match
+    elif any(word.startswith(query) for word in name.split()):
+        return 80
+    return None
+
+
+def search_result(node, score):
+    """Search result dict for a person node"""
+    from utils.data_handler import format_date_range
+    birth = node.get('birth_date', '')
+    death = node.get('death_date', '')
+    date_display = format_date_range(birth, death) or "Unknown dates"
+    
+    return {
+        'id': node['id'],
+        'name': node['name'],
+        'dates': date_display,
+        'level': node.get('level', 0),
+        'score': score,
+        'x': node.get('x', 0),
+        'y': node.get('y', 0)
+    }
+
+
 def search_nodes(tree_data, query):
     """
     Fuzzy search for nodes by name - real-time filtering from first character
@@ -11,98 +51,61 @@ def search_nodes(tree_data, query):
     
     results = []
     for node in person_nodes:
-        name = node.get('name', '').lower()
-        
-        # Exact match (highest priority)
-        if query == name:
-            score = 100
-        # Starts with
-        elif name.startswith(query):
-            score = 90
-        # Contains
-        elif query in name:
-            score = 70
-        # Word boundary match
-        elif any(word.startswith(query) for word in name.split()):
-            score = 80
-        else:
-            continue
-        
-        # Format dates
-        from utils.data_handler import format_date_range
-        birth = node.get('birth_date', '')
-        death = node.get('death_date', '')
-        date_display = format_date_range(birth, death) or "Unknown dates"
-        
-        results.append({
-            'id': node['id'],
-            'name': node['name'],
-            'dates': date_display,
-            'level': node.get('level', 0),
-            'score': score,
-            'x': node.get('x', 0),
-            'y': node.get('y', 0)
-        })
+        score = match_score(node.get('name', ''), query)
+        if score is not None:
+            results.append(search_result(node, score))
     
     # Sort by score (highest first)
     results.sort(key=lambda x: x['score'], reverse=True)
     return results[:10]  # Top 10 results
 
 
+def path_edges(path):
+    """Edge tuples along a path of node ids, root first, in both directions so highlighting works"""
+    edges = []
+    for node_a, node_b in zip(path, path[1:]):
+        edges.append((node_b, node_a))
+        edges.append((node_a, node_b))
+    return edges
+
+
 def find_path_to_node(tree_data, target_node_id):
     """
     Find path from root node to target node using BFS
     Returns list of edge tuples that form the path
     """
-    nodes = tree_data.get('nodes', [])
-    edges = tree_data.get('edges', [])
+    tree = as_tree(tree_data)
     
     # Find root node (level 0)
-    root_node = next((n for n in nodes if n.get('level', 0) == 0 and n.get('type') == 'person'), None)
+    root_node = next((n for n in tree['nodes'] if n.get('level', 0) == 0 and n.get('type') == 'person'), None)
     if not root_node or root_node['id'] == target_node_id:
         return []
     
-    # Build bidirectional adjacency graph (handles all edge types)
-    graph = {}  # node_id -> list of connected node_ids
-    
-    for edge in edges:
-        source = edge['source']
-        target = edge['target']
-        
-        # Add both directions for traversal
-        if source not in graph:
-            graph[source] = []
-        if target not in graph:
-            graph[target] = []
-        
-        graph[source].append(target)
-        graph[target].append(source)
-    
-    # BFS from root to target
+    # BFS from root to target over the edge index (all edge types, both directions)
     from collections import deque
-    queue = deque([(root_node['id'], [root_node['id']])])
-    visited = {root_node['id']}
+    queue = deque([root_node['id']])
+    came_from = {root_node['id']: None}
     
     while queue:
-        current, path = queue.popleft()
+        current = queue.popleft()
         
         # Found target
         if current == target_node_id:
-            # Convert path nodes to edge tuples
-            path_edges = []
-            for i in range(len(path) - 1):
-                node_a = path[i]
-                node_b = path[i + 1]
-                # Add both directions to ensure highlighting works
-                path_edges.append((node_a, node_b))
-                path_edges.append((node_b, node_a))
-            return path_edges
+            # Walk back to root
+            path = []
+            while current is not None:
+                path.append(current)
+                current = came_from[current]
+            path.reverse()
+            return path_edges(path)
         
         # Explore neighbors
-        for neighbor in graph.get(current, []):
-            if neighbor not in visited:
-                visited.add(neighbor)
-                queue.append((neighbor, path + [neighbor]))
+        neighbors = [e['target'] for e in tree.edges_from(current)] + \
+                    [e['source'] for e in tree.edges_to(current)]
+        for neighbor in neighbors:
+            if neighbor not in came_from:
+                came_from[neighbor] = current
+                queue.append(neighbor)
     
     # No path found
     return []
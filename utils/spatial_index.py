@@ -0,0 +1,43 @@
+import math
+
+
+class GridIndex:
+    """
+    Uniform grid over the tree's x/y plane for rectangle queries.
+
+    Items are inserted with their bounding box and land in every cell the
+    box touches; query() returns the items whose cells overlap a rectangle
+    (a cheap superset, callers clip when drawing) in insertion order, so
+    what is drawn from a query stacks the same way as a full pass.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self._items = []
+
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return (range(math.floor(min(x0, x1) / size), math.floor(max(x0, x1) / size) + 1),
+                range(math.floor(min(y0, y1) / size), math.floor(max(y0, y1) / size) + 1))
+
+    def insert(self, item, x0, y0, x1, y1):
+        """Add item covering the box (x0, y0) - (x1, y1)"""
+        index = len(self._items)
+        self._items.append(item)
+        cols, rows = self._cell_range(x0, y0, x1, y1)
+        for col in cols:
+            for row in rows:
+                self._cells.setdefault((col, row), []).append(index)
+
+    def query(self, x0, y0, x1, y1):
+        """Items in cells overlapping the box, in insertion order"""
+        found = set()
+        cols, rows = self._cell_range(x0, y0, x1, y1)
+        for col in cols:
+            for row in rows:
+                found.update(self._cells.get((col, row), ()))
+        return [self._items[index] for index in sorted(found)]
+
+    def __len__(self):
+        return len(self._items)
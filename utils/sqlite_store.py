@@ -0,0 +1,304 @@
+import json
+import sqlite3
+
+from utils.photo_store import has_photo, load_photo, store_photo
+from utils.search_handler import match_score, search_result, path_edges
+from utils.tree_model import FamilyTree
+
+# A tree in SQLite: one row per person, junction and edge, so an edit is a
+# few row updates and search / path queries run in the database without
+# loading the tree. Nodes are kept whole as JSON in 'data' (any field
+# round-trips) next to the columns that are indexed; 'pos' orders the rows
+# as the FamilyTree lists are ordered, so a loaded tree comes back in the
+# same order. Removals leave gaps in 'pos' rather than renumbering every
+# row after them, so an edge position in a FamilyTree.take_journal() entry
+# is found by counting rows in pos order. Photos referenced by the tree are kept as well (original
+# upload only: derivatives are remade when they return to the photo store);
+# ones no longer used are dropped when the whole tree is rewritten.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persons (
+    id TEXT PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    level INTEGER,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS persons_pos ON persons (pos);
+CREATE INDEX IF NOT EXISTS persons_name ON persons (name_key);
+CREATE INDEX IF NOT EXISTS persons_level ON persons (level);
+
+CREATE TABLE IF NOT EXISTS junctions (
+    id TEXT PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    level INTEGER,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS junctions_pos ON junctions (pos);
+CREATE INDEX IF NOT EXISTS junctions_level ON junctions (level);
+
+CREATE TABLE IF NOT EXISTS edges (
+    pos INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    type TEXT
+);
+CREATE INDEX IF NOT EXISTS edges_source ON edges (source);
+CREATE INDEX IF NOT EXISTS edges_target ON edges (target);
+
+CREATE TABLE IF NOT EXISTS photos (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Ids per IN (...) list when querying a whole BFS frontier at once
+QUERY_CHUNK = 500
+
+
+def open_store(path):
+    """
+    Open (creating if needed) a tree database. WAL with synchronous=NORMAL
+    makes each save one atomic transaction, synced to disk at checkpoints.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _name_key(name):
+    # Python's lower(), so matching agrees with search_handler for any script
+    return (name or '').lower()
+
+
+def _insert_node(conn, node, pos):
+    data = json.dumps(node, separators=(',', ':'))
+    if node.get('type') == 'junction':
+        conn.execute("INSERT OR REPLACE INTO junctions (id, pos, level, data) VALUES (?, ?, ?, ?)",
+                     (node['id'], pos, node.get('level', 0), data))
+    else:
+        name = node.get('name', '')
+        conn.execute("INSERT OR REPLACE INTO persons (id, pos, name, name_key, level, data) VALUES (?, ?, ?, ?, ?, ?)",
+                     (node['id'], pos, name, _name_key(name), node.get('level', 0), data))
+        _insert_photo(conn, node.get('photo_hash'))
+
+
+def _update_node(conn, node):
+    data = json.dumps(node, separators=(',', ':'))
+    if node.get('type') == 'junction':
+        conn.execute("UPDATE junctions SET level = ?, data = ? WHERE id = ?", (node.get('level', 0), data, node['id']))
+    else:
+        name = node.get('name', '')
+        conn.execute("UPDATE persons SET name = ?, name_key = ?, level = ?, data = ? WHERE id = ?",
+                     (name, _name_key(name), node.get('level', 0), data, node['id']))
+        _insert_photo(conn, node.get('photo_hash'))
+
+
+def _insert_photo(conn, photo_hash):
+    if not photo_hash or conn.execute("SELECT 1 FROM photos WHERE hash = ?", (photo_hash,)).fetchone():
+        return
+    photo_bytes = load_photo(photo_hash)
+    if photo_bytes is not None:
+        conn.execute("INSERT INTO photos (hash, data) VALUES (?, ?)", (photo_hash, photo_bytes))
+
+
+def _next_node_pos(conn):
+    last = [conn.execute(f"SELECT max(pos) FROM {table}").fetchone()[0] for table in ('persons', 'junctions')]
+    return 1 + max([pos for pos in last if pos is not None], default=-1)
+
+
+def _next_edge_pos(conn):
+    last = conn.execute("SELECT max(pos) FROM edges").fetchone()[0]
+    return 0 if last is None else last + 1
+
+
+# pos of the edge at a position of the FamilyTree edges list
+_EDGE_AT = "(SELECT pos FROM edges ORDER BY pos LIMIT 1 OFFSET ?)"
+
+
+def _remove_node(conn, node_id):
+    for table in ('persons', 'junctions'):
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (node_id,))
+
+
+def _drop_unused_photos(conn):
+    conn.execute("DELETE FROM photos WHERE hash NOT IN "
+                 "(SELECT json_extract(data, '$.photo_hash') FROM persons WHERE json_extract(data, '$.photo_hash') IS NOT NULL)")
+
+
+def write_meta(conn, meta):
+    """Replace the tree's top-level keys other than nodes / edges (e.g. 'collapsed')"""
+    conn.execute("DELETE FROM meta")
+    conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                     [(key, json.dumps(value)) for key, value in meta.items()])
+
+
+def write_tree(conn, tree_data):
+    """Replace everything in the database with tree_data, in one transaction"""
+    with conn:
+        for table in ('persons', 'junctions', 'edges', 'meta'):
+            conn.execute(f"DELETE FROM {table}")
+        persons = []
+        junctions = []
+        photo_hashes = set()
+        for pos, node in enumerate(tree_data.get('nodes', [])):
+            data = json.dumps(node, separators=(',', ':'))
+            if node.get('type') == 'junction':
+                junctions.append((node['id'], pos, node.get('level', 0), data))
+            else:
+                name = node.get('name', '')
+                persons.append((node['id'], pos, name, _name_key(name), node.get('level', 0), data))
+                if node.get('photo_hash'):
+                    photo_hashes.add(node['photo_hash'])
+        conn.executemany("INSERT INTO persons (id, pos, name, name_key, level, data) VALUES (?, ?, ?, ?, ?, ?)", persons)
+        conn.executemany("INSERT INTO junctions (id, pos, level, data) VALUES (?, ?, ?, ?)", junctions)
+        for photo_hash in photo_hashes:
+            _insert_photo(conn, photo_hash)
+        conn.executemany("INSERT INTO edges (pos, source, target, type) VALUES (?, ?, ?, ?)",
+                         [(pos, e['source'], e['target'], e.get('type')) for pos, e in enumerate(tree_data.get('edges', []))])
+        _drop_unused_photos(conn)
+        write_meta(conn, {key: value for key, value in tree_data.items() if key not in ('nodes', 'edges')})
+
+
+def apply_journal(conn, journal, meta=None):
+    """
+    Apply FamilyTree.take_journal() entries as row updates, in one
+    transaction; meta (if given) replaces the top-level keys too.
+    """
+    with conn:
+        for entry in journal:
+            kind = entry[0]
+            if kind == 'n+':
+                _insert_node(conn, entry[1], _next_node_pos(conn))
+            elif kind == 'n':
+                _update_node(conn, entry[1])
+            elif kind == 'n-':
+                _remove_node(conn, entry[1])
+            elif kind == 'e+':
+                conn.execute("INSERT INTO edges (pos, source, target, type) VALUES (?, ?, ?, ?)",
+                             (_next_edge_pos(conn), entry[1], entry[2], entry[3]))
+            elif kind == 'e-':
+                conn.execute(f"DELETE FROM edges WHERE pos = {_EDGE_AT}", (entry[1],))
+            elif kind == 'et':
+                conn.execute(f"UPDATE edges SET target = ? WHERE pos = {_EDGE_AT}", (entry[2], entry[1]))
+            else:
+                raise ValueError(f"unknown journal entry {kind!r}")
+        if meta is not None:
+            write_meta(conn, meta)
+
+
+def load_tree(conn):
+    """
+    Read the whole tree back as a FamilyTree (None if the database is
+    empty). Photos missing from the photo store are put back there.
+    """
+    rows = conn.execute("SELECT pos, data FROM persons UNION ALL SELECT pos, data FROM junctions ORDER BY pos").fetchall()
+    if not rows:
+        return None
+    tree_data = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+    tree_data['nodes'] = [json.loads(data) for _, data in rows]
+    tree_data['edges'] = [{'source': source, 'target': target, 'type': edge_type}
+                          for source, target, edge_type in conn.execute("SELECT source, target, type FROM edges ORDER BY pos")]
+    restore_photos(conn)
+    return FamilyTree(tree_data)
+
+
+def restore_photos(conn):
+    """Store photos kept in the database that the photo store does not have; returns how many"""
+    restored = 0
+    for (photo_hash,) in conn.execute("SELECT hash FROM photos").fetchall():
+        if not has_photo(photo_hash):
+            (photo_bytes,) = conn.execute("SELECT data FROM photos WHERE hash = ?", (photo_hash,)).fetchone()
+            store_photo(photo_bytes)
+            restored += 1
+    return restored
+
+
+def search_nodes(conn, query, limit=10):
+    """
+    search_handler.search_nodes against the database: same scores, same
+    order (score, then tree order). Exact and prefix matches come from the
+    name index; only when there are fewer than limit of those is every
+    name scanned (inside SQLite) for word and substring matches.
+    """
+    if not query:
+        return []
+
+    query = query.lower().strip()
+    prefix_end = query + '\U0010ffff'
+    rows = conn.execute("SELECT pos, name, data FROM persons WHERE name_key >= ? AND name_key < ?",
+                        (query, prefix_end)).fetchall()
+    if len(rows) < limit:
+        rows = conn.execute("SELECT pos, name, data FROM persons WHERE instr(name_key, ?) > 0", (query,)).fetchall()
+
+    scored = []
+    for pos, name, data in rows:
+        score = match_score(name, query)
+        if score is not None:
+            scored.append((-score, pos, data))
+    scored.sort()
+    return [search_result(json.loads(data), -score) for score, _, data in scored[:limit]]
+
+
+def _neighbors(conn, node_ids):
+    """(node, neighbor) pairs over edges in either direction, for a batch of nodes"""
+    node_ids = list(node_ids)
+    for start in range(0, len(node_ids), QUERY_CHUNK):
+        chunk = node_ids[start:start + QUERY_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        yield from conn.execute(f"SELECT source, target FROM edges WHERE source IN ({marks}) ORDER BY pos", chunk)
+        yield from conn.execute(f"SELECT target, source FROM edges WHERE target IN ({marks}) ORDER BY pos", chunk)
+
+
+def find_path_to_node(conn, target_node_id):
+    """
+    search_handler.find_path_to_node against the database: a shortest path
+    from the root (first generation 0 person) to the target, as edge
+    tuples. Searches from both ends a generation of nodes at a time, one
+    indexed query per frontier, so it only reads the part of the tree
+    between the two.
+    """
+    root = conn.execute("SELECT id FROM persons WHERE level = 0 ORDER BY pos LIMIT 1").fetchone()
+    if not root or root[0] == target_node_id:
+        return []
+    exists = conn.execute("SELECT 1 FROM persons WHERE id = ? UNION ALL SELECT 1 FROM junctions WHERE id = ?",
+                          (target_node_id, target_node_id)).fetchone()
+    if not exists:
+        return []
+
+    # came_from per side; grow the smaller frontier until they meet
+    came_from = ({root[0]: None}, {target_node_id: None})
+    frontiers = ([root[0]], [target_node_id])
+    while frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        seen, other = came_from[side], came_from[1 - side]
+        next_frontier = []
+        for node_id, neighbor in _neighbors(conn, frontiers[side]):
+            if neighbor in seen:
+                continue
+            seen[neighbor] = node_id
+            if neighbor in other:
+                # Root half walked back, target half walked forward
+                path = []
+                current = neighbor
+                while current is not None:
+                    path.append(current)
+                    current = came_from[0][current]
+                path.reverse()
+                current = came_from[1][neighbor]
+                while current is not None:
+                    path.append(current)
+                    current = came_from[1][current]
+                return path_edges(path)
+            next_frontier.append(neighbor)
+        frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+
+    # No path found
+    return []
@@ -1,36 +1,740 @@
+import atexit
+import copy
+import glob
 import json
 import os
-from pathlib import Path
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-CACHE_FILE = ".tree_cache.json"
+from utils import search_handler, sqlite_store, tree_file
+from utils.tree_model import FamilyTree
 
-def save_to_browser(tree_data):
-    """Save tree data to local cache file"""
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only locked within the process
+    fcntl = None
+
+# 'json' keeps the tree in CACHE_FILE and its JSON logs (below); 'sqlite' keeps
+# it in SQLITE_FILE, one row per person, junction and edge, which search
+# and path queries then run against (see search_workspace). Chosen with
+# the FAMILY_TREE_STORAGE environment variable.
+STORAGE_BACKENDS = ('json', 'sqlite')
+STORAGE_BACKEND = os.environ.get('FAMILY_TREE_STORAGE', 'json').strip().lower()
+if STORAGE_BACKEND not in STORAGE_BACKENDS:
+    print(f"Warning: unknown FAMILY_TREE_STORAGE {STORAGE_BACKEND!r}, using 'json'")
+    STORAGE_BACKEND = 'json'
+SQLITE_FILE = ".tree_cache.sqlite"
+
+# Snapshots are utils.tree_file files: a third the size of indented JSON,
+# and loading one whole takes about 55% of json.load's time (0.20 s against
+# 0.36 s for 100k people, see benchmarks/bench_tree_file.py). Caches from
+# before are JSON, converted to a snapshot when first loaded.
+CACHE_FILE = ".tree_cache.ftree"
+LEGACY_CACHE_FILE = ".tree_cache.json"
+
+# The saved tree is a snapshot (CACHE_FILE) plus a log of the edits made
+# since: one compact JSON line per mutation (see FamilyTree.take_journal),
+# appended on save. Each snapshot starts a new log generation, so a
+# snapshot written in the background never races the log being appended
+# to; loading replays the snapshot's log and any newer ones.
+LOG_PATTERN = ".tree_cache.{}.log"
+
+# Held (flock) while a workspace's files are read or written, so writers
+# in other processes wait their turn. It also holds a token naming the
+# last write, which tells a process whether someone else wrote since.
+LOCK_FILE = ".tree_cache.lock"
+TOKEN_WIDTH = 64
+
+# Each workspace (one per browser session, or shared by id) keeps the
+# files above in WORKSPACE_DIR/<workspace id>/. The default workspace
+# (no id) keeps them in the working directory, where caches from before
+# workspaces are.
+WORKSPACE_DIR = ".workspaces"
+WORKSPACE_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Workspaces whose store, open files and tree stay in memory; loading a hot
+# workspace skips the disk. Past HOT_WORKSPACES, the least recently used are
+# dropped once idle for HOT_IDLE_SECONDS, so sessions in use never lose
+# theirs (a store made afresh writes its first save in full).
+HOT_WORKSPACES = 16
+HOT_IDLE_SECONDS = 600
+
+# Workspace directories no one has loaded or saved for this long are
+# deleted (see expire_workspaces), at most once per EXPIRE_INTERVAL
+WORKSPACE_EXPIRY = 30 * 24 * 3600
+EXPIRE_INTERVAL = 3600
+
+# Log writes reach the OS on every save (an app crash loses nothing); they
+# are fsync-ed to disk once this many are pending or this many seconds
+# have passed, and at exit
+FSYNC_BATCH = 16
+FSYNC_SECONDS = 1.0
+
+# Compact into a new snapshot once the log outgrows the snapshot (so
+# rewriting stays amortised O(1) per edit), but not for tiny trees
+COMPACT_MIN_BYTES = 256 * 1024
+
+_stores = OrderedDict()     # workspace id -> TreeStore, most recent last
+_stores_lock = threading.Lock()
+_last_expired = 0.0
+
+# Snapshots are written on one background thread, in order
+_snapshot_pool = ThreadPoolExecutor(max_workers=1)
+
+def _tree_meta(tree_data):
+    return {key: value for key, value in tree_data.items() if key not in ('nodes', 'edges')}
+
+def _copy_tree(tree):
+    """A FamilyTree with node, edge and top-level dicts of its own"""
+    data = copy.deepcopy(_tree_meta(tree))
+    data['nodes'] = [dict(node) for node in tree['nodes']]
+    data['edges'] = [dict(edge) for edge in tree['edges']]
+    copied = FamilyTree(data)
+    copied.layout_pending = tree.layout_pending
+    return copied
+
+def _token_generation(token):
+    """Generation named in a lock file token (0 if none)"""
+    fields = token.split()
+    if len(fields) == 3 and fields[2].isdigit():
+        return int(fields[2])
+    return 0
+
+def _fsync_dir(path):
+    # Makes a rename durable; not possible on every platform
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(tree_data, f, indent=2)
-        print(f"✓ Saved to {CACHE_FILE}")
-    except Exception as e:
-        print(f"Error saving: {e}")
-
-def load_from_browser():
-    """Load tree data from local cache file"""
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
     try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _replay(tree, record):
+    """Apply one log record to tree"""
+    kind = record[0]
+    if kind == 'n+':
+        tree.add_node(record[1])
+    elif kind == 'n':
+        node = tree.node(record[1]['id'])
+        if node is not None:
+            node.clear()
+            node.update(record[1])
+            tree.mark_changed([node['id']])
+    elif kind == 'n-':
+        tree.remove_node(record[1])
+    elif kind == 'e+':
+        tree.add_edge(record[1], record[2], record[3])
+    elif kind == 'e-':
+        tree.remove_edge(tree['edges'][record[1]])
+    elif kind == 'et':
+        tree.set_edge_target(tree['edges'][record[1]], record[2])
+    elif kind == 'm':
+        for key in list(_tree_meta(tree)):
+            del tree[key]
+        tree.update(record[1])
+    else:
+        raise ValueError(f"unknown log record {kind!r}")
+
+def _replay_log(tree, path):
+    """
+    Replay a log file into tree; returns (records, bytes, complete). A
+    torn or unreadable tail (crash mid-append) is cut off.
+    """
+    records = 0
+    good_bytes = 0
+    with open(path, 'r+b') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("incomplete record")
+                _replay(tree, json.loads(line))
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                print(f"Warning: {path} ends with an unreadable record ({e}), dropped it and anything after")
+                f.truncate(good_bytes)
+                return records, good_bytes, False
+            records += 1
+            good_bytes += len(line)
+    return records, good_bytes, True
+
+class TreeStore:
+    """
+    The saved tree of one workspace: its files, the log being appended to
+    and, while the workspace is hot, the tree last loaded or saved. Use
+    workspace_store() rather than creating one, so a workspace has one
+    store per process.
+    """
+    def __init__(self, workspace=None):
+        self.workspace = workspace
+        directory = '' if workspace is None else os.path.join(WORKSPACE_DIR, workspace)
+        self.directory = directory
+        self.cache_file = os.path.join(directory, CACHE_FILE)
+        self.legacy_cache_file = os.path.join(directory, LEGACY_CACHE_FILE)
+        self.log_pattern = os.path.join(directory, LOG_PATTERN)
+        self.sqlite_file = os.path.join(directory, SQLITE_FILE)
+        self.lock_file = os.path.join(directory, LOCK_FILE)
+        self.tree = None
+        self.last_used = time.monotonic()
+
+        # Guarded by lock()
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+        self._writer = uuid.uuid4().hex[:12]
+        self._writes = 0
+        self._token = None          # lock file token as of our last load or save
+        self._saved_version = None  # FamilyTree.version last written, to skip unchanged saves
+        self._journal_uid = None    # FamilyTree.uid whose journal feeds the log
+        self._generation = 0
+        self._fenced = 0            # snapshots older than this generation are stale
+        self._log_file = None
+        self._log_bytes = 0
+        self._snapshot_bytes = 0
+        self._unsynced = 0
+        self._last_sync = 0.0
+        self._saved_meta = None     # top-level keys other than nodes / edges, as last written
+        self._sqlite_conn = None
+        self._snapshot_future = None
+
+    @contextmanager
+    def lock(self):
+        """Exclusive access to the workspace's files, across threads and processes"""
+        with self._lock:
+            if self._lock_depth == 0:
+                if self._lock_fd is None:
+                    if self.directory:
+                        os.makedirs(self.directory, exist_ok=True)
+                    self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _read_token(self):
+        """'<writer> <writes> <generation>' of the last write ('' before any)"""
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        return os.read(self._lock_fd, TOKEN_WIDTH).decode('ascii', 'replace').strip()
+
+    def _write_token(self):
+        self._writes += 1
+        self._token = f"{self._writer} {self._writes} {self._generation}"
+        # Padded to a fixed width: overwriting in place is cheaper than truncating
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        os.write(self._lock_fd, self._token.ljust(TOKEN_WIDTH).encode('ascii'))
+
+    def _resync(self, token):
+        """
+        Someone else wrote since our last load or save: the journal no
+        longer applies to what is on disk, so the next save writes the
+        whole tree, in a generation newer than any written
+        """
+        self._close_log()
+        self._journal_uid = None
+        self._saved_meta = None
+        generations = [self._path_generation(path) for path in self._log_paths()]
+        generations.append(_token_generation(token))
+        self._generation = max([self._generation] + generations)
+        self._fenced = self._generation + 1
+
+    def wait(self):
+        """Block until queued background snapshots are written"""
+        future = self._snapshot_future
+        if future is not None:
+            future.result()
+
+    def _log_path(self, generation):
+        return self.log_pattern.format(generation)
+
+    def _log_paths(self):
+        prefix, suffix = self.log_pattern.split('{}')
+        return [path for path in glob.glob(glob.escape(prefix) + '*' + suffix)
+                if self._path_generation(path) is not None]
+
+    def _path_generation(self, path):
+        prefix, suffix = LOG_PATTERN.split('{}')
+        try:
+            return int(os.path.basename(path)[len(prefix):-len(suffix)])
+        except ValueError:
+            return None
+
+    def _changed_meta(self, tree_data):
+        """Top-level keys other than nodes / edges if they changed since last written, else None"""
+        meta = _tree_meta(tree_data)
+        encoded = json.dumps(meta, sort_keys=True)
+        if encoded == self._saved_meta:
+            return None
+        self._saved_meta = encoded
+        return meta
+
+    def _take_journal(self, tree_data):
+        """
+        Edits to write for tree_data, or None when the whole tree has to be
+        written (plain dict, another tree than last time, whole-tree change)
+        """
+        if not isinstance(tree_data, FamilyTree):
+            self._journal_uid = None
+            return None
+        if tree_data.uid != self._journal_uid:
+            # Another tree (import, new session) is written out in full first
+            tree_data.start_journal()
+            self._journal_uid = tree_data.uid
+        journal = tree_data.take_journal()
+        if journal is None:
+            self._saved_meta = json.dumps(_tree_meta(tree_data), sort_keys=True)
+        return journal
+
+    def _track(self, tree):
+        """After loading: the files hold tree as it is, so only journal what comes next"""
+        tree.start_journal()
+        tree.take_journal()
+        self.tree = tree
+        self._journal_uid = tree.uid
+        self._saved_version = tree.version
+        self._saved_meta = json.dumps(_tree_meta(tree), sort_keys=True)
+        tree.storage_token = self._token
+
+    def _sqlite(self):
+        if self._sqlite_conn is None:
+            self._sqlite_conn = sqlite_store.open_store(self.sqlite_file)
+        return self._sqlite_conn
+
+    def _write_snapshot(self, state, generation, queued=False):
+        """
+        Write a snapshot atomically, then drop the logs it replaces. A
+        snapshot older than the one on disk, or queued before another
+        writer took over the workspace, is dropped instead.
+        """
+        temp_path = f"{self.cache_file}.{os.getpid()}.{generation}.tmp"
+        state['log_generation'] = generation
+        data = tree_file.encode_tree(state)
+        # Write then rename, so a crash never leaves a half-written snapshot
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock():
+            taken_over = queued and self._read_token().split(' ')[0] != self._writer
+            if generation < self._fenced or taken_over:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, self.cache_file)
+            _fsync_dir(self.cache_file)
+            self._snapshot_bytes = len(data)
+            for path in self._log_paths():
+                if self._path_generation(path) < generation:
+                    os.remove(path)
+            if os.path.exists(self.legacy_cache_file):
+                os.remove(self.legacy_cache_file)
+        print(f"✓ Saved to {self.cache_file}")
+
+    def _background_snapshot(self, state, generation):
+        try:
+            self._write_snapshot(state, generation, queued=True)
+        except Exception as e:
+            # Edits logged since are relative to this snapshot: write in full next time
+            self._journal_uid = None
+            print(f"Error saving snapshot: {e}")
+
+    def _sync_log(self, force=False):
+        """fsync pending log writes once a batch is due (or force)"""
+        if self._log_file is None or not self._unsynced:
+            return
+        if force or self._unsynced >= FSYNC_BATCH or time.monotonic() - self._last_sync >= FSYNC_SECONDS:
+            self._log_file.flush()
+            os.fsync(self._log_file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def _close_log(self):
+        if self._log_file is not None:
+            self._sync_log(force=True)
+            self._log_file.close()
+            self._log_file = None
+
+    def _snapshot(self, tree_data, background=True):
+        """
+        Start a new log generation with the tree as its snapshot. Compaction
+        only copies the node and edge dicts here and queues the write (the
+        single snapshot thread writes them oldest first): until it lands the
+        older snapshot and logs still load as the same tree. A whole-tree
+        write is written before returning, so other processes never load
+        the tree it replaces.
+        """
+        state = copy.deepcopy(_tree_meta(tree_data))
+        state['nodes'] = [dict(node) for node in tree_data['nodes']]
+        state['edges'] = [dict(edge) for edge in tree_data['edges']]
+        self._close_log()
+        self._generation += 1
+        self._log_bytes = 0
+        if background:
+            self._snapshot_future = _snapshot_pool.submit(self._background_snapshot, state, self._generation)
+        else:
+            # Queued compactions are older than this
+            self._fenced = self._generation
+            self._write_snapshot(state, self._generation)
+
+    def _append(self, records):
+        """Append log records (JSON-able lists) to the current generation's log"""
+        if not records:
+            return
+        if self._log_file is None:
+            self._log_file = open(self._log_path(self._generation), 'ab')
+        data = b''.join(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n' for record in records)
+        self._log_file.write(data)
+        self._log_file.flush()
+        self._log_bytes += len(data)
+        self._unsynced += len(records)
+        self._sync_log()
+
+    def _save_json(self, tree_data):
+        journal = self._take_journal(tree_data)
+        if journal is None:
+            self._snapshot(tree_data, background=False)
+            return
+        records = [list(entry) for entry in journal]
+        meta = self._changed_meta(tree_data)
+        if meta is not None:
+            records.append(['m', meta])
+        self._append(records)
+        if self._log_bytes > max(COMPACT_MIN_BYTES, self._snapshot_bytes):
+            self._snapshot(tree_data)
+
+    def _save_sqlite(self, tree_data):
+        journal = self._take_journal(tree_data)
+        if journal is None:
+            sqlite_store.write_tree(self._sqlite(), tree_data)
+            print(f"✓ Saved to {self.sqlite_file}")
+        else:
+            sqlite_store.apply_journal(self._sqlite(), journal, self._changed_meta(tree_data))
+
+    def save(self, tree_data, force=False):
+        """See save_to_browser"""
+        version = getattr(tree_data, 'version', None)
+        if version is not None and version == self._saved_version:
+            return True
+        try:
+            with self.lock():
+                token = self._read_token()
+                base = getattr(tree_data, 'storage_token', None)
+                if base is not None and base != token:
+                    if not force:
+                        print(f"Not saved: workspace {self.workspace or '(default)'} was saved "
+                              f"from elsewhere since this tree was loaded")
+                        return False
+                    # Kept over the newer save: its journal is relative to the older one
+                    self._journal_uid = None
+                if token != self._token:
+                    self._resync(token)
+                if STORAGE_BACKEND == 'sqlite':
+                    self._save_sqlite(tree_data)
+                else:
+                    self._save_json(tree_data)
+                self._write_token()
+                self._saved_version = version
+                self.tree = tree_data if isinstance(tree_data, FamilyTree) else None
+                if self.tree is not None:
+                    self.tree.storage_token = self._token
+            return True
+        except Exception as e:
+            # The journal taken is lost with the failed write: start over with a snapshot
+            self._journal_uid = None
+            print(f"Error saving: {e}")
+            return False
+
+    def has_newer_save(self, tree_data):
+        """See has_newer_save"""
+        base = getattr(tree_data, 'storage_token', None)
+        if base is None:
+            return False
+        with self.lock():
+            return self._read_token() != base
+
+    def _load_sqlite(self):
+        if not os.path.exists(self.sqlite_file):
+            return None
+        tree = sqlite_store.load_tree(self._sqlite())
+        if tree is not None:
+            self._track(tree)
+            print(f"✓ Loaded from {self.sqlite_file}")
+        return tree
+
+    def _load_json(self):
+        if os.path.exists(self.cache_file):
+            path = self.cache_file
+            with tree_file.open_tree(path) as snapshot:
+                data = snapshot.to_dict()
+        elif os.path.exists(self.legacy_cache_file):
+            path = self.legacy_cache_file
+            with open(path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                print(f"✓ Loaded from {CACHE_FILE}")
-                return data
-        return None
-    except Exception as e:
-        print(f"Error loading: {e}")
-        return None
-
-def clear_browser_storage():
-    """Clear cache file"""
+        else:
+            return None
+        # Caches written before the log have no generation
+        generation = data.pop('log_generation', 0)
+        tree = FamilyTree(data)
+        self._snapshot_bytes = os.path.getsize(path)
+
+        # The snapshot's own log, then newer ones left by a snapshot that
+        # never landed; older ones are already in the snapshot
+        replayed = 0
+        log_bytes = 0
+        for path in sorted(self._log_paths(), key=self._path_generation):
+            log_generation = self._path_generation(path)
+            if log_generation < generation:
+                os.remove(path)
+                continue
+            count, log_bytes, complete = _replay_log(tree, path)
+            replayed += count
+            generation = log_generation
+            if not complete:
+                break
+
+        # A compaction queued by another writer may not have landed yet: its
+        # snapshot is this same tree, so later edits go to its log
+        token_generation = _token_generation(self._token)
+        if token_generation > generation:
+            generation = token_generation
+            log_bytes = 0
+
+        self._close_log()
+        self._generation = generation
+        self._log_bytes = log_bytes
+        self._track(tree)
+        print(f"✓ Loaded from {path} ({replayed} logged edit(s) replayed)")
+        if path == self.legacy_cache_file:
+            # Converted once, rather than parsed as JSON on every load until the next snapshot
+            self._snapshot(tree, background=False)
+            self._write_token()
+            tree.storage_token = self._token
+        return tree
+
+    def load(self):
+        """See load_from_browser"""
+        try:
+            with self.lock():
+                # The lock file's mtime is when the workspace was last used (see expire_workspaces)
+                os.utime(self.lock_file)
+                token = self._read_token()
+                if (self.tree is not None and token == self._token
+                        and self.tree.version == self._saved_version):
+                    # Sessions on one workspace each edit a copy of their own;
+                    # the latest to load gets its edits journaled
+                    tree = _copy_tree(self.tree)
+                    self._track(tree)
+                    return tree
+                self._token = token
+                self.tree = None
+                if STORAGE_BACKEND == 'sqlite':
+                    return self._load_sqlite()
+                return self._load_json()
+        except Exception as e:
+            print(f"Error loading: {e}")
+            return None
+
+    def _query_db(self, tree_data, query):
+        """
+        query(connection) if the sqlite database holds tree_data exactly as
+        it is (this store saved or loaded its version and no one wrote
+        since), else None
+        """
+        version = getattr(tree_data, 'version', None)
+        if STORAGE_BACKEND != 'sqlite' or version is None or version != self._saved_version:
+            return None
+        with self.lock():
+            if self._read_token() != self._token or not os.path.exists(self.sqlite_file):
+                return None
+            return query(self._sqlite())
+
+    def search(self, tree_data, query):
+        """See search_workspace"""
+        results = self._query_db(tree_data, lambda conn: sqlite_store.search_nodes(conn, query))
+        return search_handler.search_nodes(tree_data, query) if results is None else results
+
+    def find_path(self, tree_data, target_node_id):
+        """See find_path_in_workspace"""
+        path = self._query_db(tree_data, lambda conn: sqlite_store.find_path_to_node(conn, target_node_id))
+        return search_handler.find_path_to_node(tree_data, target_node_id) if path is None else path
+
+    def clear(self):
+        """See clear_browser_storage"""
+        try:
+            self.wait()
+            with self.lock():
+                self._close_log()
+                self.tree = None
+                self._saved_version = None
+                self._journal_uid = None
+                self._generation = 0
+                self._log_bytes = 0
+                self._saved_meta = None
+                for path in self._log_paths():
+                    os.remove(path)
+                if self._sqlite_conn is not None:
+                    self._sqlite_conn.close()
+                    self._sqlite_conn = None
+                for path in (self.sqlite_file, f"{self.sqlite_file}-wal", f"{self.sqlite_file}-shm"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                for path in (self.cache_file, self.legacy_cache_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                        print(f"✓ Cleared {path}")
+                # Tells other processes holding this workspace that it changed
+                self._write_token()
+        except Exception as e:
+            print(f"Error clearing: {e}")
+
+    def close(self):
+        """Finish pending writes and close the workspace's files"""
+        self.wait()
+        with self._lock:
+            self._close_log()
+            if self._sqlite_conn is not None:
+                self._sqlite_conn.close()
+                self._sqlite_conn = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            self.tree = None
+
+def new_workspace_id():
+    return uuid.uuid4().hex[:16]
+
+def is_workspace_id(workspace):
+    return isinstance(workspace, str) and WORKSPACE_ID.fullmatch(workspace) is not None
+
+def workspace_store(workspace=None):
+    """The TreeStore of workspace (None: the default one), kept hot in an LRU"""
+    if workspace is not None and not is_workspace_id(workspace):
+        raise ValueError(f"invalid workspace id {workspace!r}")
+    now = time.monotonic()
+    with _stores_lock:
+        store = _stores.pop(workspace, None)
+        if store is None:
+            store = TreeStore(workspace)
+        store.last_used = now
+        _stores[workspace] = store
+        evicted = []
+        while len(_stores) > HOT_WORKSPACES:
+            oldest = next(iter(_stores.values()))
+            if now - oldest.last_used < HOT_IDLE_SECONDS:
+                break
+            evicted.append(_stores.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+    return store
+
+def expire_workspaces(max_age=WORKSPACE_EXPIRY):
+    """
+    Delete the directories of workspaces not loaded or saved for max_age
+    seconds, skipping hot ones and any another process is writing. Runs at
+    most once per EXPIRE_INTERVAL; returns the ids deleted.
+    """
+    global _last_expired
+    now = time.monotonic()
+    with _stores_lock:
+        if now - _last_expired < EXPIRE_INTERVAL:
+            return []
+        _last_expired = now
+        hot = set(_stores)
     try:
-        if os.path.exists(CACHE_FILE):
-            os.remove(CACHE_FILE)
-            print(f"✓ Cleared {CACHE_FILE}")
-    except Exception as e:
-        print(f"Error clearing: {e}")
+        workspaces = os.listdir(WORKSPACE_DIR)
+    except OSError:
+        return []
+    
+    expired = []
+    cutoff = time.time() - max_age
+    for workspace in workspaces:
+        directory = os.path.join(WORKSPACE_DIR, workspace)
+        lock_file = os.path.join(directory, LOCK_FILE)
+        if workspace in hot or not is_workspace_id(workspace) or not os.path.isfile(lock_file):
+            continue
+        try:
+            fd = os.open(lock_file, os.O_RDWR)
+        except OSError:
+            continue
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(fd).st_mtime < cutoff:
+                shutil.rmtree(directory)
+                expired.append(workspace)
+        except OSError:
+            continue  # in use, or already gone
+        finally:
+            os.close(fd)
+    if expired:
+        print(f"✓ Deleted {len(expired)} workspace(s) unused for {max_age // 86400} day(s)")
+    return expired
+
+def save_to_browser(tree_data, workspace=None, force=False):
+    """
+    Save tree data to the workspace's cache. A FamilyTree only writes its
+    edits since the last save (O(edits), not O(tree)): appended to the log,
+    or as row updates with the sqlite backend. The first save, a
+    whole-tree change or a save after another process wrote the workspace
+    writes everything (a JSON snapshot is written in the background, as
+    is one once the log outgrows the last).
+
+    A tree loaded from the workspace is not saved over a newer save made
+    from elsewhere (another session or process; see has_newer_save) unless
+    force is set, when it replaces that save. Returns False if the tree
+    was not saved.
+    """
+    return workspace_store(workspace).save(tree_data, force)
+
+def has_newer_save(tree_data, workspace=None):
+    """
+    Whether the workspace was saved from elsewhere since tree_data was
+    loaded from it or last saved to it (always False for a tree that was
+    neither): its saves are refused until it is reloaded or saved with force
+    """
+    return workspace_store(workspace).has_newer_save(tree_data)
+
+def load_from_browser(workspace=None):
+    """
+    Load the workspace's tree: the hot one in memory if no one wrote the
+    workspace since, else the snapshot, then its log and any newer ones
+    (or the sqlite database). Returns a FamilyTree whose further edits
+    extend what is on disk. Every call gets a tree of its own, so sessions
+    on one workspace never edit each other's, and a session's save never
+    overwrites a newer one it has not loaded (see save_to_browser).
+    """
+    return workspace_store(workspace).load()
+
+def search_workspace(tree_data, query, workspace=None):
+    """
+    search_handler.search_nodes for the workspace's tree: answered by the
+    sqlite database when that backend is on and holds tree_data as saved,
+    else from tree_data in memory
+    """
+    return workspace_store(workspace).search(tree_data, query)
+
+def find_path_in_workspace(tree_data, target_node_id, workspace=None):
+    """search_handler.find_path_to_node, from the database when possible (see search_workspace)"""
+    return workspace_store(workspace).find_path(tree_data, target_node_id)
+
+def clear_browser_storage(workspace=None):
+    """Clear the workspace's cache file and its logs, or its sqlite database"""
+    workspace_store(workspace).clear()
+
+@atexit.register
+def _flush_at_exit():
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.close()
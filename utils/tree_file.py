@@ -0,0 +1,459 @@
+import itertools
+import json
+import mmap
+import operator
+import struct
+import sys
+from array import array
+from collections import deque
+
+from utils.photo_store import has_photo, load_photo, store_photo
+from utils.tree_model import FamilyTree
+
+# A tree in a compact binary file, readable a node at a time through mmap
+# without loading the rest (see benchmarks/bench_tree_file.py for how it
+# compares with JSON). The file is MAGIC, the format version and
+# header length (uint16, uint32), a JSON header saying where everything
+# is, then 8-byte aligned blocks, little-endian:
+#   - strings: every distinct string of the tree (ids, names, dates, edge
+#     types...) once, as UTF-8 joined by NULs, with their byte offsets;
+#     index 0 stands for None
+#   - nodes and edges as tables: rows with the same keys form a group,
+#     stored column by column (strings as uint32 string indexes, numbers as
+#     float64 / int64, booleans as bytes, anything else as a JSON array),
+#     plus the group of each row and its index in that group, so one row
+#     decodes without touching the others
+#   - photos, original uploads as raw bytes (exports only: a saved tree's
+#     photos are in the photo store already)
+MAGIC = b'FTREE\r\n\x1a'
+FORMAT_VERSION = 1
+
+_PREAMBLE = struct.Struct('<HI')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_ITEMSIZE = {'str': 4, 'i64': 8, 'f64': 8, 'num': 8, 'bool': 1}
+_TYPECODE = {'str': 'I' if array('I').itemsize == 4 else 'L', 'i64': 'q', 'f64': 'd', 'num': 'd', 'bool': 'B'}
+
+# Ints beyond this share a column with floats only as JSON (float64 would round them)
+_EXACT_INT = 2 ** 53
+
+
+def _pad(size):
+    return -size % 8
+
+
+def _is_size(value):
+    return type(value) is int and value >= 0
+
+
+def _check(condition, what):
+    if not condition:
+        raise ValueError(f"tree file is damaged: {what}")
+
+
+class _Blocks:
+    """Data blocks of a file being written, each at an 8-byte aligned offset"""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        if isinstance(data, array):
+            if sys.byteorder == 'big' and data.itemsize > 1:
+                data = array(data.typecode, data)
+                data.byteswap()
+            data = data.tobytes()
+        offset = self.size
+        self.chunks.append(data)
+        self.chunks.append(b'\0' * _pad(len(data)))
+        self.size += len(data) + _pad(len(data))
+        return offset
+
+
+def _column(values, blocks, strings):
+    """Encode one column; returns its header entry [type, offset, (flags offset | bytes)]"""
+    kinds = set(map(type, values))
+    if kinds <= {str, type(None)} and str in kinds:
+        # Interned in order of first use; strings maps None to 0
+        new = [value for value in dict.fromkeys(values) if value not in strings]
+        strings.update(zip(new, itertools.count(len(strings))))
+        return ['str', blocks.add(array(_TYPECODE['str'], map(strings.__getitem__, values)))]
+    if kinds == {float}:
+        return ['f64', blocks.add(array('d', values))]
+    if kinds == {bool}:
+        return ['bool', blocks.add(array('B', values))]
+    if kinds == {type(None)}:
+        return ['null']
+    if kinds == {int} and -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+        return ['i64', blocks.add(array('q', values))]
+    if kinds == {int, float} and all(-_EXACT_INT <= v <= _EXACT_INT for v in values if type(v) is int):
+        # Layout coordinates: mostly floats, with ints where never moved
+        flags = array('B', [type(v) is int for v in values])
+        return ['num', blocks.add(array('d', values)), blocks.add(flags)]
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return ['json', blocks.add(data), len(data)]
+
+
+def _table(rows, blocks, strings):
+    """Encode a list of dicts; returns its header entry"""
+    shapes = {}
+    groups = []
+    group_of = array(_TYPECODE['str'])
+    row_of = array(_TYPECODE['str'])
+    for row in rows:
+        keys = tuple(row)
+        group = shapes.get(keys)
+        if group is None:
+            group = shapes[keys] = len(groups)
+            groups.append([])
+        group_of.append(group)
+        row_of.append(len(groups[group]))
+        groups[group].append(row)
+
+    header = {'count': len(rows), 'group': blocks.add(group_of), 'row': blocks.add(row_of), 'groups': []}
+    for keys, members in zip(shapes, groups):
+        header['groups'].append({
+            'keys': list(keys),
+            'rows': len(members),
+            'columns': [_column(list(map(operator.itemgetter(key), members)), blocks, strings) for key in keys]
+        })
+    return header
+
+
+def encode_tree(tree_data, photos=False):
+    """
+    The tree as file bytes: every node and edge field and every top-level
+    key (JSON-able values, as json would). photos=True adds the original
+    upload of every photo the tree references.
+    """
+    blocks = _Blocks()
+    strings = {None: 0}
+    header = {
+        'meta': {key: value for key, value in tree_data.items() if key not in ('nodes', 'edges')},
+        'nodes': _table(tree_data.get('nodes', []), blocks, strings),
+        'edges': _table(tree_data.get('edges', []), blocks, strings),
+        'photos': {}
+    }
+
+    encoded = [string.encode('utf-8', 'surrogatepass') for string in itertools.islice(strings, 1, None)]
+    text = b'\0'.join(encoded)
+    offsets = array(_TYPECODE['str'], itertools.accumulate((len(data) + 1 for data in encoded), initial=0))
+    header['strings'] = {
+        'count': len(encoded),
+        'offsets': blocks.add(offsets),
+        'text': blocks.add(text),
+        'bytes': len(text),
+        # Split on NUL when loading whole, unless a string holds one
+        'split': text.count(b'\0') == max(len(encoded) - 1, 0)
+    }
+
+    if photos:
+        for node in tree_data.get('nodes', []):
+            photo_hash = node.get('photo_hash')
+            if photo_hash and photo_hash not in header['photos']:
+                photo_bytes = load_photo(photo_hash)
+                if photo_bytes is not None:
+                    header['photos'][photo_hash] = [blocks.add(photo_bytes), len(photo_bytes)]
+
+    head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    preamble = MAGIC + _PREAMBLE.pack(FORMAT_VERSION, len(head)) + head
+    return b''.join([preamble, b'\0' * _pad(len(preamble))] + blocks.chunks)
+
+
+def write_tree(path, tree_data, photos=False):
+    with open(path, 'wb') as f:
+        f.write(encode_tree(tree_data, photos))
+
+
+def is_tree_file(data):
+    """True if data (bytes) starts like a tree file"""
+    return data[:len(MAGIC)] == MAGIC
+
+
+class TreeFile:
+    """
+    A tree file opened for reading. A path is memory-mapped and only the
+    header is parsed when opening; node() / edge() / find() decode single
+    rows straight from the map, to_tree() decodes everything. Bytes
+    (an upload) work the same. Opening checks that every block the header
+    names lies within the file; a damaged or truncated file raises
+    ValueError there or when the damaged part is read.
+    """
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray)):
+            self._data = source
+            self._map = None
+        else:
+            with open(source, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = self._map
+        try:
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+        self._json_columns = {}
+        self._node_pos = None
+
+    def _read_header(self):
+        """Parse the header and check every block it names lies within the file"""
+        start = len(MAGIC) + _PREAMBLE.size
+        if not is_tree_file(self._data) or len(self._data) < start:
+            raise ValueError("not a family tree file")
+        version, head_size = _PREAMBLE.unpack_from(self._data, len(MAGIC))
+        if version > FORMAT_VERSION:
+            raise ValueError(f"tree file version {version} is newer than this app reads ({FORMAT_VERSION})")
+        if start + head_size > len(self._data):
+            raise ValueError("tree file is truncated")
+        try:
+            header = json.loads(bytes(self._data[start:start + head_size]))
+        except ValueError:
+            raise ValueError("tree file header is not readable")
+        self._base = start + head_size + _pad(start + head_size)
+        try:
+            self.meta = header['meta']
+            self._nodes = header['nodes']
+            self._edges = header['edges']
+            self._strings = header['strings']
+            self._photos = header['photos']
+            _check(isinstance(self.meta, dict) and isinstance(self._photos, dict), "header")
+            self._check_table(self._nodes)
+            self._check_table(self._edges)
+            count = self._strings['count']
+            _check(_is_size(count) and isinstance(self._strings['split'], bool), "strings")
+            self._check_block(self._strings['offsets'], 4 * (count + 1))
+            self._check_block(self._strings['text'], self._strings['bytes'])
+            for entry in self._photos.values():
+                self._check_block(entry[0], entry[1])
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"tree file header is incomplete ({e!r})")
+
+    def _check_block(self, offset, size):
+        _check(_is_size(offset) and _is_size(size)
+               and self._base + offset + size <= len(self._data), "block past the end of the file")
+
+    def _check_table(self, table):
+        count = table['count']
+        _check(_is_size(count) and isinstance(table['groups'], list), "table")
+        self._check_block(table['group'], 4 * count)
+        self._check_block(table['row'], 4 * count)
+        total = 0
+        for group in table['groups']:
+            rows = group['rows']
+            _check(_is_size(rows) and len(group['keys']) == len(group['columns'])
+                   and all(isinstance(key, str) for key in group['keys']), "table group")
+            total += rows
+            for column in group['columns']:
+                kind = column[0]
+                if kind in _ITEMSIZE:
+                    self._check_block(column[1], _ITEMSIZE[kind] * rows)
+                    if kind == 'num':
+                        self._check_block(column[2], rows)
+                elif kind == 'json':
+                    self._check_block(column[1], column[2])
+                else:
+                    _check(kind == 'null', f"column type {kind!r}")
+        _check(total == count, "table row count")
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def node_count(self):
+        return self._nodes['count']
+
+    @property
+    def edge_count(self):
+        return self._edges['count']
+
+    def _u32(self, offset, index):
+        return _U32.unpack_from(self._data, self._base + offset + 4 * index)[0]
+
+    def string(self, index):
+        if index == 0:
+            return None
+        _check(index <= self._strings['count'], "string index")
+        start = self._u32(self._strings['offsets'], index - 1)
+        end = self._u32(self._strings['offsets'], index) - 1
+        text = self._base + self._strings['text']
+        return bytes(self._data[text + start:text + end]).decode('utf-8', 'surrogatepass')
+
+    def _value(self, column, row):
+        kind = column[0]
+        if kind == 'null':
+            return None
+        if kind == 'json':
+            values = self._json_column(column)
+            _check(row < len(values), "column length")
+            return values[row]
+        offset = self._base + column[1] + _ITEMSIZE[kind] * row
+        if kind == 'str':
+            return self.string(_U32.unpack_from(self._data, offset)[0])
+        if kind == 'i64':
+            return _I64.unpack_from(self._data, offset)[0]
+        if kind == 'bool':
+            return bool(self._data[offset])
+        value = _F64.unpack_from(self._data, offset)[0]
+        if kind == 'num' and self._data[self._base + column[2] + row]:
+            return int(value)
+        return value
+
+    def _row(self, table, index):
+        if not 0 <= index < table['count']:
+            raise IndexError(index)
+        group_index = self._u32(table['group'], index)
+        _check(group_index < len(table['groups']), "row group")
+        group = table['groups'][group_index]
+        row = self._u32(table['row'], index)
+        _check(row < group['rows'], "row index")
+        return {key: self._value(column, row) for key, column in zip(group['keys'], group['columns'])}
+
+    def node(self, index):
+        """Node at a position of the nodes list, as a new dict"""
+        return self._row(self._nodes, index)
+
+    def edge(self, index):
+        """Edge at a position of the edges list, as a new dict"""
+        return self._row(self._edges, index)
+
+    def find(self, node_id):
+        """Node with an id (None if absent); the first call indexes the id column"""
+        if self._node_pos is None:
+            strings = self._string_list()
+            ids = [list(self._column(group['columns'][group['keys'].index('id')], group['rows'], strings))
+                   if 'id' in group['keys'] else [None] * group['rows']
+                   for group in self._nodes['groups']]
+            node_pos = {}
+            try:
+                for pos, (group, row) in enumerate(zip(self._array('str', self._nodes['group'], self.node_count),
+                                                       self._array('str', self._nodes['row'], self.node_count))):
+                    node_pos.setdefault(ids[group][row], pos)
+            except (IndexError, TypeError):
+                raise ValueError("tree file is damaged: row index")
+            self._node_pos = node_pos
+        pos = self._node_pos.get(node_id)
+        return None if pos is None else self.node(pos)
+
+    def photo(self, photo_hash):
+        """Original bytes of a photo kept in the file (None if not kept)"""
+        entry = self._photos.get(photo_hash)
+        if entry is None:
+            return None
+        start = self._base + entry[0]
+        return bytes(self._data[start:start + entry[1]])
+
+    def _array(self, kind, offset, count):
+        start = self._base + offset
+        values = array(_TYPECODE[kind])
+        values.frombytes(self._data[start:start + _ITEMSIZE[kind] * count])
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values.byteswap()
+        return values
+
+    def _string_list(self):
+        """All strings, by index"""
+        start = self._base + self._strings['text']
+        text = bytes(self._data[start:start + self._strings['bytes']])
+        if self._strings['count'] == 0:
+            return [None]
+        if self._strings['split']:
+            strings = [None] + text.decode('utf-8', 'surrogatepass').split('\0')
+        else:
+            offsets = self._array('str', self._strings['offsets'], self._strings['count'] + 1)
+            strings = [None] + [text[begin:end - 1].decode('utf-8', 'surrogatepass')
+                                for begin, end in zip(offsets, offsets[1:])]
+        _check(len(strings) == self._strings['count'] + 1, "string count")
+        return strings
+
+    def _json_column(self, column):
+        values = self._json_columns.get(column[1])
+        if values is None:
+            start = self._base + column[1]
+            values = json.loads(bytes(self._data[start:start + column[2]]))
+            _check(isinstance(values, list), "column")
+            self._json_columns[column[1]] = values
+        return values
+
+    def _column(self, column, rows, strings):
+        """A column's values, decoded as they are iterated"""
+        kind = column[0]
+        if kind == 'null':
+            return itertools.repeat(None, rows)
+        if kind == 'json':
+            values = self._json_column(column)
+            _check(len(values) == rows, "column length")
+            return values
+        values = self._array(kind, column[1], rows)
+        if kind == 'str':
+            _check(not values or max(values) < len(strings), "string index")
+            return map(strings.__getitem__, values)
+        if kind == 'bool':
+            return map(bool, values)
+        if kind == 'num':
+            values = values.tolist()
+            for row in itertools.compress(range(rows), self._array('bool', column[2], rows)):
+                values[row] = int(values[row])
+        return values
+
+    def _table(self, table, strings):
+        groups = []
+        for group in table['groups']:
+            # Built a column at a time rather than a row at a time, which
+            # takes about half as long: every row starts as a copy of one
+            # dict holding the group's keys (None, as null columns stay),
+            # then each column is set across all rows
+            rows = list(map(dict.copy, itertools.repeat(dict.fromkeys(group['keys']), group['rows'])))
+            for key, column in zip(group['keys'], group['columns']):
+                if column[0] != 'null':
+                    deque(map(operator.setitem, rows, itertools.repeat(key), self._column(column, group['rows'], strings)), 0)
+            groups.append(iter(rows))
+        if len(groups) == 1:
+            return list(groups[0])
+        # Back into list order: the next row of each one's group
+        group_of = self._array('str', table['group'], table['count'])
+        _check(all(group_of.count(i) == group['rows'] for i, group in enumerate(table['groups'])), "row groups")
+        return list(map(next, map(groups.__getitem__, group_of)))
+
+    def to_dict(self):
+        """The whole tree as a plain dict, as written"""
+        strings = self._string_list()
+        tree_data = dict(self.meta)
+        tree_data['nodes'] = self._table(self._nodes, strings)
+        tree_data['edges'] = self._table(self._edges, strings)
+        return tree_data
+
+    def to_tree(self):
+        return FamilyTree(self.to_dict())
+
+    def restore_photos(self):
+        """Store photos kept in the file that the photo store does not have; returns how many"""
+        restored = 0
+        for photo_hash in self._photos:
+            if not has_photo(photo_hash):
+                store_photo(self.photo(photo_hash))
+                restored += 1
+        return restored
+
+
+def open_tree(source):
+    """TreeFile of a path (memory-mapped) or of file bytes"""
+    return TreeFile(source)
+
+
+def load_tree(source):
+    """
+    Read a whole tree file (path or bytes) as a FamilyTree. Photos it
+    carries that the photo store does not have are put back there.
+    """
+    with TreeFile(source) as tree_file:
+        tree_file.restore_photos()
+        return tree_file.to_tree()
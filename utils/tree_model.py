@@ -0,0 +1,435 @@
+import bisect
+import hashlib
+import itertools
+
+
+class FamilyTree(dict):
+    """
+    Tree dict ({'nodes': [...], 'edges': [...]}) with lookup indexes.
+
+    It is still a plain dict to everything else (json.dump, session state,
+    exporters), but keeps id -> node, source -> edges, target -> edges,
+    junction -> parents and family -> ordered children indexes current when
+    mutated through its methods, so single edits cost O(degree) instead of
+    a scan over the whole tree. It also keeps the people a layout starts
+    from (root_ids()).
+
+    Removing a node or edge keeps the order of the rest, as saves, exports
+    and layouts see it. Each node and edge is numbered by a slot that only
+    goes up, and removed slots are kept in a short sorted gap list, so a
+    position is its slot minus the gaps before it. The slots are
+    renumbered once the gaps pile up, which keeps a removal amortised
+    O(log gaps) plus one list deletion.
+
+    layout_pending is set when an edit left positions for a full layout to
+    settle (see components.layout_manager.settle_layout); layout_units
+    holds the family units of the last layout, for re-laying out single
+    families after edits. Neither is saved. After watch_links() the ids of
+    nodes added, removed or relinked are collected for take_relinked(),
+    which is how the layout tells which of its units an edit touched.
+
+    revision goes up with every change: the mutation methods bump it, and
+    edits made to node dicts in place (fields, positions) are reported
+    with mark_changed(). version pairs it with an id unique to this tree
+    object, so in-process caches can key on it across imports.
+    structure_hash covers ids, HASHED_FIELDS and edges but not positions
+    or order. It is built from blake2b digests, so equal trees hash equal
+    in any process and it can key caches on disk or shared between
+    sessions; it is computed on first use and kept incrementally after.
+
+    After start_journal() every mutation is also recorded, in order, for
+    take_journal() (see utils.storage_handler, which appends them to a log
+    instead of rewriting the whole tree on each save). storage_token names
+    the save this tree was loaded from or last written as, so a save over
+    someone else's newer one is refused rather than overwriting it.
+    """
+
+    # Node fields in structure_hash; x / y / level / fixed are layout
+    HASHED_FIELDS = ('id', 'type', 'name', 'birth_date', 'death_date', 'photo_hash')
+
+    _instances = itertools.count(1)
+
+    def __init__(self, data=None):
+        super().__init__(data or {})
+        self.setdefault('nodes', [])
+        self.setdefault('edges', [])
+        self.layout_pending = False
+        self.layout_units = None
+        self._relinked = None
+        self.uid = next(FamilyTree._instances)
+        self.revision = 0
+        self._journal = None
+        self.storage_token = None
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild every index from the current node and edge lists"""
+        self._nodes_list = self['nodes']
+        self._edges_list = self['edges']
+        self._nodes_by_id = {}
+        self._node_slot = {}
+        self._edge_slot = {}
+        self._node_gaps = []
+        self._edge_gaps = []
+        self._out_edges = {}
+        self._in_edges = {}
+        self._junction_parents = {}
+        self._children = {}
+        self._roots = set()
+        # None until structure_hash is first asked for
+        self._node_hashes = None
+        self._structure_hash = 0
+        # Everything may have changed: whoever watched links has to start over
+        self._relinked = None
+
+        for pos, node in enumerate(self._nodes_list):
+            self._nodes_by_id[node['id']] = node
+            self._node_slot[node['id']] = pos
+
+        for pos, edge in enumerate(self._edges_list):
+            self._index_edge(edge, pos)
+
+        for node in self._nodes_list:
+            self._update_root(node['id'])
+
+        self._journal_full = True
+
+    def sync(self):
+        """Reindex if the lists were replaced or resized behind our back"""
+        if (self.get('nodes') is not self._nodes_list
+                or self.get('edges') is not self._edges_list
+                or len(self._nodes_list) != len(self._node_slot)
+                or len(self._edges_list) != len(self._edge_slot)):
+            self.setdefault('nodes', [])
+            self.setdefault('edges', [])
+            self.reindex()
+            self.revision += 1
+
+    # ---------- Lookups ----------
+
+    def node(self, node_id):
+        """Return node dict by id (or None)"""
+        return self._nodes_by_id.get(node_id)
+
+    def position(self, node_id):
+        """Index of a node in the nodes list"""
+        slot = self._node_slot.get(node_id)
+        return None if slot is None else slot - bisect.bisect_left(self._node_gaps, slot)
+
+    def edges_from(self, node_id):
+        """Edges whose source is node_id"""
+        return self._out_edges.get(node_id, [])
+
+    def edges_to(self, node_id):
+        """Edges whose target is node_id"""
+        return self._in_edges.get(node_id, [])
+
+    def edges_of(self, node_id):
+        """All edges touching node_id, in either direction"""
+        return self.edges_from(node_id) + self.edges_to(node_id)
+
+    def junction_parents(self, junction_id):
+        """Ids of the parents joined by a junction"""
+        return self._junction_parents.get(junction_id, [])
+
+    def children_of(self, family_id):
+        """Ids of the children linked to a parent or junction, in the order they were added"""
+        return self._children.get(family_id, [])
+
+    def edge_position(self, edge):
+        """Index of an edge in the edges list"""
+        slot = self._edge_slot.get(id(edge))
+        return None if slot is None else slot - bisect.bisect_left(self._edge_gaps, slot)
+
+    def parent_link(self, child_id):
+        """First child_to_parent edge of a child (target is parent or junction)"""
+        return next((e for e in self.edges_from(child_id)
+                     if e.get('type') == 'child_to_parent'), None)
+
+    def root_ids(self):
+        """
+        Ids of people with no parent link, or whose parent link goes to a
+        junction with no parents left, in node order
+        """
+        return sorted(self._roots, key=self._node_slot.__getitem__)
+
+    @property
+    def version(self):
+        """(tree id, revision): changes whenever the tree does"""
+        return (self.uid, self.revision)
+
+    @property
+    def structure_hash(self):
+        """Hash of people, junctions and edges, ignoring positions and order"""
+        if self._node_hashes is None:
+            self._node_hashes = {}
+            for node in self._nodes_list:
+                self._hash_node(node)
+            for edge in self._edges_list:
+                self._structure_hash = (self._structure_hash + _edge_hash(edge)) & _HASH_MASK
+        return self._structure_hash
+
+    def next_id(self, prefix):
+        """Unused id in the usual '<prefix>_<n>' format"""
+        n = len(self._nodes_list)
+        while f"{prefix}_{n}" in self._nodes_by_id:
+            n += 1
+        return f"{prefix}_{n}"
+
+    # ---------- Mutations ----------
+
+    def add_node(self, node):
+        """Append node dict"""
+        self._node_slot[node['id']] = len(self._nodes_list) + len(self._node_gaps)
+        self._nodes_by_id[node['id']] = node
+        self._nodes_list.append(node)
+        self._hash_node(node)
+        self._update_root(node['id'])
+        for child_id in self._children.get(node['id'], []):
+            self._update_root(child_id)
+        self.revision += 1
+        self._relink(node['id'])
+        self._record('n+', node)
+        return node
+
+    def remove_node(self, node_id):
+        """Remove node and every edge touching it"""
+        node = self._nodes_by_id.pop(node_id, None)
+        if node is None:
+            return None
+
+        for edge in self.edges_of(node_id):
+            self.remove_edge(edge)
+
+        slot = self._node_slot.pop(node_id)
+        del self._nodes_list[slot - bisect.bisect_left(self._node_gaps, slot)]
+        bisect.insort(self._node_gaps, slot)
+        if len(self._node_gaps) > _max_gaps(self._nodes_list):
+            self._node_gaps = []
+            for pos, other in enumerate(self._nodes_list):
+                self._node_slot[other['id']] = pos
+
+        self._out_edges.pop(node_id, None)
+        self._in_edges.pop(node_id, None)
+        self._junction_parents.pop(node_id, None)
+        self._children.pop(node_id, None)
+        self._roots.discard(node_id)
+        self._unhash_node(node_id)
+        self.revision += 1
+        self._relink(node_id)
+        self._record('n-', node_id)
+        return node
+
+    def add_edge(self, source, target, edge_type):
+        """Append edge and return it"""
+        edge = {
+            'source': source,
+            'target': target,
+            'type': edge_type
+        }
+        self._index_edge(edge, len(self._edges_list) + len(self._edge_gaps))
+        self._edges_list.append(edge)
+        self.revision += 1
+        self._relink(source, target)
+        self._record('e+', source, target, edge_type)
+        return edge
+
+    def remove_edge(self, edge):
+        """Remove an edge dict previously returned by a lookup"""
+        slot = self._edge_slot.pop(id(edge), None)
+        if slot is None:
+            return
+
+        self._unindex_edge(edge)
+
+        pos = slot - bisect.bisect_left(self._edge_gaps, slot)
+        del self._edges_list[pos]
+        bisect.insort(self._edge_gaps, slot)
+        if len(self._edge_gaps) > _max_gaps(self._edges_list):
+            self._edge_gaps = []
+            for other_pos, other in enumerate(self._edges_list):
+                self._edge_slot[id(other)] = other_pos
+        self.revision += 1
+        self._relink(edge['source'], edge['target'])
+        self._record('e-', pos)
+
+    def set_edge_target(self, edge, target):
+        """Point an existing edge at a new target"""
+        self._unindex_edge(edge)
+        self._relink(edge['source'], edge['target'], target)
+        edge['target'] = target
+        self._index_edge(edge, self._edge_slot[id(edge)])
+        self.revision += 1
+        self._record('et', self.edge_position(edge), target)
+
+    # ---------- Change tracking ----------
+
+    def mark_changed(self, node_ids=(), reason='edit'):
+        """
+        Report changes made to node dicts in place. reason is 'edit',
+        'layout', 'collapse', 'import' or similar; node_ids are re-hashed
+        unless the reason is 'layout', which only moves nodes.
+        """
+        for node_id in node_ids:
+            node = self._nodes_by_id.get(node_id)
+            if node is not None:
+                if reason != 'layout':
+                    self._unhash_node(node_id)
+                    self._hash_node(node)
+                self._record('n', node)
+        if not node_ids:
+            # Not tied to particular nodes: anything may have changed
+            self._journal_full = True
+        self.revision += 1
+
+    def start_journal(self):
+        """Record mutations from now on; the first take_journal() returns None"""
+        self._journal = []
+        self._journal_full = True
+
+    def take_journal(self):
+        """
+        Mutations since the last call, oldest first, and clear them:
+        ('n+', node) added, ('n', node) changed in place, ('n-', id)
+        removed, ('e+', source, target, type) added, ('e-', position)
+        removed and ('et', position, target) retargeted. Node entries hold
+        the node dict itself, so they read its fields as they are now.
+        Returns None when the whole tree has to be written out instead
+        (journal just started, lists replaced, change without node ids)
+        or when no journal was started.
+        """
+        if self._journal is None:
+            return None
+        journal, full = self._journal, self._journal_full
+        self._journal = []
+        self._journal_full = False
+        return None if full else journal
+
+    def watch_links(self):
+        """Collect the ids of nodes added, removed or relinked from now on, for take_relinked()"""
+        self._relinked = set()
+
+    def take_relinked(self):
+        """
+        Ids of the nodes added or removed, or with an edge added, removed
+        or retargeted, since the last call or watch_links(), and clear
+        them. Returns None if links are not watched, or stopped being
+        watched because the lists were replaced.
+        """
+        relinked = self._relinked
+        if relinked is not None:
+            self._relinked = set()
+        return relinked
+
+    # ---------- Internals ----------
+
+    def _record(self, *entry):
+        if self._journal is not None and not self._journal_full:
+            self._journal.append(entry)
+
+    def _relink(self, *node_ids):
+        if self._relinked is not None:
+            self._relinked.update(node_ids)
+
+    def _hash_node(self, node):
+        if self._node_hashes is None:
+            return
+        node_hash = _digest(tuple(node.get(field) for field in self.HASHED_FIELDS))
+        self._node_hashes[node['id']] = node_hash
+        self._structure_hash = (self._structure_hash + node_hash) & _HASH_MASK
+
+    def _unhash_node(self, node_id):
+        if self._node_hashes is None:
+            return
+        node_hash = self._node_hashes.pop(node_id, 0)
+        self._structure_hash = (self._structure_hash - node_hash) & _HASH_MASK
+
+    def _index_edge(self, edge, slot):
+        # Hashes are summed, not xor-ed, so duplicate edges do not cancel out
+        if self._node_hashes is not None:
+            self._structure_hash = (self._structure_hash + _edge_hash(edge)) & _HASH_MASK
+        self._edge_slot[id(edge)] = slot
+        self._out_edges.setdefault(edge['source'], []).append(edge)
+        self._in_edges.setdefault(edge['target'], []).append(edge)
+        if edge.get('type') == 'parent_to_junction':
+            self._junction_parents.setdefault(edge['target'], []).append(edge['source'])
+            for child_id in self._children.get(edge['target'], []):
+                self._update_root(child_id)
+        elif edge.get('type') == 'child_to_parent':
+            self._children.setdefault(edge['target'], []).append(edge['source'])
+            self._update_root(edge['source'])
+
+    def _unindex_edge(self, edge):
+        if self._node_hashes is not None:
+            self._structure_hash = (self._structure_hash - _edge_hash(edge)) & _HASH_MASK
+        _discard(self._out_edges.get(edge['source'], []), edge)
+        _discard(self._in_edges.get(edge['target'], []), edge)
+        if edge.get('type') == 'parent_to_junction':
+            parents = self._junction_parents.get(edge['target'], [])
+            if edge['source'] in parents:
+                parents.remove(edge['source'])
+            for child_id in self._children.get(edge['target'], []):
+                self._update_root(child_id)
+        elif edge.get('type') == 'child_to_parent':
+            children = self._children.get(edge['target'], [])
+            if edge['source'] in children:
+                children.remove(edge['source'])
+            self._update_root(edge['source'])
+
+    def _update_root(self, node_id):
+        node = self._nodes_by_id.get(node_id)
+        is_root = False
+        if node is not None and node.get('type') == 'person':
+            link = self.parent_link(node_id)
+            family = self._nodes_by_id.get(link['target']) if link else None
+            is_root = family is None or (family.get('type') == 'junction'
+                                         and not self._junction_parents.get(family['id']))
+        if is_root:
+            self._roots.add(node_id)
+        else:
+            self._roots.discard(node_id)
+
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def _max_gaps(items):
+    # Renumbering costs O(len(items)), so let the gaps grow with the list
+    return max(64, len(items) // 64)
+
+
+def _digest(values):
+    """64-bit blake2b of a tuple's repr: unlike hash(), the same in every process"""
+    return int.from_bytes(hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _edge_hash(edge):
+    return _digest((edge['source'], edge['target'], edge.get('type')))
+
+
+def _discard(items, item):
+    """Remove item from list by identity (edge dicts may compare equal)"""
+    for i, candidate in enumerate(items):
+        if candidate is item:
+            del items[i]
+            return
+
+
+def as_tree(tree_data):
+    """
+    Return an indexed FamilyTree for tree_data.
+    A FamilyTree is synced and returned as-is; a plain dict gets a wrapper
+    sharing its node and edge lists, so mutations show up in both.
+    """
+    if isinstance(tree_data, FamilyTree):
+        tree_data.sync()
+        return tree_data
+    tree_data.setdefault('nodes', [])
+    tree_data.setdefault('edges', [])
+    return FamilyTree(tree_data)
+
+
+def mark_changed(tree_data, node_ids=(), reason='edit'):
+    """FamilyTree.mark_changed for any tree dict; a plain dict keeps no revision"""
+    if isinstance(tree_data, FamilyTree):
+        tree_data.mark_changed(node_ids, reason)